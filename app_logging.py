@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+非阻塞的日志输出
+请求线程只把日志记录放进内存队列，由后台线程写入 app.log 和控制台，请求线程从不等待日志 I/O
+
+- 队列有上限，写满时直接丢弃新记录并计数，写入线程在下一次输出时补记一条"丢弃了多少条"的警告
+- 热点路径（CDN 缓存命中、缓存写入等）的日志按事件采样：每 N 次只记录 1 次，被采样掉的次数单独计数
+- 输出格式可以是 JSON（每行一个对象，便于检索和回放）或传统的文本格式
+- fork 出的子进程（gunicorn 预加载时的 worker）会重建队列并启动自己的写入线程
+"""
+
+import atexit
+import copy
+import datetime
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+_exception_formatter = logging.Formatter()
+
+
+def parse_sample_rates(spec):
+    """解析 "事件=N,事件=N" 形式的采样配置，N 表示每 N 次记录 1 次"""
+    rates = {}
+    for item in (spec or '').split(','):
+        event, _, rate = item.strip().partition('=')
+        if event and rate.strip().isdigit():
+            rates[event] = max(1, int(rate))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为一行 JSON"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key in ('event', 'sample_rate', 'dropped'):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列写满时丢弃记录而不是阻塞调用线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 调用线程只把消息参数和异常堆栈转成字符串（参数对象之后可能被修改），按格式输出留给写入线程
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # 计数不加锁：并发丢弃时可能少计，作为统计数据可以接受
+            self.dropped += 1
+
+
+class DropReportingListener(logging.handlers.QueueListener):
+    """写入线程：输出记录，并在发现有记录被丢弃时补记一条警告"""
+
+    def __init__(self, log_queue, queue_handler, *handlers):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self.reported_dropped = 0
+
+    def enqueue_sentinel(self):
+        # 停止时队列可能是满的，等待写入线程腾出位置，保证剩余日志都被写出
+        self.queue.put(self._sentinel)
+
+    def handle(self, record):
+        dropped = self.queue_handler.dropped
+        if dropped > self.reported_dropped:
+            warning = logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                '日志队列已满，丢弃了 %d 条日志', (dropped - self.reported_dropped,), None
+            )
+            warning.dropped = dropped - self.reported_dropped
+            self.reported_dropped = dropped
+            super().handle(warning)
+        super().handle(record)
+
+
+class QueueLogging:
+    """管理日志队列、写入线程和采样计数"""
+
+    def __init__(self):
+        self.queue_size = 0
+        self.handlers = []
+        self.queue_handler = None
+        self.listener = None
+        self.sample_rates = {}
+        self.sample_counters = {}
+        self.sampled_out = {}
+        self._lock = threading.Lock()
+
+    def install(self, handlers, queue_size=10000, sample_rates=None, level=logging.INFO, logger=None):
+        """把日志记录器（默认为根记录器）的输出改为经过队列，由后台线程写入 handlers；重复调用不会重复安装"""
+        with self._lock:
+            if self.queue_handler is not None:
+                return
+            self.queue_size = queue_size
+            self.handlers = handlers
+            self.sample_rates = dict(sample_rates or {})
+            self.sample_counters = {event: itertools.count() for event in self.sample_rates}
+            self.sampled_out = {event: 0 for event in self.sample_rates}
+            self._start()
+            logger = logger or logging.getLogger()
+            logger.setLevel(level)
+            logger.addHandler(self.queue_handler)
+            atexit.register(self.stop)
+            if hasattr(os, 'register_at_fork'):
+                os.register_at_fork(after_in_child=self.after_fork_in_child)
+
+    def _start(self):
+        log_queue = queue.Queue(self.queue_size)
+        if self.queue_handler is None:
+            self.queue_handler = DroppingQueueHandler(log_queue)
+        else:
+            self.queue_handler.queue = log_queue
+        self.listener = DropReportingListener(log_queue, self.queue_handler, *self.handlers)
+        self.listener.start()
+
+    def stop(self):
+        """写完队列中剩余的日志并停止写入线程"""
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+
+    def after_fork_in_child(self):
+        """子进程没有父进程的写入线程，重建队列（父进程的队列锁可能处于持有状态）并启动新的线程"""
+        if self.listener is None:
+            return
+        self.listener = None
+        self._start()
+        self.listener.reported_dropped = self.queue_handler.dropped
+
+    def should_log(self, event):
+        """
+        热点路径在记录日志之前调用：按事件的采样率决定这一次是否记录，未配置采样率的事件总是记录
+        采样掉的记录不会创建 LogRecord，也不进入队列
+        """
+        counter = self.sample_counters.get(event)
+        if counter is None:
+            return True
+        rate = self.sample_rates[event]
+        if next(counter) % rate == 0:
+            return True
+        # 与丢弃计数一样不加锁，并发时可能少计
+        self.sampled_out[event] += 1
+        return False
+
+    def extra(self, event):
+        """随日志记录输出的事件名和采样率（按采样率放大即可估算真实次数）"""
+        return {'event': event, 'sample_rate': self.sample_rates.get(event, 1)}
+
+    def stats(self):
+        handler = self.queue_handler
+        return {
+            'enabled': handler is not None,
+            'writer_alive': bool(self.listener and self.listener._thread and self.listener._thread.is_alive()),
+            'queued': handler.queue.qsize() if handler else 0,
+            'queue_size': self.queue_size,
+            'dropped': handler.dropped if handler else 0,
+            'sample_rates': dict(self.sample_rates),
+            'sampled_out': dict(self.sampled_out),
+        }
+
+
+queue_logging = QueueLogging()
+
+
+def setup_logging(log_file='app.log', log_format='json', queue_size=10000, sample_rates=None):
+    """
+    配置根日志记录器：日志经过队列由后台线程写入 log_file 和控制台
+    log_format 为 'json' 时每行一个 JSON 对象，否则使用传统文本格式
+    """
+    formatter = JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.FileHandler(log_file), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    queue_logging.install(handlers, queue_size=queue_size, sample_rates=sample_rates)
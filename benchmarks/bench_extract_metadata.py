@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTML 元数据提取基准测试
+对比流式提取器 extract_html_metadata 与原先基于 BeautifulSoup 的实现
+
+用法:
+    python benchmarks/bench_extract_metadata.py [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+
+from main import extract_html_metadata
+
+
+def extract_html_metadata_bs4(html_content):
+    """
+    原先的实现：用 BeautifulSoup 构建完整文档树后提取元数据
+    作为流式提取器的对照基准和正确性参考
+    """
+    try:
+        soup = BeautifulSoup(html_content, 'html.parser')
+
+        # 提取标题
+        title = None
+        if soup.title:
+            title = soup.title.string.strip()
+        elif soup.find('h1'):
+            title = soup.find('h1').get_text().strip()
+
+        # 提取描述
+        description = None
+        meta_desc = soup.find('meta', attrs={'name': 'description'})
+        if meta_desc:
+            description = meta_desc.get('content', '').strip()
+        elif soup.find('p'):
+            # 取第一个段落作为描述，限制长度
+            first_p = soup.find('p').get_text().strip()
+            description = first_p[:100] + '...' if len(first_p) > 100 else first_p
+
+        return {
+            'title': title or '未命名项目',
+            'description': description or '暂无描述'
+        }
+    except Exception:
+        return {
+            'title': '未命名项目',
+            'description': '暂无描述'
+        }
+
+
+CARD = (
+    '<div class="card"><h2>Item</h2>'
+    '<p>Lorem ipsum <b>dolor</b> sit amet &amp; consectetur.</p>'
+    '<script>var label = "<p>";</script></div>\n'
+)
+
+
+def build_document(size, with_meta=True, trailing_meta=False):
+    """
+    生成指定大小的测试文档
+    with_meta: <head> 中是否带 description meta
+    trailing_meta: 在文档末尾放一个无关的 meta，迫使流式提取器解析完整文档（最坏情况）
+    """
+    head = '<meta charset="utf-8"><title>Benchmark page</title>'
+    if with_meta:
+        head += '<meta name="description" content="Benchmark description">'
+    prefix = f'<!DOCTYPE html><html><head>{head}</head><body><h1>Heading</h1><p>First paragraph</p>'
+    suffix = '<meta name="generator" content="bench"></body></html>' if trailing_meta else '</body></html>'
+    body = CARD * max(0, (size - len(prefix) - len(suffix)) // len(CARD))
+    return prefix + body + suffix
+
+
+CASES = [
+    ('small (2KB)', build_document(2 * 1024)),
+    ('1MB, meta 在 head', build_document(1024 * 1024)),
+    ('1MB, 无 meta', build_document(1024 * 1024, with_meta=False)),
+    ('1MB, 末尾有 meta (最坏情况)', build_document(1024 * 1024, with_meta=False, trailing_meta=True)),
+]
+
+
+def time_function(func, document, repeat):
+    """返回多次运行中的最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(document)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTML 元数据提取基准测试')
+    parser.add_argument('--repeat', type=int, default=5, help='每个用例重复次数，取最短耗时')
+    args = parser.parse_args()
+
+    print(f"{'用例':<28}{'BeautifulSoup':>16}{'流式提取':>14}{'加速比':>10}")
+    print('-' * 70)
+    for name, document in CASES:
+        # 两种实现的结果必须一致
+        assert extract_html_metadata(document) == extract_html_metadata_bs4(document), name
+
+        # 小文档耗时太短，多跑几轮
+        repeat = args.repeat * 100 if len(document) < 64 * 1024 else args.repeat
+        old_time = time_function(extract_html_metadata_bs4, document, repeat)
+        new_time = time_function(extract_html_metadata, document, repeat)
+        print(f"{name:<28}{old_time * 1000:>14.2f}ms{new_time * 1000:>12.2f}ms{old_time / new_time:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+main.py 冷启动导入耗时压测
+每轮在一个新的 Python 进程中导入 main，统计导入耗时、导入后的线程数，
+并用 -X importtime 列出累计耗时最多的顶层模块
+
+用法:
+    python benchmarks/bench_import.py [--runs 10] [--top 10] [--ref HEAD~1]
+
+--ref 指定一个 git 版本时，会把该版本导出到临时目录，与当前工作区对比
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = (
+    "import time, threading\n"
+    "start = time.perf_counter()\n"
+    "import main\n"
+    "elapsed = time.perf_counter() - start\n"
+    "time.sleep(0.1)  # flask-limiter 的内存存储会启动一个很快结束的过期定时器，不计入常驻线程\n"
+    "print(elapsed, threading.active_count())\n"
+)
+
+
+def run_probe(source_dir, work_dir, importtime=False):
+    """在新进程中导入 main，返回 (耗时秒数, 线程数, importtime 输出)"""
+    env = dict(os.environ, PYTHONPATH=source_dir, PREVIEW_DEFER_BACKGROUND_SERVICES='false',
+               PROJECT_INDEX_PATH=os.path.join(work_dir, 'project_index.db'))
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', PROBE]
+    result = subprocess.run(command, cwd=work_dir, env=env, capture_output=True, text=True, check=True)
+    seconds, threads = result.stdout.split()
+    return float(seconds), int(threads), result.stderr
+
+
+def top_modules(importtime_output, count):
+    """解析 -X importtime 输出，返回累计耗时最多的顶层模块"""
+    modules = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # 子模块先于父模块输出：遇到 main 之前的其它顶层模块（site 等）时丢弃已收集的条目
+        if not name.startswith('  '):
+            if name.strip() == 'main':
+                break
+            modules = []
+            continue
+        # 由 main 直接导入的模块缩进两个空格（前面还有一个分隔空格）
+        if not name.startswith('    '):
+            modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def bench(label, source_dir, runs, top):
+    work_dir = tempfile.mkdtemp(prefix='bench-import-')
+    try:
+        run_probe(source_dir, work_dir)  # 预热字节码缓存，只统计冷进程的导入本身
+        timings = []
+        for _ in range(runs):
+            seconds, threads, _ = run_probe(source_dir, work_dir)
+            timings.append(seconds * 1000)
+        _, _, importtime_output = run_probe(source_dir, work_dir, importtime=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"[{label}] 导入耗时: 中位数 {statistics.median(timings):.1f}ms, 最小 {min(timings):.1f}ms, "
+          f"最大 {max(timings):.1f}ms（{runs} 次），导入后线程数: {threads}")
+    for cumulative, name in top_modules(importtime_output, top):
+        print(f"    {cumulative / 1000:8.1f}ms  {name}")
+    return statistics.median(timings)
+
+
+def export_revision(ref):
+    """把指定 git 版本导出到临时目录"""
+    target = tempfile.mkdtemp(prefix='bench-import-ref-')
+    archive = subprocess.run(['git', 'archive', ref], cwd=REPO_ROOT, capture_output=True, check=True)
+    subprocess.run(['tar', '-x', '-C', target], input=archive.stdout, check=True)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description='main.py 冷启动导入耗时压测')
+    parser.add_argument('--runs', type=int, default=10, help='每个版本的导入次数')
+    parser.add_argument('--top', type=int, default=10, help='列出累计耗时最多的顶层模块数')
+    parser.add_argument('--ref', help='对比的 git 版本，例如 HEAD~1')
+    args = parser.parse_args()
+
+    current = bench('当前工作区', REPO_ROOT, args.runs, args.top)
+    if args.ref:
+        ref_dir = export_revision(args.ref)
+        try:
+            baseline = bench(args.ref, ref_dir, args.runs, args.top)
+        finally:
+            shutil.rmtree(ref_dir, ignore_errors=True)
+        print(f"\n相对 {args.ref}: {baseline:.1f}ms -> {current:.1f}ms（缩短 {(1 - current / baseline) * 100:.1f}%）")
+
+
+if __name__ == '__main__':
+    main()
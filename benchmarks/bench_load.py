@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+整体负载压测
+在临时目录中用 gunicorn.conf.py 启动服务，并启动一个本地的假 CDN 代替 CDN_DOMAINS 中的真实站点，
+多个客户端进程按配置的比例并发请求 /proxy、/upload、/static/<id>/index.html 和 /api/projects，
+统计各类请求的 p50/p95/p99 延迟、吞吐量、代理缓存命中率和服务进程的内存占用（RSS）
+
+假 CDN 以 HTTP 正向代理的方式接入：服务进程的 HTTP_PROXY 指向它，压测使用 http:// 的 CDN 地址，
+请求仍经过 /proxy 的域名校验和缓存逻辑，但不会访问外网。假 CDN 的延迟、响应大小和错误率都可以配置
+
+用法:
+    python benchmarks/bench_load.py [--duration 20] [--clients 4] [--client-threads 8]
+        [--mix proxy=50,static=30,projects=15,upload=5] [--cdn-latency-ms 50] [--cdn-error-rate 0.01]
+        [--json results.json] [--compare baseline.json]
+
+--json 把配置和结果写成 JSON（- 表示标准输出），--compare 读取之前的 JSON 结果并列出变化，
+可用于比较不同版本或配置（worker 数用 --workers 指定，其它配置如 SHARED_CACHE_ENABLED 通过环境变量传给服务进程）
+"""
+
+import argparse
+import http.client
+import http.server
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+
+from bench_workers import free_port
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CDN_HOST = 'cdn.jsdelivr.net'
+OPERATIONS = ('proxy', 'static', 'projects', 'upload')
+RSS_SAMPLE_INTERVAL = 0.5
+
+
+def parse_mix(spec):
+    """解析 "proxy=50,static=30" 形式的请求比例"""
+    weights = {}
+    for item in spec.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'未知的请求类型: {name}')
+        weights[name] = float(weight or 0)
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError('请求比例不能全为 0')
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class FakeCDNHandler(http.server.BaseHTTPRequestHandler):
+    """
+    假 CDN：作为 HTTP 正向代理接收绝对地址的请求
+    config['assets'] 中有记录的地址按记录的大小和类型响应（回放日志时使用），
+    其它地址的响应大小由 URL 决定（同一地址每次返回相同内容），按配置的延迟和错误率响应
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        config = self.server.config
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(random.uniform(0, 2 * config['latency']) if config['jitter'] else config['latency'])
+        if random.random() < config['error_rate']:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        path = urllib.parse.urlsplit(self.path).path
+        asset = config.get('assets', {}).get(self.path)
+        if asset:
+            size, content_type = asset
+        else:
+            sizes = config['sizes']
+            size = sizes[zlib.crc32(path.encode('utf-8')) % len(sizes)]
+            content_type = 'text/css' if path.endswith('.css') else 'application/javascript'
+        body = (f'/* {path} */\n'.encode('utf-8') + b'x' * size)[:max(size, 1)]
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeCDNServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 服务进程关闭长连接时的连接重置不是错误
+        pass
+
+
+def fake_cdn_process(port, config, ready, stop, stats):
+    server = FakeCDNServer(('127.0.0.1', port), FakeCDNHandler)
+    server.config = config
+    server.lock = threading.Lock()
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    ready.set()
+    stop.wait()
+    server.shutdown()
+    stats.put({'requests': server.requests})
+
+
+def start_server(work_dir, port, cdn_port, workers, threads, extra_env=None):
+    """
+    启动 gunicorn，CDN 请求经 HTTP_PROXY 转发到假 CDN，等到可以响应请求后返回进程对象
+    extra_env 中的配置覆盖当前环境变量（例如 SHARED_CACHE_SIZE）
+    """
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        RATELIMIT_ENABLED='false',
+        # 多个 worker 需要相同的密钥，否则 CSRF 令牌只在签发它的 worker 上有效
+        SECRET_KEY=os.environ.get('SECRET_KEY', 'bench-load'),
+        PROJECT_INDEX_PATH=os.path.join(work_dir, 'project_index.db'),
+        METRICS_DIR=os.path.join(work_dir, 'metrics'),
+        HTTP_PROXY=f'http://127.0.0.1:{cdn_port}',
+        http_proxy=f'http://127.0.0.1:{cdn_port}',
+        NO_PROXY='', no_proxy='',
+    )
+    env.setdefault('SHARED_CACHE_PATH', os.path.join(work_dir, 'shared-cache'))
+    env.update(extra_env or {})
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_ROOT, 'gunicorn.conf.py'),
+         '--chdir', work_dir, '--pythonpath', REPO_ROOT, 'wsgi:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/csrf-token')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn 启动超时')
+
+
+def process_tree_rss(pid):
+    """返回进程及其所有子进程的 RSS 之和（字节），读取 /proc，其它平台返回 0"""
+    children = {}
+    total = 0
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class Client:
+    """一个客户端线程的长连接和会话（CSRF 令牌与 session cookie）"""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+        self.cookie = None
+        self.csrf_token = None
+
+    def request(self, method, path, body=None, headers=None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            raise
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response, data
+
+    def upload(self, html):
+        if self.csrf_token is None:
+            _, data = self.request('GET', '/api/csrf-token')
+            self.csrf_token = json.loads(data)['csrf_token']
+        body = urllib.parse.urlencode({'html_content': html})
+        return self.request('POST', '/upload', body=body, headers={
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'X-CSRFToken': self.csrf_token,
+        })
+
+
+def build_page(index, asset_urls):
+    links = ''.join(f'<script src="{url}"></script>' for url in asset_urls)
+    rows = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>' * 50
+    return (f'<!DOCTYPE html><html><head><title>bench {index}</title>'
+            f'<meta name="description" content="load test page {index}">{links}</head>'
+            f'<body>{rows}</body></html>')
+
+
+def asset_url(index):
+    return f'http://{CDN_HOST}/npm/bench-{index}/dist/bench.min.js'
+
+
+def seed_projects(port, count, asset_count):
+    """上传初始项目，返回项目ID列表"""
+    client = Client(port)
+    project_ids = []
+    for index in range(count):
+        urls = [asset_url((index + offset) % asset_count) for offset in range(3)]
+        response, data = client.upload(build_page(index, urls))
+        if response.status != 200:
+            raise RuntimeError(f'初始化项目失败: HTTP {response.status} {data[:200]!r}')
+        project_ids.append(json.loads(data)['project_id'])
+    return project_ids
+
+
+def client_process(port, weights, project_ids, asset_count, threads, duration, seed, results):
+    """一个客户端进程：多个线程按比例随机选择请求类型，汇总每类请求的延迟、状态码和代理缓存结果"""
+    deadline = time.time() + duration
+    lock = threading.Lock()
+    latencies = {name: [] for name in OPERATIONS}
+    statuses = {name: {} for name in OPERATIONS}
+    cache_statuses = {}
+    names = list(weights)
+    cumulative = list(itertools.accumulate(weights[name] for name in names))
+
+    def loop(thread_index):
+        rng = random.Random(seed * 1000 + thread_index)
+        client = Client(port)
+        local_latencies = {name: [] for name in OPERATIONS}
+        local_statuses = {name: {} for name in OPERATIONS}
+        local_cache = {}
+        counter = itertools.count()
+        while time.time() < deadline:
+            name = rng.choices(names, cum_weights=cumulative)[0]
+            # 资源的热度近似幂律分布：少数资源被频繁请求，长尾资源偶尔被请求
+            asset = min(int(rng.paretovariate(1.2)) - 1, asset_count - 1)
+            start = time.perf_counter()
+            try:
+                if name == 'proxy':
+                    quoted = urllib.parse.quote(asset_url(asset), safe='')
+                    response, _ = client.request('GET', f'/proxy?url={quoted}')
+                    cache_status = response.getheader('X-Cache-Status') or 'ERROR'
+                    local_cache[cache_status] = local_cache.get(cache_status, 0) + 1
+                elif name == 'static':
+                    project_id = project_ids[min(int(rng.paretovariate(1.2)) - 1, len(project_ids) - 1)]
+                    response, _ = client.request('GET', f'/static/{project_id}/index.html',
+                                                 headers={'Accept-Encoding': 'gzip'})
+                elif name == 'projects':
+                    response, _ = client.request('GET', f'/api/projects?page={rng.randint(1, 3)}')
+                else:
+                    unique = f'{seed}-{thread_index}-{next(counter)}'
+                    response, _ = client.upload(build_page(unique, [asset_url(asset)]))
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                status = 'error'
+            local_latencies[name].append(time.perf_counter() - start)
+            local_statuses[name][status] = local_statuses[name].get(status, 0) + 1
+        with lock:
+            for name in OPERATIONS:
+                latencies[name].extend(local_latencies[name])
+                for status, count in local_statuses[name].items():
+                    statuses[name][status] = statuses[name].get(status, 0) + count
+            for cache_status, count in local_cache.items():
+                cache_statuses[cache_status] = cache_statuses.get(cache_status, 0) + count
+
+    workers = [threading.Thread(target=loop, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put((latencies, statuses, cache_statuses))
+
+
+def run_load(port, args, project_ids):
+    """并发压测并在压测期间采样服务进程的 RSS，返回汇总结果"""
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [
+        context.Process(target=client_process, args=(
+            port, args.mix, project_ids, args.assets, args.client_threads, args.duration, index, results))
+        for index in range(args.clients)
+    ]
+    for process in processes:
+        process.start()
+
+    rss_samples = []
+    deadline = time.time() + args.duration
+    while time.time() < deadline:
+        rss_samples.append(process_tree_rss(args.server_pid))
+        time.sleep(RSS_SAMPLE_INTERVAL)
+
+    latencies = {name: [] for name in OPERATIONS}
+    statuses = {name: {} for name in OPERATIONS}
+    cache_statuses = {}
+    for _ in processes:
+        process_latencies, process_statuses, process_cache = results.get()
+        for name in OPERATIONS:
+            latencies[name].extend(process_latencies[name])
+            for status, count in process_statuses[name].items():
+                statuses[name][str(status)] = statuses[name].get(str(status), 0) + count
+        for cache_status, count in process_cache.items():
+            cache_statuses[cache_status] = cache_statuses.get(cache_status, 0) + count
+    for process in processes:
+        process.join()
+    rss_samples.append(process_tree_rss(args.server_pid))
+
+    operations = {}
+    for name in OPERATIONS:
+        values = sorted(latencies[name])
+        if not values:
+            continue
+        errors = sum(count for status, count in statuses[name].items() if not status.startswith('2'))
+        operations[name] = {
+            'requests': len(values),
+            'errors': errors,
+            'rps': len(values) / args.duration,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'max_ms': values[-1] * 1000,
+            'statuses': statuses[name],
+        }
+
+    all_latencies = sorted(itertools.chain.from_iterable(latencies.values()))
+    proxied = sum(cache_statuses.values())
+    hits = sum(count for status, count in cache_statuses.items() if status.startswith('HIT'))
+    return {
+        'operations': operations,
+        'total': {
+            'requests': len(all_latencies),
+            'errors': sum(item['errors'] for item in operations.values()),
+            'rps': len(all_latencies) / args.duration,
+            'p50_ms': percentile(all_latencies, 0.50) * 1000,
+            'p95_ms': percentile(all_latencies, 0.95) * 1000,
+            'p99_ms': percentile(all_latencies, 0.99) * 1000,
+        },
+        'proxy_cache': {
+            'statuses': cache_statuses,
+            'hit_ratio': hits / proxied if proxied else None,
+        },
+        'rss_bytes': {
+            'peak': max(rss_samples),
+            'final': rss_samples[-1],
+        },
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result):
+    print(f"{'请求类型':<10}{'请求数':>8}{'错误':>7}{'req/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}")
+    print('-' * 64)
+    rows = list(result['operations'].items()) + [('total', result['total'])]
+    for name, item in rows:
+        print(f"{name:<12}{item['requests']:>8}{item['errors']:>7}{item['rps']:>9.1f}"
+              f"{item['p50_ms']:>8.1f}ms{item['p95_ms']:>8.1f}ms{item['p99_ms']:>8.1f}ms")
+    cache = result['proxy_cache']
+    if cache['hit_ratio'] is not None:
+        details = ', '.join(f'{status}={count}' for status, count in sorted(cache['statuses'].items()))
+        print(f"\n代理缓存命中率: {cache['hit_ratio'] * 100:.1f}%（{details}），假 CDN 收到请求: {result['cdn_requests']}")
+    rss = result['rss_bytes']
+    print(f"服务进程 RSS: 峰值 {rss['peak'] / 1024 / 1024:.1f}MB, 结束时 {rss['final'] / 1024 / 1024:.1f}MB")
+
+
+def print_comparison(baseline, current, file=sys.stdout):
+    """与之前保存的 JSON 结果对比吞吐量和尾延迟"""
+    print(f"\n相对基线（{baseline.get('revision')}, {baseline.get('timestamp')}）:", file=file)
+    for name in list(current['operations']) + ['total']:
+        old = baseline['total'] if name == 'total' else baseline.get('operations', {}).get(name)
+        new = current['total'] if name == 'total' else current['operations'][name]
+        if not old:
+            continue
+        changes = []
+        for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if old[key]:
+                changes.append(f"{key} {old[key]:.1f} -> {new[key]:.1f} ({(new[key] / old[key] - 1) * 100:+.1f}%)")
+        print(f"  {name:<10}" + ', '.join(changes), file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='整体负载压测（本地假 CDN）')
+    parser.add_argument('--duration', type=float, default=20, help='压测时长（秒）')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker 数量')
+    parser.add_argument('--threads', type=int, default=8, help='每个 worker 的线程数')
+    parser.add_argument('--clients', type=int, default=4, help='客户端进程数')
+    parser.add_argument('--client-threads', type=int, default=8, help='每个客户端进程的并发连接数')
+    parser.add_argument('--mix', type=parse_mix, default='proxy=50,static=30,projects=15,upload=5',
+                        help='各类请求的比例')
+    parser.add_argument('--projects', type=int, default=50, help='压测前上传的项目数')
+    parser.add_argument('--assets', type=int, default=200, help='CDN 资源地址的数量')
+    parser.add_argument('--cdn-latency-ms', type=float, default=50, help='假 CDN 的平均响应延迟（毫秒）')
+    parser.add_argument('--cdn-jitter', action='store_true', help='延迟在 0 到 2 倍平均值之间均匀分布')
+    parser.add_argument('--cdn-sizes', default='2048,16384,131072', help='逗号分隔的响应大小（字节），按地址选取')
+    parser.add_argument('--cdn-error-rate', type=float, default=0.0, help='假 CDN 返回 503 的比例')
+    parser.add_argument('--json', help='把配置和结果写入 JSON 文件，- 表示标准输出')
+    parser.add_argument('--compare', help='之前用 --json 保存的结果，用于对比')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('fork')
+    cdn_port = free_port()
+    cdn_config = {
+        'latency': args.cdn_latency_ms / 1000,
+        'jitter': args.cdn_jitter,
+        'sizes': [int(size) for size in args.cdn_sizes.split(',')],
+        'error_rate': args.cdn_error_rate,
+    }
+    cdn_ready, cdn_stop, cdn_stats = context.Event(), context.Event(), context.Queue()
+    cdn = context.Process(target=fake_cdn_process, args=(cdn_port, cdn_config, cdn_ready, cdn_stop, cdn_stats))
+    cdn.start()
+    cdn_ready.wait(10)
+
+    work_dir = tempfile.mkdtemp(prefix='bench-load-')
+    try:
+        port = free_port()
+        server = start_server(work_dir, port, cdn_port, args.workers, args.threads)
+        args.server_pid = server.pid
+        try:
+            project_ids = seed_projects(port, args.projects, args.assets)
+            result = run_load(port, args, project_ids)
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        cdn_stop.set()
+        result_cdn = cdn_stats.get(timeout=10) if cdn.is_alive() else {'requests': None}
+        cdn.join()
+
+    result['cdn_requests'] = result_cdn['requests']
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'duration': args.duration,
+            'workers': args.workers,
+            'threads': args.threads,
+            'concurrency': args.clients * args.client_threads,
+            'mix': args.mix,
+            'projects': args.projects,
+            'assets': args.assets,
+            'cdn': cdn_config,
+            'cpu_count': os.cpu_count(),
+        },
+        **result,
+    }
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            # JSON 输出到标准输出时，对比结果写到标准错误，保持标准输出可以直接解析
+            print_comparison(json.load(f), report, sys.stderr if args.json == '-' else sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+热点函数微基准与性能回归检查
+在临时目录中生成合成数据，分别计时 replace_cdn_links、extract_html_metadata、get_all_projects
+（1k/10k/100k 个项目）、get_directory_size、CDN 缓存读写和 serve_static
+
+每个用例自动确定每批调用次数（单批不少于 --min-time 秒），重复 --repeat 批，
+以每次调用的最小耗时作为结果（受系统噪声影响最小），同时记录中位数
+
+用法:
+    python benchmarks/bench_micro.py [--sizes 1000,10000,100000] [--filter cdn] [--repeat 5]
+    python benchmarks/bench_micro.py --save                    # 保存为基线
+    python benchmarks/bench_micro.py --compare --threshold 0.2 # 与基线对比，有用例变慢超过 20% 时退出码为 1
+
+基线默认保存在 benchmarks/micro_baseline.json（不纳入版本库），只在同一台机器上的结果之间比较才有意义：
+先在改动前的版本上 --save，再在改动后的版本上 --compare
+"""
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, 'benchmarks', 'micro_baseline.json')
+
+# 导入 main 之前把索引、共享缓存和指标文件指向临时目录，不影响本机正在运行的服务
+WORK_DIR = tempfile.mkdtemp(prefix='bench-micro-')
+os.environ.update({
+    'PROJECT_INDEX_PATH': os.path.join(WORK_DIR, 'project_index.db'),
+    'SHARED_CACHE_PATH': os.path.join(WORK_DIR, 'shared-cache'),
+    'METRICS_DIR': '',
+    'RATELIMIT_ENABLED': 'false',
+})
+sys.path.insert(0, REPO_ROOT)
+
+import main  # noqa: E402
+from main import app  # noqa: E402
+
+CDN_LINKS = [
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'https://unpkg.com/react@18/umd/react.production.min.js',
+    'https://cdnjs.cloudflare.com/ajax/libs/jquery/3.7.1/jquery.min.js',
+    'https://cdn.tailwindcss.com/3.4.0',
+]
+
+
+def build_html(paragraphs=400, links=40):
+    """生成带有 CDN 链接和元数据的页面（约 100KB）"""
+    head = ''.join(
+        f'<script src="{CDN_LINKS[i % len(CDN_LINKS)]}?v={i}"></script>' for i in range(links)
+    )
+    body = ''.join(
+        f'<p class="row">第 {i} 段 Lorem ipsum dolor sit amet, consectetur adipiscing elit, '
+        f'sed do eiusmod tempor incididunt ut labore.</p>' for i in range(paragraphs)
+    )
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>基准页面</title>'
+            f'<meta name="description" content="micro benchmark page">{head}</head><body>{body}</body></html>')
+
+
+def build_project_tree(static_dir, count):
+    """生成 count 个分片布局的项目（index.html + metadata.json）"""
+    html = '<!DOCTYPE html><html><head><title>p</title></head><body><p>project</p></body></html>'
+    with app.app_context():
+        original = app.config['UPLOAD_FOLDER']
+        app.config['UPLOAD_FOLDER'] = static_dir
+        try:
+            for index in range(count):
+                project_dir = main.get_shard_path(f'p{index:07d}')
+                os.makedirs(project_dir)
+                with open(os.path.join(project_dir, 'index.html'), 'w', encoding='utf-8') as f:
+                    f.write(html)
+                with open(os.path.join(project_dir, 'metadata.json'), 'w', encoding='utf-8') as f:
+                    json.dump({'title': f'项目 {index}', 'description': '合成数据',
+                               'created_at': f'2024-01-01T00:00:{index % 60:02d}'}, f)
+        finally:
+            app.config['UPLOAD_FOLDER'] = original
+
+
+def measure(func, min_time, repeat):
+    """返回每次调用的 (最小耗时, 中位数耗时, 每批调用次数)，单位秒"""
+    func()  # 预热
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings), statistics.median(timings), number
+
+
+def get_cases(sizes):
+    """生成 (用例名, 准备函数) 列表；准备函数返回被计时的无参函数"""
+    cases = []
+    html = build_html()
+
+    cases.append(('replace_cdn_links', lambda: lambda: main.replace_cdn_links(html)))
+    cases.append(('extract_html_metadata', lambda: lambda: main.extract_html_metadata(html)))
+
+    def project_tree_case(count, cached):
+        def setup():
+            static_dir = os.path.join(WORK_DIR, f'tree-{count}')
+            if not os.path.isdir(static_dir):
+                build_project_tree(static_dir, count)
+            app.config['UPLOAD_FOLDER'] = static_dir
+
+            def run():
+                if not cached:
+                    main.PROJECTS_CACHE['data'] = None
+                main.get_all_projects()
+            return run
+        return setup
+
+    def directory_size_case(count):
+        def setup():
+            static_dir = os.path.join(WORK_DIR, f'tree-{count}')
+            if not os.path.isdir(static_dir):
+                build_project_tree(static_dir, count)
+            return lambda: main.get_directory_size(static_dir)
+        return setup
+
+    for count in sizes:
+        label = f'{count // 1000}k' if count % 1000 == 0 else str(count)
+        cases.append((f'get_all_projects[{label}]', project_tree_case(count, cached=False)))
+        cases.append((f'get_all_projects_cached[{label}]', project_tree_case(count, cached=True)))
+        cases.append((f'get_directory_size[{label}]', directory_size_case(count)))
+
+    asset = b'/* asset */' + b'x' * 32 * 1024
+    url_hash = main.get_url_hash(CDN_LINKS[0])
+
+    def memory_get():
+        main.set_cdn_to_memory_cache(url_hash, asset, 'text/css')
+        return lambda: main.get_cdn_from_memory_cache(url_hash)
+
+    def file_cache(setter):
+        def setup():
+            main.CDN_CACHE_DIR = os.path.join(WORK_DIR, 'cdn_cache')
+            main.set_cdn_to_file_cache(url_hash, asset, 'text/css')
+            if setter:
+                return lambda: main.set_cdn_to_file_cache(url_hash, asset, 'text/css')
+            return lambda: main.get_cdn_from_file_cache(url_hash, 'text/css')
+        return setup
+
+    cases.append(('get_url_hash', lambda: lambda: main.get_url_hash(CDN_LINKS[0])))
+    cases.append(('get_cdn_from_memory_cache', memory_get))
+    cases.append(('set_cdn_to_memory_cache', lambda: lambda: main.set_cdn_to_memory_cache(url_hash, asset, 'text/css')))
+    cases.append(('get_cdn_from_file_cache', file_cache(setter=False)))
+    cases.append(('set_cdn_to_file_cache', file_cache(setter=True)))
+
+    def serve_static_case(accept_encoding):
+        def setup():
+            static_dir = os.path.join(WORK_DIR, 'serve')
+            app.config['UPLOAD_FOLDER'] = static_dir
+            project_dir = main.get_shard_path('serve001')
+            if not os.path.isdir(project_dir):
+                os.makedirs(project_dir)
+                with open(os.path.join(project_dir, 'index.html.gz'), 'wb') as f:
+                    f.write(gzip.compress(html.encode('utf-8')))
+            client = app.test_client()
+
+            def run():
+                response = client.get('/static/serve001/index.html', headers={'Accept-Encoding': accept_encoding})
+                response.get_data()
+                response.close()
+            return run
+        return setup
+
+    cases.append(('serve_static[gzip]', serve_static_case('gzip')))
+    cases.append(('serve_static[identity]', serve_static_case('identity')))
+    return cases
+
+
+def format_duration(seconds):
+    if seconds >= 1:
+        return f'{seconds:.2f}s'
+    if seconds >= 1e-3:
+        return f'{seconds * 1e3:.2f}ms'
+    return f'{seconds * 1e6:.1f}us'
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, threshold):
+    """打印与基线的对比，返回变慢超过阈值的用例名列表"""
+    regressions = []
+    print(f"\n与基线对比（{baseline.get('revision')}, {baseline.get('timestamp')}），阈值 +{threshold * 100:.0f}%:")
+    for name, result in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f"  {name:<36}基线中没有此用例")
+            continue
+        ratio = result['min_seconds'] / old['min_seconds']
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print(f"  {name:<36}{format_duration(old['min_seconds']):>10} -> {format_duration(result['min_seconds']):>10}"
+              f"{(ratio - 1) * 100:>+9.1f}%{'  变慢' if regressed else ''}")
+    return regressions
+
+
+def main_entry():
+    parser = argparse.ArgumentParser(description='热点函数微基准与性能回归检查')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='逗号分隔的合成项目数量')
+    parser.add_argument('--filter', help='只运行名称包含该字符串的用例')
+    parser.add_argument('--repeat', type=int, default=5, help='每个用例重复的批数')
+    parser.add_argument('--min-time', type=float, default=0.2, help='每批的最短耗时（秒）')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件路径')
+    parser.add_argument('--save', action='store_true', help='把结果保存为基线')
+    parser.add_argument('--compare', action='store_true', help='与基线对比，变慢超过阈值时退出码为 1')
+    parser.add_argument('--threshold', type=float, default=0.25, help='判定为变慢的相对阈值')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    results = {}
+    original_upload_folder = app.config['UPLOAD_FOLDER']
+    original_cdn_cache_dir = main.CDN_CACHE_DIR
+    try:
+        print(f"{'用例':<38}{'最小':>10}{'中位数':>10}{'每批次数':>10}")
+        print('-' * 70)
+        for name, setup in get_cases(sizes):
+            if args.filter and args.filter not in name:
+                continue
+            run = setup()
+            best, median, number = measure(run, args.min_time, args.repeat)
+            app.config['UPLOAD_FOLDER'] = original_upload_folder
+            main.CDN_CACHE_DIR = original_cdn_cache_dir
+            results[name] = {'min_seconds': best, 'median_seconds': median, 'number': number}
+            print(f"{name:<40}{format_duration(best):>10}{format_duration(median):>10}{number:>10}")
+    finally:
+        app.config['UPLOAD_FOLDER'] = original_upload_folder
+        main.CDN_CACHE_DIR = original_cdn_cache_dir
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    exit_code = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"\n基线文件不存在: {args.baseline}，请先用 --save 生成")
+            return 2
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} 个用例变慢超过 {args.threshold * 100:.0f}%: {', '.join(regressions)}")
+            exit_code = 1
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+        # 只运行了部分用例时保留基线中的其它用例
+        merged = dict(baseline.get('results', {}), **results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'revision': git_revision(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': merged,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n基线已保存到 {args.baseline}")
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main_entry())
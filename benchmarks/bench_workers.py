@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gunicorn worker 数量扩展性压测
+在临时目录中用 gunicorn.conf.py 依次以不同 worker 数量启动服务，
+用多个客户端进程并发请求同一组接口，比较吞吐量和延迟
+
+默认压测两类请求：
+- cpu: 只保存了 gzip 版本的预览页，以 Accept-Encoding: identity 请求，服务端需要边读边解压
+- io:  已压缩的预览页，直接发送文件
+
+用法:
+    python benchmarks/bench_workers.py [--workers 1,2,4] [--threads 8] [--duration 10] [--clients 4] [--mode cpu]
+
+吞吐量应随 worker 数量近似线性增长，直到 worker 数超过 CPU 核数
+"""
+
+import argparse
+import gzip
+import http.client
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT_ID = 'bench001'
+
+HEADERS_BY_MODE = {
+    'cpu': {'Accept-Encoding': 'identity'},
+    'io': {'Accept-Encoding': 'gzip'},
+}
+
+
+def build_site(work_dir, page_size):
+    """生成只有 gzip 版本的预览页（旧版平铺目录布局）"""
+    project_dir = os.path.join(work_dir, 'static', PROJECT_ID)
+    os.makedirs(project_dir)
+    row = '<tr><td>Item</td><td>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</td></tr>\n'
+    html = '<!DOCTYPE html><html><head><title>bench</title></head><body><table>'
+    html += row * (page_size // len(row)) + '</table></body></html>'
+    with gzip.open(os.path.join(project_dir, 'index.html.gz'), 'wb', compresslevel=9) as f:
+        f.write(html.encode('utf-8'))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(work_dir, port, workers, threads):
+    """以指定的 worker 数量启动 gunicorn，等到可以响应请求后返回进程对象"""
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        RATELIMIT_ENABLED='false',
+        PROJECT_INDEX_PATH=os.path.join(work_dir, 'project_index.db'),
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_ROOT, 'gunicorn.conf.py'),
+         '--chdir', work_dir, '--pythonpath', REPO_ROOT, 'wsgi:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', f'/static/{PROJECT_ID}/index.html')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn 启动超时')
+
+
+def client_process(port, mode, threads, duration, results):
+    """一个客户端进程：多个线程各自保持长连接循环请求，汇总请求数、错误数和延迟"""
+    deadline = time.time() + duration
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def loop():
+        local = []
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.time() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request('GET', f'/static/{PROJECT_ID}/index.html', headers=HEADERS_BY_MODE[mode])
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise OSError(response.status)
+                local.append(time.perf_counter() - start)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put((latencies, errors[0]))
+
+
+def run_load(port, mode, clients, client_threads, duration):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [
+        context.Process(target=client_process, args=(port, mode, client_threads, duration, results))
+        for _ in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    latencies, errors = [], 0
+    for _ in processes:
+        process_latencies, process_errors = results.get()
+        latencies.extend(process_latencies)
+        errors += process_errors
+    for process in processes:
+        process.join()
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / duration,
+        'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gunicorn worker 数量扩展性压测')
+    parser.add_argument('--workers', default='1,2,4', help='逗号分隔的 worker 数量列表')
+    parser.add_argument('--threads', type=int, default=8, help='每个 worker 的线程数')
+    parser.add_argument('--duration', type=float, default=10, help='每轮压测时长（秒）')
+    parser.add_argument('--clients', type=int, default=4, help='客户端进程数')
+    parser.add_argument('--client-threads', type=int, default=8, help='每个客户端进程的并发连接数')
+    parser.add_argument('--mode', choices=sorted(HEADERS_BY_MODE), default='cpu', help='压测的请求类型')
+    parser.add_argument('--page-size', type=int, default=256 * 1024, help='预览页大小（字节）')
+    args = parser.parse_args()
+
+    print(f"CPU 核数: {os.cpu_count()}, 模式: {args.mode}, 每 worker 线程数: {args.threads}, "
+          f"并发连接: {args.clients * args.client_threads}")
+    print(f"{'workers':>8}{'请求数':>10}{'错误':>8}{'req/s':>10}{'p50':>10}{'p99':>10}{'加速比':>9}")
+    print('-' * 66)
+
+    baseline = None
+    for workers in [int(value) for value in args.workers.split(',')]:
+        work_dir = tempfile.mkdtemp(prefix='bench-workers-')
+        try:
+            build_site(work_dir, args.page_size)
+            port = free_port()
+            server = start_server(work_dir, port, workers, args.threads)
+            try:
+                result = run_load(port, args.mode, args.clients, args.client_threads, args.duration)
+            finally:
+                server.terminate()
+                server.wait(timeout=60)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        baseline = baseline or result['rps']
+        print(f"{workers:>8}{result['requests']:>10}{result['errors']:>8}{result['rps']:>10.1f}"
+              f"{result['p50_ms']:>8.1f}ms{result['p99_ms']:>8.1f}ms{result['rps'] / baseline:>8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按 app.log 回放真实流量
+把 app.log 中的 CDN 代理命中/未命中和上传记录解析成带时间的请求序列，在临时目录中启动服务和本地假 CDN
+（按日志中记录的资源大小和类型响应），按 1 倍、N 倍或最快速度回放，
+对比不同配置下的代理缓存命中率、延迟和服务进程内存，用于按真实负载确定内存缓存上限和 TTL
+
+支持两种日志格式：
+- JSON（LOG_FORMAT=json）：使用 url、bytes、content_type、project_id 等字段；被采样的事件按 sample_rate
+  还原为多次请求，均匀分布在该事件上一条记录到这一条记录之间（被采样掉的请求地址未知，按同一地址回放）
+- 文本（LOG_FORMAT=text）：只能从消息中解析出地址，资源大小使用 --default-asset-size
+
+用法:
+    python benchmarks/replay_log.py app.log [--speed 1 | --speed 10 | --speed 0]
+        [--variant baseline] [--variant small:SHARED_CACHE_SIZE=8388608,CDN_CACHE_MAX_MEMORY_ITEMS=50]
+        [--json replay.json]
+
+--speed 0 表示不等待，按最快速度回放；每个 --variant 使用独立的服务进程和数据目录回放同一份请求序列。
+按 N 倍速回放时，与时间有关的配置（如 CDN_CACHE_TTL）相对请求序列被放大了 N 倍，需要按比例缩小后再比较
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from bench_load import Client, fake_cdn_process, percentile, process_tree_rss, start_server
+from bench_workers import free_port
+
+PROXY_EVENTS = {
+    'cdn_memory_hit': 'HIT-MEMORY',
+    'cdn_file_hit': 'HIT-DISK',
+    'cdn_miss': 'MISS',
+}
+TEXT_LINE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3}) - \S+ - \w+ - (.*)$')
+TEXT_MESSAGE_PATTERNS = [
+    (re.compile(r'^CDN 缓存命中（内存）: (\S+)$'), 'cdn_memory_hit'),
+    (re.compile(r'^CDN 缓存命中（文件）: (\S+)$'), 'cdn_file_hit'),
+    (re.compile(r'^CDN 缓存未命中，从外部获取: (\S+)$'), 'cdn_miss'),
+    (re.compile(r'^项目已上传: (\S+) \((\d+) bytes\)$'), 'upload'),
+]
+
+
+def parse_log_line(line):
+    """解析一行日志，返回 {'time', 'event', 'sample_rate', ...}；不是回放关心的事件时返回 None"""
+    line = line.strip()
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        if entry.get('event') not in PROXY_EVENTS and entry.get('event') != 'upload':
+            return None
+        if entry['event'] != 'upload' and not entry.get('url'):
+            return None
+        entry['time'] = datetime.datetime.fromisoformat(entry['time']).timestamp()
+        entry.setdefault('sample_rate', 1)
+        return entry
+
+    match = TEXT_LINE_PATTERN.match(line)
+    if not match:
+        return None
+    timestamp = datetime.datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S').timestamp()
+    timestamp += int(match.group(2)) / 1000
+    for pattern, event in TEXT_MESSAGE_PATTERNS:
+        message_match = pattern.match(match.group(3))
+        if message_match:
+            if event == 'upload':
+                return {'time': timestamp, 'event': event, 'sample_rate': 1,
+                        'project_id': message_match.group(1), 'bytes': int(message_match.group(2))}
+            return {'time': timestamp, 'event': event, 'sample_rate': 1, 'url': message_match.group(1)}
+    return None
+
+
+def build_trace(lines, expand_samples=True):
+    """
+    把日志行转换为请求序列 [(相对开始的秒数, 类型, 参数)] 和资源目录 {地址: (字节数, Content-Type)}
+    """
+    entries = sorted(filter(None, map(parse_log_line, lines)), key=lambda entry: entry['time'])
+    if not entries:
+        return [], {}, {}
+    start = entries[0]['time']
+
+    assets = {}
+    recorded = {}
+    trace = []
+    previous_time = {}
+    for entry in entries:
+        event = entry['event']
+        copies = entry['sample_rate'] if expand_samples else 1
+        recorded[event] = recorded.get(event, 0) + copies
+        if entry.get('url'):
+            url = entry['url']
+            size, content_type = assets.get(url, (None, None))
+            assets[url] = (entry.get('bytes') or size, entry.get('content_type') or content_type)
+
+        # 被采样掉的请求发生在同一事件的上一条记录之后，均匀分布到这段时间内
+        since = previous_time.get(event, entry['time'])
+        previous_time[event] = entry['time']
+        for index in range(copies):
+            offset = entry['time'] - (entry['time'] - since) * (copies - 1 - index) / copies - start
+            if event == 'upload':
+                trace.append((offset, 'upload', entry.get('bytes') or 4096))
+            else:
+                trace.append((offset, 'proxy', entry['url']))
+    trace.sort(key=lambda item: item[0])
+    return trace, assets, recorded
+
+
+def to_fake_cdn_url(url):
+    """HTTP_PROXY 只接管 http:// 请求，回放时把 https:// 地址改为 http://（仍能通过 /proxy 的域名校验）"""
+    parts = urllib.parse.urlsplit(url)
+    return urllib.parse.urlunsplit(('http',) + tuple(parts[1:]))
+
+
+def build_upload_html(index, size):
+    filler = 'x' * max(0, size - 120)
+    return f'<!DOCTYPE html><html><head><title>replay {index}</title></head><body><p>{filler}</p></body></html>'
+
+
+def replay(port, trace, speed, concurrency):
+    """
+    按时间回放请求序列，返回每类请求的延迟、状态码、代理缓存结果和调度延迟（实际发出时间晚于计划的秒数）
+    speed 为 0 时不等待，由 concurrency 个线程尽快发出
+    """
+    work = queue.Queue(maxsize=concurrency * 4)
+    lock = threading.Lock()
+    latencies = {'proxy': [], 'upload': []}
+    statuses = {'proxy': {}, 'upload': {}}
+    cache_statuses = {}
+    lags = []
+
+    def worker():
+        client = Client(port)
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            index, due, kind, value = item
+            lag = max(0.0, time.perf_counter() - due) if due is not None else 0.0
+            start = time.perf_counter()
+            try:
+                if kind == 'proxy':
+                    response, _ = client.request('GET', f"/proxy?url={urllib.parse.quote(value, safe='')}")
+                    cache_status = response.getheader('X-Cache-Status') or 'ERROR'
+                else:
+                    response, _ = client.upload(build_upload_html(index, value))
+                    cache_status = None
+                status = str(response.status)
+            except (OSError, http.client.HTTPException):
+                status, cache_status = 'error', 'ERROR' if kind == 'proxy' else None
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[kind].append(elapsed)
+                statuses[kind][status] = statuses[kind].get(status, 0) + 1
+                if cache_status:
+                    cache_statuses[cache_status] = cache_statuses.get(cache_status, 0) + 1
+                lags.append(lag)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    for index, (offset, kind, value) in enumerate(trace):
+        due = None
+        if speed:
+            due = started + offset / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        value = to_fake_cdn_url(value) if kind == 'proxy' else value
+        work.put((index, due, kind, value))
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, cache_statuses, lags, time.perf_counter() - started
+
+
+def fetch_json(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        conn.request('GET', path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def run_variant(name, env, trace, args, cdn_port):
+    """用一组配置启动服务并回放请求序列，返回汇总结果"""
+    work_dir = tempfile.mkdtemp(prefix='replay-')
+    rss_samples = []
+    stop_sampling = threading.Event()
+    try:
+        port = free_port()
+        server = start_server(work_dir, port, cdn_port, args.workers, args.threads, extra_env=env)
+
+        def sample_rss():
+            while not stop_sampling.wait(0.5):
+                rss_samples.append(process_tree_rss(server.pid))
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+        try:
+            latencies, statuses, cache_statuses, lags, elapsed = replay(port, trace, args.speed, args.concurrency)
+            memory_cache = fetch_json(port, '/api/cdn-cache/stats').get('memory_cache')
+            rss_samples.append(process_tree_rss(server.pid))
+        finally:
+            stop_sampling.set()
+            server.terminate()
+            server.wait(timeout=60)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    operations = {}
+    for kind, values in latencies.items():
+        values.sort()
+        if values:
+            operations[kind] = {
+                'requests': len(values),
+                'errors': sum(count for status, count in statuses[kind].items() if not status.startswith('2')),
+                'p50_ms': percentile(values, 0.50) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+                'statuses': statuses[kind],
+            }
+    proxied = sum(cache_statuses.values())
+    lags.sort()
+    return {
+        'name': name,
+        'env': env,
+        'elapsed_seconds': elapsed,
+        'operations': operations,
+        'proxy_cache': {
+            'statuses': cache_statuses,
+            'memory_hit_ratio': cache_statuses.get('HIT-MEMORY', 0) / proxied if proxied else None,
+            'hit_ratio': (cache_statuses.get('HIT-MEMORY', 0) + cache_statuses.get('HIT-DISK', 0)) / proxied
+            if proxied else None,
+        },
+        'memory_cache': memory_cache,
+        'rss_bytes': {'peak': max(rss_samples), 'final': rss_samples[-1]},
+        'schedule_lag_p99_ms': percentile(lags, 0.99) * 1000,
+    }
+
+
+def parse_variant(spec):
+    """解析 "名称:KEY=VALUE,KEY=VALUE" 形式的配置"""
+    name, _, assignments = spec.partition(':')
+    env = {}
+    for item in filter(None, assignments.split(',')):
+        key, separator, value = item.partition('=')
+        if not separator:
+            raise argparse.ArgumentTypeError(f'配置项应为 KEY=VALUE: {item}')
+        env[key.strip()] = value.strip()
+    return name, env
+
+
+def format_ratio(value):
+    return '-' if value is None else f'{value * 100:.1f}%'
+
+
+def print_report(recorded, results):
+    proxied = sum(recorded.get(event, 0) for event in PROXY_EVENTS)
+    if proxied:
+        print(f"日志中的代理命中率: 内存 {format_ratio(recorded.get('cdn_memory_hit', 0) / proxied)}, "
+              f"内存+文件 {format_ratio((recorded.get('cdn_memory_hit', 0) + recorded.get('cdn_file_hit', 0)) / proxied)}"
+              f"（{proxied} 次代理请求, {recorded.get('upload', 0)} 次上传）\n")
+    print(f"{'配置':<16}{'内存命中':>10}{'总命中':>10}{'代理p50':>10}{'代理p99':>10}{'上传p99':>10}"
+          f"{'缓存条目':>9}{'缓存MB':>8}{'RSS峰值MB':>10}{'调度延迟p99':>12}")
+    print('-' * 112)
+    for result in results:
+        proxy = result['operations'].get('proxy', {})
+        upload = result['operations'].get('upload', {})
+        memory_cache = result['memory_cache'] or {}
+        print(f"{result['name']:<18}{format_ratio(result['proxy_cache']['memory_hit_ratio']):>10}"
+              f"{format_ratio(result['proxy_cache']['hit_ratio']):>10}"
+              f"{proxy.get('p50_ms', 0):>8.1f}ms{proxy.get('p99_ms', 0):>8.1f}ms{upload.get('p99_ms', 0):>8.1f}ms"
+              f"{memory_cache.get('items', 0):>11}{memory_cache.get('size_mb', 0):>10.1f}"
+              f"{result['rss_bytes']['peak'] / 1024 / 1024:>12.1f}{result['schedule_lag_p99_ms']:>12.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按 app.log 回放真实流量')
+    parser.add_argument('log_file', help='app.log 路径（JSON 或文本格式）')
+    parser.add_argument('--speed', type=float, default=1, help='回放倍速，0 表示最快速度')
+    parser.add_argument('--variant', type=parse_variant, action='append',
+                        help='回放的配置，格式为 名称:KEY=VALUE,KEY=VALUE，可重复指定')
+    parser.add_argument('--concurrency', type=int, default=32, help='并发连接数')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker 数量')
+    parser.add_argument('--threads', type=int, default=8, help='每个 worker 的线程数')
+    parser.add_argument('--cdn-latency-ms', type=float, default=50, help='假 CDN 的响应延迟（毫秒）')
+    parser.add_argument('--default-asset-size', type=int, default=16384, help='日志中没有记录大小的资源字节数')
+    parser.add_argument('--no-expand-samples', action='store_true', help='不按 sample_rate 还原被采样掉的请求')
+    parser.add_argument('--limit', type=int, help='只回放前 N 个请求')
+    parser.add_argument('--json', help='把结果写入 JSON 文件，- 表示标准输出')
+    args = parser.parse_args()
+
+    with open(args.log_file, encoding='utf-8', errors='replace') as f:
+        trace, assets, recorded = build_trace(f, expand_samples=not args.no_expand_samples)
+    if args.limit:
+        trace = trace[:args.limit]
+    if not trace:
+        print('日志中没有可回放的代理或上传记录')
+        return 1
+    duration = trace[-1][0]
+    print(f"请求序列: {len(trace)} 个请求, {len(assets)} 个不同资源, 原始时长 {duration:.1f}s, "
+          f"回放速度 {'最快' if not args.speed else f'{args.speed:g}x'}", file=sys.stderr if args.json == '-' else sys.stdout)
+
+    context = multiprocessing.get_context('fork')
+    cdn_port = free_port()
+    cdn_config = {
+        'latency': args.cdn_latency_ms / 1000,
+        'jitter': False,
+        'sizes': [args.default_asset_size],
+        'error_rate': 0.0,
+        'assets': {
+            to_fake_cdn_url(url): (size or args.default_asset_size, content_type or 'application/javascript')
+            for url, (size, content_type) in assets.items()
+        },
+    }
+    cdn_ready, cdn_stop, cdn_stats = context.Event(), context.Event(), context.Queue()
+    cdn = context.Process(target=fake_cdn_process, args=(cdn_port, cdn_config, cdn_ready, cdn_stop, cdn_stats))
+    cdn.start()
+    cdn_ready.wait(10)
+    results = []
+    try:
+        for name, env in args.variant or [('default', {})]:
+            results.append(run_variant(name, env, trace, args, cdn_port))
+    finally:
+        cdn_stop.set()
+        cdn.join(timeout=10)
+
+    report = {
+        'log_file': os.path.abspath(args.log_file),
+        'requests': len(trace),
+        'assets': len(assets),
+        'trace_seconds': duration,
+        'speed': args.speed,
+        'recorded_events': recorded,
+        'variants': results,
+    }
+    if args.json == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_report(recorded, results)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
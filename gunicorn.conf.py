@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Gunicorn 配置
+
+- 多进程 + 多线程（gthread）：/upload 的 HTML 重写、元数据提取和压缩是 CPU 密集型，
+  受 GIL 限制，只能靠多个 worker 进程并行；/proxy 回源是 I/O 密集型，一个请求最多占用
+  一个线程 10 秒（上游超时），靠每个进程内的多个线程并发
+- 默认预加载应用：main.py 只在主进程导入一次，worker 通过 fork 共享只读内存；
+  导入时不启动任何后台线程，在 post_fork 中由各 worker 自己启动
+- 平滑重启：kill -HUP <主进程> 逐个替换 worker；预加载时 HUP 不会加载新代码，
+  升级代码请使用 kill -USR2 启动新主进程，再向旧主进程发送 WINCH 和 QUIT
+
+容量估算见 README.md 的「生产部署」一节，所有参数都可以通过环境变量覆盖
+"""
+
+import multiprocessing
+import os
+
+# 必须在加载 wsgi.py 之前设置：主进程中不启动调度器等后台线程，避免 fork 时把线程状态带进 worker
+os.environ.setdefault('PREVIEW_DEFER_BACKGROUND_SERVICES', 'true')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5010)}"
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_class = 'gthread'
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+# 上游请求超时 10 秒，上传后处理在后台线程中执行，60 秒足够覆盖最慢的同步请求
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# 处理一定数量的请求后重启 worker，0 表示不重启
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+
+def on_starting(server):
+    """主进程启动时清空上一次运行留下的各 worker 指标文件，/metrics 从零开始汇总"""
+    import main
+
+    main.metrics_registry.clear()
+
+
+def post_fork(server, worker):
+    """worker 启动后开启后台服务，只有拿到调度锁的 worker（leader）运行过期清理等任务"""
+    import main
+
+    main.start_background_services()
+    server.log.info(f"worker {worker.pid} 已启动后台服务{'（调度 leader，负责定时清理）' if main.is_scheduler_leader() else ''}")
+
+
+def worker_exit(server, worker):
+    """worker 退出前等待上传后处理完成，并写入尚未落盘的访问记录"""
+    import main
+
+    main.stop_background_services()
+
+
+def on_exit(server):
+    """
+    主进程退出时删除共享缓存文件（此时所有 worker 都已退出）
+    USR2 升级过程中旧主进程退出时新主进程仍在使用同一个文件，不删除
+    """
+    if server.reexec_pid or server.master_pid:
+        return
+    import main
+
+    main.remove_cdn_memory_cache()
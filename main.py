@@ -1,48 +1,117 @@
 import os
 import secrets
+import random
 import re
-import requests
 import json
 import datetime
 import base64
+import gzip
 import logging
+import math
 import time
 import shutil
 import hashlib
+import importlib
+import importlib.util
+import io
+import mimetypes
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import uuid
+import warnings
+import zipfile
+import urllib.parse
 from collections import OrderedDict
-from flask import Flask, request, render_template, jsonify, send_from_directory, Response, make_response
-from bs4 import BeautifulSoup
-import bleach
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from html.entities import html5 as html5_entities
+from html.parser import HTMLParser
+from flask import Flask, Request, request, render_template, jsonify, send_from_directory, Response, abort, g
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_wtf.csrf import CSRFProtect, generate_csrf
-from apscheduler.schedulers.background import BackgroundScheduler
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
+import shared_cache
+import app_logging
+import metrics
+import profiling
+from app_logging import queue_logging
+
+try:
+    import brotli  # 可选依赖，安装后额外保存 br 压缩版本的预览页
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，调度锁不可用时每个进程都运行定时任务
+    fcntl = None
+
+# 缩略图缩放与转码；未安装 Pillow 时只接受 PNG 并按原样保存（只检查是否安装，导入推迟到首次生成缩略图）
+PILLOW_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+# 按需导入的重量级模块：只在少数代码路径中用到，首次使用时才导入，加快 worker 启动和测试导入
+# 函数内直接 import；外部仍可以通过 main.<名称> 访问（例如测试中 patch('main.requests.get')）
+LAZY_MODULES = {
+    'requests': 'requests',  # 仅 CDN 代理回源和上传后预取使用
+    'bleach': 'bleach',  # 仅已停用的 sanitize_html 使用
+    'Image': 'PIL.Image',  # 仅在缩略图进程池中缩放、转码和拼图时使用
+}
+
+def __getattr__(name):
+    if name in LAZY_MODULES:
+        return importlib.import_module(LAZY_MODULES[name])
+    if name == 'cdn_memory_cache':
+        return get_cdn_memory_cache()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 app = Flask(__name__, static_folder=None)  # 禁用默认静态文件夹,使用自定义路由
 
 # 配置密钥（用于CSRF保护）
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
 
-# 配置日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
-)
+# 日志配置 - 日志经过内存队列由后台线程写入 app.log 和控制台，请求线程不等待日志 I/O
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()  # json（每行一个 JSON 对象）/ text
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # 队列上限，写满时丢弃并计数
+# 热点路径日志的采样率："事件=N" 表示每 N 次只记录 1 次
+LOG_SAMPLING = app_logging.parse_sample_rates(os.environ.get(
+    'LOG_SAMPLING',
+    'cdn_memory_hit=100,cdn_file_hit=10,cdn_cache_write=10,projects_cache_rebuild=10,projects_cache_stored=10'
+))
+
+# 日志记录器；输出到 app.log 和控制台的处理器由 create_app 配置，单纯导入时不创建日志文件
 logger = logging.getLogger(__name__)
 
+def configure_logging():
+    """配置根日志记录器（经过队列写入 app.log 并输出到控制台），重复调用不会重复安装"""
+    app_logging.setup_logging('app.log', log_format=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE,
+                              sample_rates=LOG_SAMPLING)
+
+def log_event(event, message, **fields):
+    """
+    记录热点路径上的日志：按 LOG_SAMPLING 采样，输出中附带事件名和采样率
+    fields 在 JSON 格式中作为独立字段输出（例如 URL 和字节数，供 benchmarks/replay_log.py 回放）
+    """
+    if queue_logging.should_log(event):
+        extra = queue_logging.extra(event)
+        if fields:
+            extra['fields'] = fields
+        logger.info(message, extra=extra)
+
 # 初始化CSRF保护
 csrf = CSRFProtect(app)
 
 # 配置速率限制
+# memory:// 下每个 worker 进程单独计数，多进程部署时可指向 redis:// 等共享存储
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', 'True').lower() == 'true'
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    storage_uri=os.environ.get('RATELIMIT_STORAGE_URI', 'memory://')
 )
 
 # 配置
@@ -53,25 +122,301 @@ MAX_PROXY_SIZE = 10 * 1024 * 1024  # 10MB
 MAX_STORAGE_QUOTA = 500 * 1024 * 1024  # 500MB 总存储配额
 PROJECT_EXPIRY_DAYS = int(os.environ.get('PROJECT_EXPIRY_DAYS', 30))  # 项目过期天数，默认30天
 CLEANUP_INTERVAL_HOURS = int(os.environ.get('CLEANUP_INTERVAL_HOURS', 24))  # 清理任务间隔，默认24小时
+ACCESS_FLUSH_INTERVAL_SECONDS = int(os.environ.get('ACCESS_FLUSH_INTERVAL_SECONDS', 60))  # 访问记录批量落盘间隔，默认60秒
+CLEANUP_MAX_SECONDS_PER_RUN = float(os.environ.get('CLEANUP_MAX_SECONDS_PER_RUN', 60))  # 单次清理的时间预算
+CLEANUP_MAX_DELETIONS_PER_RUN = int(os.environ.get('CLEANUP_MAX_DELETIONS_PER_RUN', 1000))  # 单次清理最多删除的项目数
+CLEANUP_BATCH_SIZE = int(os.environ.get('CLEANUP_BATCH_SIZE', 50))  # 每批删除的项目数
+CLEANUP_BATCH_PAUSE_SECONDS = float(os.environ.get('CLEANUP_BATCH_PAUSE_SECONDS', 0.2))  # 批次之间的暂停，平滑磁盘 I/O
+CDN_CACHE_EVICT_INTERVAL_MINUTES = int(os.environ.get('CDN_CACHE_EVICT_INTERVAL_MINUTES', 60))  # 过期 CDN 缓存清理间隔
+SCHEDULER_ELECTION_INTERVAL_SECONDS = int(os.environ.get('SCHEDULER_ELECTION_INTERVAL_SECONDS', 30))  # 非 leader 进程重试获取调度锁的间隔
+JOB_RUN_HISTORY_LIMIT = 20  # 每个定时任务在项目索引中保留的运行记录数
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['PROJECT_INDEX_PATH'] = os.environ.get('PROJECT_INDEX_PATH', 'project_index.db')  # 项目索引（SQLite）
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+# 批量上传配置 - 通过 zip/tar 归档一次上传多个项目或多文件项目
+MAX_BULK_UPLOAD_SIZE = int(os.environ.get('MAX_BULK_UPLOAD_SIZE', 50 * 1024 * 1024))  # 归档本身的大小上限
+BULK_UPLOAD_MAX_EXTRACTED_SIZE = int(os.environ.get('BULK_UPLOAD_MAX_EXTRACTED_SIZE', 100 * 1024 * 1024))  # 解压后总大小上限
+BULK_UPLOAD_MAX_FILES = int(os.environ.get('BULK_UPLOAD_MAX_FILES', 1000))  # 归档内文件数上限
+BULK_UPLOAD_MAX_PROJECTS = int(os.environ.get('BULK_UPLOAD_MAX_PROJECTS', 50))  # 单次批量上传的项目数上限
+BULK_UPLOAD_HTML_EXTENSIONS = ('.html', '.htm')
+BULK_UPLOAD_COPY_CHUNK_SIZE = 64 * 1024
+
+class PreviewRequest(Request):
+    """
+    批量上传和缩略图上传使用单独的请求体大小上限，其它接口仍为 MAX_CONTENT_LENGTH
+    缩略图的各种请求体（二进制、multipart、JSON）都按 THUMBNAIL_MAX_UPLOAD_SIZE 限制，图片本身的大小在写盘时再检查
+    """
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'bulk_upload':
+            return MAX_BULK_UPLOAD_SIZE
+        if self.endpoint == 'upload_thumbnail':
+            return THUMBNAIL_MAX_UPLOAD_SIZE
+        return super().max_content_length
+
+app.request_class = PreviewRequest
+
 port = os.environ.get('PORT', DEFAULT_PORT)
 
 # 项目列表缓存配置
+# 每个进程缓存自己的列表，失效通过共享缓存中的计数器通知所有进程
 PROJECTS_CACHE = {
     'data': None,  # 缓存的项目列表
     'timestamp': 0,  # 缓存时间戳
-    'ttl': 300  # 缓存有效期(秒),默认5分钟
+    'ttl': 300,  # 缓存有效期(秒),默认5分钟
+    'generation': None  # 生成缓存时的失效代数，与共享计数器不一致说明有进程使缓存失效了
 }
+PROJECTS_CACHE_COUNTER = 0  # 项目列表失效代数在共享缓存计数器中的位置
 
 # CDN 缓存配置
 CDN_CACHE_DIR = os.path.join(UPLOAD_FOLDER, 'cdn_cache')
 CDN_CACHE_TTL = int(os.environ.get('CDN_CACHE_TTL', 7 * 24 * 3600))  # 默认7天
 CDN_CACHE_MAX_MEMORY_ITEMS = int(os.environ.get('CDN_CACHE_MAX_MEMORY_ITEMS', 100))  # 内存缓存最大条目数
 
-# 内存缓存 - 使用 OrderedDict 实现简单的 LRU
-cdn_memory_cache = OrderedDict()
+# 跨进程共享缓存配置 - 多个 worker 进程共用一份 CDN 内存缓存和缓存失效计数器
+# 默认放在 /dev/shm（共享内存）中，文件名包含 static 目录路径的哈希，同一台机器上的不同部署互不影响
+SHARED_CACHE_ENABLED = os.environ.get('SHARED_CACHE_ENABLED', 'True').lower() == 'true'
+SHARED_CACHE_SIZE = int(os.environ.get('SHARED_CACHE_SIZE', 64 * 1024 * 1024))  # 共享缓存数据区大小（字节）
+SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH') or os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+    f"html-preview-cache-{hashlib.sha256(os.path.abspath(UPLOAD_FOLDER).encode('utf-8')).hexdigest()[:12]}"
+)
+
+# 指标配置 - 每个 worker 进程把计数写入 METRICS_DIR 下自己的文件，/metrics 读取时汇总所有进程
+# 设置为空字符串时只统计处理 /metrics 请求的那个进程
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+    f"html-preview-metrics-{hashlib.sha256(os.path.abspath(UPLOAD_FOLDER).encode('utf-8')).hexdigest()[:12]}"
+))
+# 分阶段耗时 - 代理、预览页、上传和项目列表接口按阶段计时，阶段耗时总是计入指标；
+# 开启后同时以 Server-Timing 响应头返回，可直接在浏览器开发者工具中查看
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'False').lower() == 'true'
+
+# 按需请求分析 - 只有设置了 PROFILING_TOKEN 才启用；请求带 X-Profile: <令牌> 时分析该请求，
+# 或对 PROFILING_ENDPOINTS 中的路由按 PROFILING_SAMPLE_RATE 随机抽样；未启用时每个请求只多一次判断
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN') or None
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))  # 0-1，抽样分析的请求比例
+PROFILING_ENDPOINTS = frozenset(filter(None, os.environ.get('PROFILING_ENDPOINTS', 'upload_html,get_projects').split(',')))
+PROFILING_INTERVAL = float(os.environ.get('PROFILING_INTERVAL_MS', 5)) / 1000  # 调用栈采样间隔
+PROFILES_DIR = os.environ.get('PROFILES_DIR', 'profiles')
+PROFILES_MAX_FILES = int(os.environ.get('PROFILES_MAX_FILES', 200))  # 超出时删除最旧的分析结果
+PROFILE_ID_PATTERN = re.compile(r'^[0-9]{8}T[0-9]{6}-[A-Za-z0-9_]+-[0-9a-f]{8}$')
+
+# 项目存储分片配置
+# 新项目存放在 static/shards/<xx>/<yy>/<project_id>/，xx/yy 取自项目ID哈希的前四位十六进制字符，
+# 避免 static/ 下直接堆积大量目录；旧项目仍可位于 static/<project_id>/，由 migrate_storage.py 在线迁移
+PROJECT_SHARD_ROOT = 'shards'
+# 内容寻址存储 - 相同内容的 index.html 只保存一份 static/blobs/<sha256前2位>/<sha256>.html，
+# 各项目目录通过硬链接指向它（不支持硬链接时退化为复制），引用计数记录在项目索引中
+BLOB_STORE_ROOT = 'blobs'
+RESERVED_STATIC_DIRS = frozenset(['cdn_cache', PROJECT_SHARD_ROOT, BLOB_STORE_ROOT])  # static/ 下不是项目的目录
+
+# 预览页压缩存储 - 共享内容以 gzip（安装 brotli 时另存 br）形式保存，项目目录中为 index.html.gz / index.html.br，
+# serve_static 直接发送压缩字节；只有不支持压缩的客户端才边读边解压
+PREVIEW_KEEP_RAW_HTML = os.environ.get('PREVIEW_KEEP_RAW_HTML', 'False').lower() == 'true'  # 是否同时保留未压缩的 index.html
+PREVIEW_BROTLI_ENABLED = os.environ.get('PREVIEW_BROTLI_ENABLED', 'True').lower() == 'true' and brotli is not None
+HTML_ENCODING_SUFFIXES = OrderedDict([('br', '.br'), ('gzip', '.gz')])  # 按发送优先级排列
+HTML_STREAM_CHUNK_SIZE = 64 * 1024
+
+# 静态文件发送卸载 - serve_static 仍负责校验路径和选择响应头，文件内容交给前端服务器发送
+# off: 由应用发送；x-accel: nginx 的 X-Accel-Redirect；x-sendfile: Apache/lighttpd 的 X-Sendfile
+STATIC_OFFLOAD_MODE = os.environ.get('STATIC_OFFLOAD_MODE', 'off').lower()
+STATIC_OFFLOAD_PREFIX = os.environ.get('STATIC_OFFLOAD_PREFIX', '/_protected_static/')  # nginx internal location，对应 static/ 目录
+if STATIC_OFFLOAD_MODE not in ('off', 'x-accel', 'x-sendfile'):
+    raise ValueError(f'不支持的 STATIC_OFFLOAD_MODE: {STATIC_OFFLOAD_MODE}')
+app.config['USE_X_SENDFILE'] = STATIC_OFFLOAD_MODE == 'x-sendfile'
+
+# 预览内容安全头 - 导入时计算一次，所有请求复用同一份不可变元组
+# 注意: 对于预览工具,我们允许脚本执行,因为这是用户的预期
+# 但我们限制外部资源加载,除非通过代理
+PREVIEW_SECURITY_HEADERS = (
+    ('Content-Security-Policy', (
+        "default-src 'self' 'unsafe-inline' 'unsafe-eval' data: blob:; "
+        "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://cdn.jsdelivr.net https://unpkg.com https://cdnjs.cloudflare.com https://cdn.tailwindcss.com; "
+        "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net https://unpkg.com https://cdnjs.cloudflare.com https://fonts.googleapis.com; "
+        "img-src 'self' data: https:; "
+        "font-src 'self' data: https://fonts.gstatic.com https://cdn.jsdelivr.net; "
+        "connect-src 'self' https:; "
+        "frame-ancestors 'none'; "
+        "base-uri 'self';"
+    )),
+    # 防止被嵌入
+    ('X-Frame-Options', 'SAMEORIGIN'),
+    ('X-Content-Type-Options', 'nosniff'),
+)
+PROJECT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# 内存缓存 - 跨进程共享（不支持时退化为进程内 LRU），同时承载项目列表的失效计数器
+# 首次使用时才打开，导入 main 不会在 /dev/shm 中创建文件；外部仍可以通过 main.cdn_memory_cache 访问
+_cdn_memory_cache = None
+cdn_memory_cache_lock = threading.Lock()
+
+def get_cdn_memory_cache():
+    """获取 CDN 内存缓存（首次使用时打开共享缓存文件）"""
+    global _cdn_memory_cache
+    if _cdn_memory_cache is None:
+        with cdn_memory_cache_lock:
+            if _cdn_memory_cache is None:
+                _cdn_memory_cache = shared_cache.open_cache(
+                    SHARED_CACHE_PATH if SHARED_CACHE_ENABLED else None, SHARED_CACHE_SIZE, CDN_CACHE_MAX_MEMORY_ITEMS
+                )
+    return _cdn_memory_cache
+
+def remove_cdn_memory_cache():
+    """
+    删除共享缓存文件和锁文件
+    只能在所有 worker 都已退出后由主进程调用，否则仍在运行的进程和之后打开缓存的进程会各用一份文件
+    """
+    if SHARED_CACHE_ENABLED and shared_cache.remove_cache(SHARED_CACHE_PATH):
+        logger.info(f"已删除共享缓存文件 {SHARED_CACHE_PATH}")
+
+# Prometheus 指标 - 请求路径上每次只做几次 mmap 写入，汇总和格式化都在 /metrics 被访问时进行
+metrics_registry = metrics.MetricsRegistry(METRICS_DIR or None)
+REQUEST_LATENCY = metrics_registry.histogram(
+    'preview_http_request_duration_seconds', '按路由统计的请求处理耗时（秒）', ('endpoint', 'method'))
+REQUEST_COUNT = metrics_registry.counter(
+    'preview_http_requests_total', '按路由和状态码统计的请求数', ('endpoint', 'method', 'status'))
+RESPONSE_BYTES = metrics_registry.counter(
+    'preview_http_response_bytes_total', '按路由统计的响应体字节数（长度已知的响应）', ('endpoint',))
+PROXY_RESULTS = metrics_registry.counter(
+    'preview_proxy_requests_total', 'CDN 代理请求结果（X-Cache-Status，出错时为 ERROR）', ('cache_status', 'status'))
+UPSTREAM_LATENCY = metrics_registry.histogram(
+    'preview_proxy_upstream_duration_seconds', 'CDN 回源耗时（秒，到收到响应头为止）', ('domain',))
+PROJECTS_REBUILD_SECONDS = metrics_registry.histogram(
+    'preview_projects_cache_rebuild_seconds', '项目列表缓存重建耗时（秒）')
+CLEANUP_SECONDS = metrics_registry.histogram(
+    'preview_cleanup_duration_seconds', '过期项目清理耗时（秒）', buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300))
+REQUEST_PHASE_LATENCY = metrics_registry.histogram(
+    'preview_http_request_phase_seconds', '按路由和阶段统计的处理耗时（秒，与 Server-Timing 相同）', ('endpoint', 'phase'))
+CLEANUP_DELETED = metrics_registry.counter(
+    'preview_cleanup_deleted_projects_total', '过期清理删除的项目数')
+metrics_registry.gauge(
+    'preview_memory_cache_resident_bytes', 'CDN 内存缓存占用的字节数', lambda: get_cdn_memory_cache().stats()['bytes'])
+metrics_registry.gauge(
+    'preview_memory_cache_items', 'CDN 内存缓存的条目数', lambda: get_cdn_memory_cache().stats()['items'])
+
+# 项目访问记录 - {project_id: (最后访问时间, 访问次数)}
+# serve_static 只做一次字典赋值（GIL 下为原子操作，无锁、无磁盘 I/O），由后台任务定期批量写入项目索引
+project_access_log = {}
+
+# 项目索引表结构
+PROJECT_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    last_access REAL NOT NULL,
+    access_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_projects_last_access ON projects (last_access);
+CREATE TABLE IF NOT EXISTS index_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    source_hash TEXT,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_blobs_source_hash ON blobs (source_hash);
+CREATE TABLE IF NOT EXISTS project_blobs (
+    project_id TEXT PRIMARY KEY,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS thumbnail_leases (
+    project_id TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    duration REAL,
+    status TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_job_runs_job_id ON job_runs (job_id, id);
+CREATE TABLE IF NOT EXISTS background_jobs (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, id)
+);
+CREATE INDEX IF NOT EXISTS idx_background_jobs_created_at ON background_jobs (kind, created_at);
+"""
+
+# 每个线程持有独立的 SQLite 连接
+_project_index_local = threading.local()
+
+# 内容寻址存储的引用计数变更与文件增删必须一起完成：进程内用线程锁，进程间再加文件锁（见 blob_store_locked）
+blob_store_lock = threading.Lock()
+
+# 元数据回填任务 - 为缺少 metadata.json 的旧项目一次性补写元数据
+# 进度保存在项目索引的 background_jobs 表中（kind 为 metadata_backfill，只保留最近一次），任何 worker 都能查询
+METADATA_BACKFILL_WORKERS = int(os.environ.get('METADATA_BACKFILL_WORKERS', 4))
+METADATA_BACKFILL_SAVE_EVERY = 50  # 每处理多少个项目把进度写入一次索引
+metadata_backfill_lock = threading.Lock()
+
+# 清理任务 - 单线程执行器保证同一时间只有一个清理在运行
+# 任务状态保存在项目索引的 background_jobs 表中（kind 为 cleanup），任何 worker 都能查询
+cleanup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cleanup')
+cleanup_lock = threading.Lock()
+MAX_CLEANUP_JOB_HISTORY = 20
+
+# 上传后处理流水线 - 上传接口只做持久化写入并立即返回预览地址，
+# CDN 链接替换、元数据提取、索引更新和 CDN 预取在有界线程池中分阶段执行
+UPLOAD_PIPELINE_WORKERS = int(os.environ.get('UPLOAD_PIPELINE_WORKERS', 2))
+UPLOAD_PIPELINE_MAX_PENDING = int(os.environ.get('UPLOAD_PIPELINE_MAX_PENDING', 100))  # 排队上限，超过后上传返回 503
+UPLOAD_PIPELINE_MAX_RETRIES = int(os.environ.get('UPLOAD_PIPELINE_MAX_RETRIES', 3))  # 每个阶段的最大尝试次数
+UPLOAD_PIPELINE_RETRY_DELAY_SECONDS = float(os.environ.get('UPLOAD_PIPELINE_RETRY_DELAY_SECONDS', 0.5))  # 重试退避基数
+UPLOAD_PREFETCH_CDN = os.environ.get('UPLOAD_PREFETCH_CDN', 'False').lower() == 'true'  # 是否预取页面引用的 CDN 资源
+UPLOAD_PREFETCH_MAX_URLS = 20
+UPLOAD_PENDING_MARKER = '.pending'  # 后处理未完成的标记文件，重启后据此恢复任务
+MAX_UPLOAD_JOB_HISTORY = 1000
+upload_pipeline_executor = ThreadPoolExecutor(max_workers=UPLOAD_PIPELINE_WORKERS, thread_name_prefix='upload-pipeline')
+upload_pipeline_slots = threading.BoundedSemaphore(UPLOAD_PIPELINE_MAX_PENDING)
+# 后处理状态保存在项目索引的 background_jobs 表中（kind 为 upload），任何 worker 都能查询到同一份进度
+
+# 缩略图规范化 - 上传的截图在进程池中解码、校验并缩放，保存为多个宽度的 WebP 和一份 PNG 兜底
+THUMBNAIL_WIDTHS = (320, 640)  # WebP 版本的宽度，用于 srcset
+THUMBNAIL_PNG_WIDTH = 640  # thumbnail.png 兜底版本的宽度
+THUMBNAIL_WEBP_QUALITY = int(os.environ.get('THUMBNAIL_WEBP_QUALITY', 80))
+THUMBNAIL_MAX_UPLOAD_SIZE = int(os.environ.get('THUMBNAIL_MAX_UPLOAD_SIZE', 5 * 1024 * 1024))  # 上传图片的字节数上限
+THUMBNAIL_MAX_PIXELS = int(os.environ.get('THUMBNAIL_MAX_PIXELS', 25000000))  # 像素数上限，防止解压炸弹
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+THUMBNAIL_PROCESS_TIMEOUT_SECONDS = 30
+THUMBNAIL_UPLOAD_MIMETYPES = ('image/png', 'image/webp', 'image/jpeg')  # 可直接作为请求体上传的图片类型
+THUMBNAIL_STREAM_CHUNK_SIZE = 64 * 1024  # 流式接收缩略图时每次读取的字节数
+thumbnail_pool = None  # 首次使用时创建
+thumbnail_pool_lock = threading.Lock()
+
+# 缩略图拼图配置 - 项目列表的一页缩略图合成一张图片，减少首页的图片请求数
+THUMBNAIL_SPRITE_COLUMNS = 5
+THUMBNAIL_SPRITE_MAX_TILE_HEIGHT = 400  # 单个缩略图在拼图中的最大高度，超出部分从底部裁掉
+THUMBNAIL_SPRITE_CACHE_SIZE = int(os.environ.get('THUMBNAIL_SPRITE_CACHE_SIZE', 32))  # 内存中缓存的拼图数量
+THUMBNAIL_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'  # 带版本号的缩略图地址内容不会变化
+
+# 缩略图生成租约配置 - 同一项目同一时间只让一个浏览器截图上传
+THUMBNAIL_LEASE_SECONDS = int(os.environ.get('THUMBNAIL_LEASE_SECONDS', 60))  # 租约有效期，持有者消失后到期释放
+THUMBNAIL_LEASE_RETRY_SECONDS = 5  # 未拿到租约的客户端多久后再来查询
+thumbnail_sprite_cache = OrderedDict()  # 拼图版本 -> (拼图字节, 各项目坐标)，LRU 淘汰
+thumbnail_sprite_lock = threading.Lock()
+thumbnail_sprite_building = set()  # 正在后台生成的拼图版本，避免重复提交
+# 项目列表接口不等待拼图生成，未命中缓存时提交到这里在后台生成
+thumbnail_sprite_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='thumbnail-sprite')
+
+# 存储用量缓存 - 上传时不再每次遍历 static/ 统计大小
+STORAGE_USAGE_CACHE_TTL = int(os.environ.get('STORAGE_USAGE_CACHE_TTL', 60))
+storage_usage_cache = {
+    'bytes': None,
+    'timestamp': 0
+}
 
 # 常见CDN域名列表
 CDN_DOMAINS = [
@@ -88,6 +433,24 @@ CDN_DOMAINS = [
     'use.fontawesome.com'
 ]
 
+# 匹配CDN链接的正则表达式
+CDN_URL_PATTERN = re.compile(r'(https?://(?:' + '|'.join(re.escape(domain) for domain in CDN_DOMAINS) + r')[^\s"\'<>]*)')
+
+# HTML 元数据提取 - 以下规则与 BeautifulSoup 的 html.parser 树构建保持一致
+METADATA_PARSE_CHUNK_SIZE = 4 * 1024  # 流式解析每次喂入的字符数
+METADATA_TAG_PATTERN = re.compile(r'<(title|meta)', re.IGNORECASE)
+HTML_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+HTML_VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta',
+    'param', 'source', 'track', 'wbr',
+    'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex', 'nextid', 'spacer',
+])
+HTML_STRING_CONTAINER_TAGS = frozenset(['rt', 'rp', 'style', 'script', 'template'])
+HTML_PRESERVE_WHITESPACE_TAGS = frozenset(['pre', 'textarea'])
+HTML_ENTITY_TO_CHARACTER = {}
+for _entity_name, _character in sorted(html5_entities.items()):
+    HTML_ENTITY_TO_CHARACTER.setdefault(_entity_name.rstrip(';'), _character)
+
 def get_host_url():
     """获取主机URL，从环境变量读取，如果没有则使用默认值"""
     host_url = os.environ.get('HOST_URL', f'http://127.0.0.1:{port}')
@@ -99,6 +462,63 @@ def generate_random_string(length=8):
     """生成随机字符串作为目录名"""
     return secrets.token_urlsafe(length)[:length]
 
+def is_valid_project_id(project_id):
+    """检查项目ID是否合法（防止目录遍历，并排除 static/ 下的保留目录）"""
+    return bool(PROJECT_ID_PATTERN.match(project_id)) and project_id not in RESERVED_STATIC_DIRS
+
+def get_shard_path(project_id):
+    """
+    项目在分片布局中的目录路径
+    static/shards/<xx>/<yy>/<project_id>，xx/yy 取自项目ID的 SHA256 前四位
+    """
+    digest = hashlib.sha256(project_id.encode('utf-8')).hexdigest()
+    return os.path.join(app.config['UPLOAD_FOLDER'], PROJECT_SHARD_ROOT, digest[:2], digest[2:4], project_id)
+
+def get_project_dir(project_id):
+    """
+    获取项目目录路径，对调用方屏蔽分片布局
+    优先返回分片目录，其次返回旧的平铺目录；都不存在时返回分片目录（用于新建项目）
+    迁移工具的 rename 恰好发生在两次检查之间时，最后再查一次分片目录
+    项目ID不合法时返回 None
+    """
+    if not is_valid_project_id(project_id):
+        return None
+
+    sharded_path = get_shard_path(project_id)
+    if os.path.isdir(sharded_path):
+        return sharded_path
+    legacy_path = os.path.join(app.config['UPLOAD_FOLDER'], project_id)
+    if os.path.isdir(legacy_path):
+        return legacy_path
+    return sharded_path
+
+def iter_project_dirs():
+    """
+    遍历所有项目目录（分片目录和旧的平铺目录）
+    生成 (project_id, 目录路径)，不检查目录中是否有 index.html；目录名不是合法项目ID的跳过
+    """
+    static_dir = app.config['UPLOAD_FOLDER']
+
+    def list_subdirs(path):
+        try:
+            with os.scandir(path) as entries:
+                return [entry for entry in entries if entry.is_dir()]
+        except FileNotFoundError:
+            return []
+
+    seen = set()
+    for level1 in list_subdirs(os.path.join(static_dir, PROJECT_SHARD_ROOT)):
+        for level2 in list_subdirs(level1.path):
+            for entry in list_subdirs(level2.path):
+                seen.add(entry.name)
+                yield entry.name, entry.path
+
+    for entry in list_subdirs(static_dir):
+        # 跳过保留目录和不是合法项目ID的目录（如批量上传的 .bulk-* 暂存目录）；
+        # 迁移过程中同一个项目可能先后出现在两处，只返回一次
+        if is_valid_project_id(entry.name) and entry.name not in seen:
+            yield entry.name, entry.path
+
 def get_url_hash(url):
     """
     生成 URL 的哈希值作为缓存文件名
@@ -134,24 +554,20 @@ def get_cdn_from_memory_cache(url_hash):
     从内存缓存中获取 CDN 资源
     返回 (content, content_type, timestamp) 或 None
     """
-    if url_hash in cdn_memory_cache:
-        # LRU: 移动到末尾表示最近使用
-        cdn_memory_cache.move_to_end(url_hash)
-        return cdn_memory_cache[url_hash]
-    return None
+    cached = get_cdn_memory_cache().get(url_hash)
+    if cached is None:
+        return None
+    content, content_type, timestamp = cached
+    return content, content_type.decode('utf-8'), timestamp
 
 def set_cdn_to_memory_cache(url_hash, content, content_type):
     """
     将 CDN 资源存储到内存缓存
-    使用 LRU 策略，超过最大条目数时删除最旧的
+    容量用尽时淘汰最旧的条目，对所有 worker 进程可见
     """
-    if url_hash in cdn_memory_cache:
-        cdn_memory_cache.move_to_end(url_hash)
-    else:
-        cdn_memory_cache[url_hash] = (content, content_type, time.time())
-        # LRU: 如果超过最大条目数，删除最旧的（第一个）
-        if len(cdn_memory_cache) > CDN_CACHE_MAX_MEMORY_ITEMS:
-            cdn_memory_cache.popitem(last=False)
+    cache = get_cdn_memory_cache()
+    if url_hash not in cache:
+        cache.set(url_hash, content, content_type.encode('utf-8'))
 
 def get_cdn_from_file_cache(url_hash, content_type):
     """
@@ -196,7 +612,7 @@ def set_cdn_to_file_cache(url_hash, content, content_type):
         with open(cache_path, 'wb') as f:
             f.write(content)
 
-        logger.info(f"CDN 资源已缓存到文件: {cache_path} ({len(content)} bytes)")
+        log_event('cdn_cache_write', f"CDN 资源已缓存到文件: {cache_path} ({len(content)} bytes)")
         return True
 
     except Exception as e:
@@ -206,23 +622,33 @@ def set_cdn_to_file_cache(url_hash, content, content_type):
 def get_directory_size(path):
     """
     计算目录的总大小（包括所有子文件和子目录）
+    硬链接到同一内容的多个文件只计算一次
     返回字节数
     """
     total_size = 0
+    seen_inodes = set()
     try:
         for dirpath, dirnames, filenames in os.walk(path):
             for filename in filenames:
                 file_path = os.path.join(dirpath, filename)
                 # 跳过符号链接
-                if not os.path.islink(file_path):
-                    total_size += os.path.getsize(file_path)
+                if os.path.islink(file_path):
+                    continue
+                file_stat = os.stat(file_path)
+                if file_stat.st_nlink > 1:
+                    inode = (file_stat.st_dev, file_stat.st_ino)
+                    if inode in seen_inodes:
+                        continue
+                    seen_inodes.add(inode)
+                total_size += file_stat.st_size
     except Exception as e:
         logger.error(f"计算目录大小失败: {e}")
     return total_size
 
-def check_storage_quota():
+def check_storage_quota(max_age=0):
     """
     检查当前存储使用情况是否超过配额
+    max_age > 0 时允许使用不超过 max_age 秒的缓存用量，避免每次上传都遍历整个目录
     返回 (is_within_quota, current_size, quota)
     """
     try:
@@ -230,7 +656,13 @@ def check_storage_quota():
         if not os.path.exists(static_dir):
             return True, 0, MAX_STORAGE_QUOTA
 
-        current_size = get_directory_size(static_dir)
+        cached_size = storage_usage_cache['bytes']
+        if cached_size is not None and time.time() - storage_usage_cache['timestamp'] < max_age:
+            current_size = cached_size
+        else:
+            current_size = get_directory_size(static_dir)
+            storage_usage_cache['bytes'] = current_size
+            storage_usage_cache['timestamp'] = time.time()
         is_within_quota = current_size < MAX_STORAGE_QUOTA
         return is_within_quota, current_size, MAX_STORAGE_QUOTA
     except Exception as e:
@@ -238,15 +670,322 @@ def check_storage_quota():
         # 出错时保守策略：允许上传
         return True, 0, MAX_STORAGE_QUOTA
 
+def add_storage_usage(size):
+    """上传成功后累加缓存的存储用量，下次遍历目录时再校准"""
+    if storage_usage_cache['bytes'] is not None:
+        storage_usage_cache['bytes'] += size
+
+def get_project_index():
+    """
+    获取当前线程的项目索引连接
+    首次连接时自动建表，索引路径变化（如测试中切换目录）时重新连接
+    """
+    index_path = app.config['PROJECT_INDEX_PATH']
+    conn = getattr(_project_index_local, 'conn', None)
+    if conn is not None and _project_index_local.path == index_path:
+        return conn
+    if conn is not None:
+        conn.close()
+
+    conn = sqlite3.connect(index_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(PROJECT_INDEX_SCHEMA)
+    _project_index_local.conn = conn
+    _project_index_local.path = index_path
+    return conn
+
+def record_project_access(project_id, views=1):
+    """
+    记录一次项目访问（仅写内存，不做任何 I/O）
+    上传时以 views=0 调用，只刷新最后访问时间
+    并发请求下访问次数可能少计，作为统计数据可以接受
+    """
+    previous = project_access_log.get(project_id)
+    project_access_log[project_id] = (time.time(), previous[1] + views if previous else views)
+
+def flush_project_access_log():
+    """
+    将内存中的访问记录批量写入项目索引
+    由后台定时任务调用，清理前也会先调用一次
+    返回写入的项目数
+    """
+    # 逐条 popitem 取出记录，期间新到的访问写入同一个字典，留待下一批
+    batch = []
+    while True:
+        try:
+            project_id, (last_access, count) = project_access_log.popitem()
+        except KeyError:
+            break
+        batch.append((project_id, last_access, count))
+
+    if not batch:
+        return 0
+
+    try:
+        conn = get_project_index()
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO projects (id, last_access, access_count) VALUES (?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    last_access = MAX(last_access, excluded.last_access),
+                    access_count = access_count + excluded.access_count
+                """,
+                batch
+            )
+        logger.info(f"访问记录已写入项目索引 ({len(batch)} 个项目)")
+    except Exception as e:
+        logger.error(f"写入访问记录失败: {e}")
+        # 写入失败时放回内存，等待下一次落盘
+        for project_id, last_access, count in batch:
+            record = project_access_log.get(project_id)
+            if record:
+                last_access = max(last_access, record[0])
+                count += record[1]
+            project_access_log[project_id] = (last_access, count)
+        return 0
+
+    return len(batch)
+
+def sync_project_index():
+    """
+    把索引中缺失的旧项目补录进索引（只在索引首次使用时执行一次）
+    以 index.html 的修改时间作为初始最后访问时间
+    返回补录的项目数
+    """
+    conn = get_project_index()
+    if conn.execute("SELECT 1 FROM index_meta WHERE key = 'synced_at'").fetchone():
+        return 0
+
+    rows = []
+    for project_id, project_dir in iter_project_dirs():
+        try:
+            rows.append((project_id, os.path.getmtime(get_project_html_path(project_dir))))
+        except OSError:
+            continue
+
+    with conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO projects (id, last_access) VALUES (?, ?)',
+            rows
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO index_meta (key, value) VALUES ('synced_at', ?)",
+            (str(time.time()),)
+        )
+    logger.info(f"项目索引已同步 (共 {len(rows)} 个项目)")
+    return len(rows)
+
+def get_expired_projects(cutoff, limit):
+    """
+    按最后访问时间从旧到新返回过期项目
+    依赖 last_access 上的索引，只读取过期的行
+    返回 [(project_id, last_access), ...]
+    """
+    conn = get_project_index()
+    return conn.execute(
+        'SELECT id, last_access FROM projects WHERE last_access < ? ORDER BY last_access LIMIT ?',
+        (cutoff, limit)
+    ).fetchall()
+
+def remove_from_project_index(project_ids):
+    """
+    从项目索引中移除已删除的项目，并释放它们对共享内容的引用
+    """
+    try:
+        conn = get_project_index()
+        with conn:
+            conn.executemany('DELETE FROM projects WHERE id = ?', [(pid,) for pid in project_ids])
+            conn.executemany('DELETE FROM thumbnail_leases WHERE project_id = ?', [(pid,) for pid in project_ids])
+            conn.executemany("DELETE FROM background_jobs WHERE kind = 'upload' AND id = ?",
+                             [(pid,) for pid in project_ids])
+    except Exception as e:
+        logger.error(f"从项目索引移除项目失败: {e}")
+    for project_id in project_ids:
+        project_access_log.pop(project_id, None)
+        release_project_blob(project_id)
+
+def get_blob_path(content_hash, suffix='.gz'):
+    """获取内容寻址存储中某个哈希对应的文件路径，suffix 为压缩格式后缀（'' 表示未压缩）"""
+    return os.path.join(app.config['UPLOAD_FOLDER'], BLOB_STORE_ROOT, content_hash[:2], f"{content_hash}.html{suffix}")
+
+def get_blob_suffixes():
+    """当前配置下共享内容需要保存的各个版本"""
+    suffixes = ['.gz']
+    if PREVIEW_BROTLI_ENABLED:
+        suffixes.append('.br')
+    if PREVIEW_KEEP_RAW_HTML:
+        suffixes.append('')
+    return suffixes
+
+def encode_html(html_bytes, suffix):
+    """按后缀压缩HTML；gzip 固定 mtime，相同内容得到相同的字节"""
+    if suffix == '.gz':
+        return gzip.compress(html_bytes, compresslevel=9, mtime=0)
+    if suffix == '.br':
+        return brotli.compress(html_bytes, mode=brotli.MODE_TEXT)
+    return html_bytes
+
+def read_blob_html(content_hash):
+    """从任意一个已保存的版本读出共享内容的原始HTML字节，都不存在时抛出 FileNotFoundError"""
+    for suffix in ('.gz', ''):
+        blob_path = get_blob_path(content_hash, suffix)
+        if os.path.exists(blob_path):
+            with open(blob_path, 'rb') as f:
+                data = f.read()
+            return gzip.decompress(data) if suffix == '.gz' else data
+    raise FileNotFoundError(get_blob_path(content_hash))
+
+def get_source_hash(html_content):
+    """
+    计算上传原文的哈希，用于在替换CDN链接之前就识别重复上传
+    替换结果取决于 HOST_URL，因此一并计入
+    """
+    return hashlib.sha256(f"{get_host_url()}\0{html_content}".encode('utf-8')).hexdigest()
+
+def find_blob_by_source(source_hash):
+    """按上传原文哈希查找已存在的共享内容，返回内容哈希或 None"""
+    try:
+        row = get_project_index().execute(
+            'SELECT hash FROM blobs WHERE source_hash = ? AND refcount > 0 LIMIT 1', (source_hash,)
+        ).fetchone()
+    except Exception as e:
+        logger.error(f"查询共享内容失败: {e}")
+        return None
+    if row and os.path.exists(get_blob_path(row[0])):
+        return row[0]
+    return None
+
+def link_blob(blob_path, target_path):
+    """
+    把共享内容放到项目目录：优先硬链接，文件系统不支持时复制
+    先链接到临时文件再 rename，替换已有文件时读者不会看到中间状态
+    """
+    tmp_path = f"{target_path}.{threading.get_ident()}.link"
+    try:
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            shutil.copyfile(blob_path, tmp_path)
+        os.replace(tmp_path, target_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def get_blob_lock_path():
+    """共享内容的文件锁位于项目索引旁，同一份数据目录上的所有进程竞争同一把锁"""
+    return f"{app.config['PROJECT_INDEX_PATH']}.blobs.lock"
+
+@contextmanager
+def blob_store_locked():
+    """
+    独占内容寻址存储：引用计数的检查与更新和共享文件的写入、链接、删除在同一把锁内完成，
+    避免一个 worker 把引用计数减到零、正要删除文件时，另一个 worker 刚把新项目链接到这个文件
+    进程内先用线程锁串行化，再对 .blobs.lock 加 flock（每次新打开文件，fork 后的子进程也不会共用锁）；
+    不支持 fcntl 的平台上没有多进程部署，只用线程锁
+    """
+    with blob_store_lock:
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(get_blob_lock_path(), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+def attach_project_blob(project_id, project_dir, content_hash, content=None, source_hash=None):
+    """
+    让项目的 index.html 指向共享内容并增加引用计数
+    content 不为空且共享内容尚不存在时先写入（缺少的压缩版本从已有版本补齐）；
+    项目原先指向其它内容时释放旧引用
+    """
+    html_bytes = content.encode('utf-8') if content is not None else None
+    suffixes = get_blob_suffixes()
+    with blob_store_locked():
+        conn = get_project_index()
+        row = conn.execute('SELECT hash FROM project_blobs WHERE project_id = ?', (project_id,)).fetchone()
+        previous_hash = row[0] if row else None
+
+        blob_size = 0
+        for suffix in suffixes:
+            blob_path = get_blob_path(content_hash, suffix)
+            if not os.path.exists(blob_path):
+                if html_bytes is None:
+                    html_bytes = read_blob_html(content_hash)
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                write_file_atomic(blob_path, encode_html(html_bytes, suffix), durable=True)
+            link_blob(blob_path, os.path.join(project_dir, f'index.html{suffix}'))
+            blob_size += os.path.getsize(blob_path)
+
+        # 删除不再需要的版本（不保留原文时删除上传时写入的未压缩 index.html）
+        for suffix in ('',) + tuple(HTML_ENCODING_SUFFIXES.values()):
+            stale_file = os.path.join(project_dir, f'index.html{suffix}')
+            if suffix not in suffixes and os.path.exists(stale_file):
+                os.remove(stale_file)
+
+        if previous_hash == content_hash:
+            return
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO blobs (hash, source_hash, size, refcount) VALUES (?, ?, ?, 1)
+                ON CONFLICT(hash) DO UPDATE SET
+                    refcount = refcount + 1,
+                    source_hash = COALESCE(blobs.source_hash, excluded.source_hash)
+                """,
+                (content_hash, source_hash, blob_size)
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO project_blobs (project_id, hash) VALUES (?, ?)',
+                (project_id, content_hash)
+            )
+        if previous_hash:
+            _release_blob(conn, previous_hash)
+
+def store_project_html(project_id, project_dir, html_content, source_hash=None):
+    """
+    按内容哈希保存项目的 index.html，相同内容只在磁盘上保存一份
+    返回内容哈希
+    """
+    content_hash = hashlib.sha256(html_content.encode('utf-8')).hexdigest()
+    attach_project_blob(project_id, project_dir, content_hash, content=html_content, source_hash=source_hash)
+    return content_hash
+
+def _release_blob(conn, content_hash):
+    """减少共享内容的引用计数，归零时删除记录和文件（调用方须处于 blob_store_locked 之内）"""
+    with conn:
+        conn.execute('UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?', (content_hash,))
+        row = conn.execute('SELECT refcount FROM blobs WHERE hash = ?', (content_hash,)).fetchone()
+        if row and row[0] <= 0:
+            conn.execute('DELETE FROM blobs WHERE hash = ?', (content_hash,))
+    if row and row[0] <= 0:
+        for suffix in ('',) + tuple(HTML_ENCODING_SUFFIXES.values()):
+            blob_path = get_blob_path(content_hash, suffix)
+            if os.path.exists(blob_path):
+                os.remove(blob_path)
+
+def release_project_blob(project_id):
+    """项目删除后释放它对共享内容的引用，其它指向同一内容的项目不受影响"""
+    try:
+        with blob_store_locked():
+            conn = get_project_index()
+            row = conn.execute('SELECT hash FROM project_blobs WHERE project_id = ?', (project_id,)).fetchone()
+            if not row:
+                return
+            with conn:
+                conn.execute('DELETE FROM project_blobs WHERE project_id = ?', (project_id,))
+            _release_blob(conn, row[0])
+    except Exception as e:
+        logger.error(f"释放共享内容引用失败: 项目ID={project_id}, 错误={e}")
+
 def replace_cdn_links(html_content):
     """
     替换HTML中的CDN链接为代理链接
     """
     host_url = get_host_url()
     
-    # 匹配CDN链接的正则表达式
-    cdn_pattern = r'(https?://(?:' + '|'.join(re.escape(domain) for domain in CDN_DOMAINS) + r')[^\s"\'<>]*)'
-    
     def replace_url(match):
         original_url = match.group(1)
         # 将URL编码后作为代理参数
@@ -256,7 +995,7 @@ def replace_cdn_links(html_content):
         return proxy_url
     
     # 替换HTML中的CDN链接
-    modified_html = re.sub(cdn_pattern, replace_url, html_content)
+    modified_html = CDN_URL_PATTERN.sub(replace_url, html_content)
     return modified_html
 
 def sanitize_html(html_content):
@@ -264,6 +1003,8 @@ def sanitize_html(html_content):
     HTML内容清理函数
     使用bleach库进行安全清理,防止XSS攻击
     """
+    import bleach
+
     # 允许的HTML标签列表(包含常用的HTML5标签)
     allowed_tags = [
         'a', 'abbr', 'acronym', 'address', 'article', 'aside', 'audio',
@@ -336,218 +1077,1577 @@ def sanitize_html(html_content):
 
     return cleaned_html
 
-def extract_html_metadata(html_content):
+class _MetadataComplete(Exception):
+    """元数据字段已全部确定，用于提前结束解析"""
+
+class HTMLMetadataParser(HTMLParser):
     """
-    从HTML内容中提取元数据（标题、描述等）
+    流式 HTML 元数据解析器
+    只跟踪标签栈以及 <title>、description meta、第一个 <h1>、第一个 <p>，不构建文档树；
+    文本合并、空白折叠、实体转换、自闭合标签等规则与 BeautifulSoup(html.parser) 保持一致，
+    提取结果与原先基于 BeautifulSoup 的实现完全相同
     """
-    try:
-        soup = BeautifulSoup(html_content, 'html.parser')
 
-        # 提取标题
+    def __init__(self):
+        # 与 BeautifulSoup 相同：字符引用由解析器自行转换
+        super().__init__(convert_charrefs=False)
+        self.stack = []  # 当前打开的标签名
+        self.already_closed_empty_element = []
+        self.container_depth = 0  # script/style 等特殊字符串容器的嵌套层数
+        self.preserve_whitespace_depth = 0  # pre/textarea 的嵌套层数
+        self.current_data = []
+
+        # <title>：只为第一个 title 记录一棵很小的子树，用来计算 BeautifulSoup 的 .string
+        self.title_found = False
+        self.title_done = False
+        self.title_depth = None
+        self.title_nodes = []  # 与 stack 中 title 及其后代一一对应的子节点列表
+        self.title = None
+
+        # 第一个 <h1> 和第一个 <p> 的文本
+        self.h1_depth = None
+        self.h1_parts = None
+        self.h1_done = False
+        self.p_depth = None
+        self.p_parts = None
+        self.p_done = False
+
+        # 第一个 name="description" 的 meta
+        self.meta_description = None
+
+    # ---- 与 BeautifulSoup 树构建等价的栈操作 ----
+
+    def _end_data(self, string_type='text'):
+        """结束当前文本片段（对应 BeautifulSoup.endData）"""
+        if not self.current_data:
+            return
+        data = ''.join(self.current_data)
+        self.current_data = []
+
+        if not self.preserve_whitespace_depth:
+            for char in data:
+                if char not in HTML_ASCII_SPACES:
+                    break
+            else:
+                data = '\n' if '\n' in data else ' '
+
+        # 位于 script/style 等容器中的普通文本不会出现在 get_text() 中
+        if string_type == 'text' and self.container_depth:
+            string_type = 'container'
+
+        if string_type in ('text', 'cdata'):
+            if self.h1_parts is not None and not self.h1_done:
+                self.h1_parts.append(data)
+            if self.p_parts is not None and not self.p_done:
+                self.p_parts.append(data)
+        if self.title_nodes:
+            self.title_nodes[-1].append(data)
+
+    def _push(self, name):
+        self.stack.append(name)
+        if name in HTML_STRING_CONTAINER_TAGS:
+            self.container_depth += 1
+        if name in HTML_PRESERVE_WHITESPACE_TAGS:
+            self.preserve_whitespace_depth += 1
+
+        if self.title_nodes:
+            node = []
+            self.title_nodes[-1].append(node)
+            self.title_nodes.append(node)
+        elif name == 'title' and not self.title_found:
+            self.title_found = True
+            self.title_depth = len(self.stack)
+            self.title_nodes.append([])
+
+        if name == 'h1' and self.h1_depth is None:
+            self.h1_depth = len(self.stack)
+            self.h1_parts = []
+        if name == 'p' and self.p_depth is None:
+            self.p_depth = len(self.stack)
+            self.p_parts = []
+
+    def _pop(self):
+        name = self.stack.pop()
+        if name in HTML_STRING_CONTAINER_TAGS:
+            self.container_depth -= 1
+        if name in HTML_PRESERVE_WHITESPACE_TAGS:
+            self.preserve_whitespace_depth -= 1
+
+        depth = len(self.stack)
+        if self.title_nodes:
+            node = self.title_nodes.pop()
+            if depth + 1 == self.title_depth:
+                self._finish_title(node)
+        if self.h1_depth is not None and depth < self.h1_depth:
+            self.h1_done = True
+        if self.p_depth is not None and depth < self.p_depth:
+            self.p_done = True
+
+    def _pop_to_tag(self, name):
+        if name not in self.stack:
+            return
+        while self.stack:
+            popped = self.stack[-1]
+            self._pop()
+            if popped == name:
+                break
+
+    def _finish_title(self, node):
+        """计算 title 的 .string：唯一子节点为字符串时取该字符串，唯一子节点为标签时递归"""
+        while len(node) == 1 and isinstance(node[0], list):
+            node = node[0]
+        self.title = node[0] if len(node) == 1 else None
+        self.title_done = True
+
+    # ---- HTMLParser 回调 ----
+
+    def handle_starttag(self, name, attrs, handle_empty_element=True):
+        attr_dict = {}
+        for key, value in attrs:
+            attr_dict[key] = '' if value is None else value
+
+        self._end_data()
+        self._push(name)
+        if name == 'meta' and self.meta_description is None and attr_dict.get('name') == 'description':
+            self.meta_description = attr_dict.get('content', '')
+
+        if name in HTML_VOID_ELEMENTS and handle_empty_element:
+            self.handle_endtag(name, check_already_closed=False)
+            self.already_closed_empty_element.append(name)
+
+    def handle_startendtag(self, name, attrs):
+        self.handle_starttag(name, attrs, handle_empty_element=False)
+        self.handle_endtag(name)
+
+    def handle_endtag(self, name, check_already_closed=True):
+        if check_already_closed and name in self.already_closed_empty_element:
+            self.already_closed_empty_element.remove(name)
+        else:
+            self._end_data()
+            self._pop_to_tag(name)
+
+    def handle_data(self, data):
+        self.current_data.append(data)
+
+    def handle_charref(self, name):
+        if name[0] in 'xX':
+            codepoint = int(name.lstrip(name[0]), 16)
+        else:
+            codepoint = int(name)
+
+        data = None
+        if codepoint < 256:
+            try:
+                data = bytearray([codepoint]).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(codepoint)
+            except (ValueError, OverflowError):
+                pass
+        self.handle_data(data or '\N{REPLACEMENT CHARACTER}')
+
+    def handle_entityref(self, name):
+        character = HTML_ENTITY_TO_CHARACTER.get(name)
+        self.handle_data(character if character is not None else f'&{name}')
+
+    def _handle_special(self, data, string_type):
+        self._end_data()
+        self.current_data.append(data)
+        self._end_data(string_type)
+
+    def handle_comment(self, data):
+        self._handle_special(data, 'comment')
+
+    def handle_decl(self, data):
+        self._handle_special(data[len('DOCTYPE '):], 'doctype')
+
+    def unknown_decl(self, data):
+        if data.upper().startswith('CDATA['):
+            self._handle_special(data[len('CDATA['):], 'cdata')
+        else:
+            self._handle_special(data, 'declaration')
+
+    def handle_pi(self, data):
+        self._handle_special(data, 'pi')
+
+    # ---- 流式解析 ----
+
+    def parse(self, html_content, chunk_size=None):
+        """
+        分块解析文档，标题和描述都已确定时提前停止
+        文档中最后一个 <title / <meta 之后的部分不可能再改变结果，据此判断能否提前结束
+        """
+        chunk_size = chunk_size or METADATA_PARSE_CHUNK_SIZE
+        last_positions = None
+
+        fed = 0
+        try:
+            while fed < len(html_content):
+                self.feed(html_content[fed:fed + chunk_size])
+                fed += chunk_size
+                parsed_upto = fed - len(self.rawdata)
+
+                title_settled = self.title_done
+                description_settled = self.meta_description is not None
+                if not (title_settled and description_settled):
+                    # 只有需要退回 <h1>/<p> 时才扫描一次文档中 <title / <meta 的位置
+                    if not (self.h1_done or self.p_done):
+                        continue
+                    if last_positions is None:
+                        last_positions = {'title': -1, 'meta': -1}
+                        for match in METADATA_TAG_PATTERN.finditer(html_content):
+                            last_positions[match.group(1).lower()] = match.start()
+                    title_settled = title_settled or (
+                        self.h1_done and not self.title_found and parsed_upto > last_positions['title']
+                    )
+                    description_settled = description_settled or (
+                        self.p_done and parsed_upto > last_positions['meta']
+                    )
+                if title_settled and description_settled:
+                    raise _MetadataComplete()
+
+            self.close()
+            self._end_data()
+            while self.stack:
+                self._pop()
+        except _MetadataComplete:
+            pass
+
+    def get_metadata(self):
+        """按原先 BeautifulSoup 实现的规则组装结果"""
         title = None
-        if soup.title:
-            title = soup.title.string.strip()
-        elif soup.find('h1'):
-            title = soup.find('h1').get_text().strip()
+        if self.title_found:
+            # 与 soup.title.string.strip() 一致：.string 为 None 时整体按解析失败处理
+            if self.title is None:
+                raise ValueError('title has no single string')
+            title = self.title.strip()
+        elif self.h1_parts is not None:
+            title = ''.join(self.h1_parts).strip()
 
-        # 提取描述
         description = None
-        meta_desc = soup.find('meta', attrs={'name': 'description'})
-        if meta_desc:
-            description = meta_desc.get('content', '').strip()
-        elif soup.find('p'):
-            # 取第一个段落作为描述，限制长度
-            first_p = soup.find('p').get_text().strip()
+        if self.meta_description is not None:
+            description = self.meta_description.strip()
+        elif self.p_parts is not None:
+            first_p = ''.join(self.p_parts).strip()
             description = first_p[:100] + '...' if len(first_p) > 100 else first_p
 
         return {
             'title': title or '未命名项目',
             'description': description or '暂无描述'
         }
+
+def extract_html_metadata(html_content):
+    """
+    从HTML内容中提取元数据（标题、描述等）
+    使用流式解析，找到所需字段后即停止，不构建完整的文档树
+    """
+    try:
+        parser = HTMLMetadataParser()
+        parser.parse(html_content)
+        return parser.get_metadata()
     except Exception as e:
         return {
             'title': '未命名项目',
             'description': '暂无描述'
         }
 
+def write_file_atomic(file_path, content, durable=False):
+    """
+    原子写入文件（content 为 str 时按 UTF-8 写入，为 bytes 时原样写入）：
+    先写临时文件再 rename，读者不会看到写了一半的内容
+    durable=True 时在 rename 前 fsync，保证返回后内容已落盘
+    """
+    tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+    try:
+        if isinstance(content, bytes):
+            f = open(tmp_path, 'wb')
+        else:
+            f = open(tmp_path, 'w', encoding='utf-8')
+        with f:
+            f.write(content)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def write_json_atomic(file_path, data):
+    """
+    原子写入 JSON 文件
+    """
+    write_file_atomic(file_path, json.dumps(data, ensure_ascii=False, indent=2))
+
+def get_project_html_path(project_dir):
+    """
+    返回项目实际存在的页面文件：优先未压缩的 index.html，其次 index.html.gz
+    都不存在时返回 index.html 的路径
+    """
+    html_file = os.path.join(project_dir, 'index.html')
+    if not os.path.exists(html_file) and os.path.exists(f'{html_file}.gz'):
+        return f'{html_file}.gz'
+    return html_file
+
+def has_project_html(project_dir):
+    """检查项目目录中是否有页面文件（未压缩或压缩版本）"""
+    return os.path.exists(get_project_html_path(project_dir))
+
+def read_project_html(project_dir):
+    """读取项目页面的HTML文本，压缩存储时自动解压"""
+    html_file = get_project_html_path(project_dir)
+    if html_file.endswith('.gz'):
+        with gzip.open(html_file, 'rt', encoding='utf-8') as f:
+            return f.read()
+    with open(html_file, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def select_project_html_file(project_dir):
+    """
+    按客户端的 Accept-Encoding 选择要发送的页面文件
+    返回 (文件名, Content-Encoding)；只有压缩版本而客户端不支持压缩时返回 (None, None)
+    """
+    html_file = os.path.join(project_dir, 'index.html')
+    for encoding, suffix in HTML_ENCODING_SUFFIXES.items():
+        if request.accept_encodings[encoding] and os.path.exists(f'{html_file}{suffix}'):
+            return f'index.html{suffix}', encoding
+    if os.path.exists(html_file):
+        return 'index.html', None
+    if os.path.exists(f'{html_file}.gz'):
+        return None, None
+    abort(404)
+
+def send_static_file(project_dir, filename, mimetype=None):
+    """
+    发送项目目录中的文件
+    x-accel 模式下只返回 X-Accel-Redirect 头，由 nginx 发送文件内容；
+    x-sendfile 模式由 Flask 的 USE_X_SENDFILE 在 send_from_directory 中处理
+    """
+    if STATIC_OFFLOAD_MODE != 'x-accel':
+        # Flask 把相对目录解析到应用代码所在目录，而项目目录相对于工作目录，这里先转换为绝对路径
+        return send_from_directory(os.path.abspath(project_dir), filename, mimetype=mimetype)
+
+    file_path = safe_join(project_dir, filename)
+    if file_path is None or not os.path.isfile(file_path):
+        abort(404)
+    relative_path = os.path.relpath(file_path, app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+    response = Response(mimetype=mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = STATIC_OFFLOAD_PREFIX + urllib.parse.quote(relative_path)
+    return response
+
+def send_project_html(project_dir):
+    """
+    发送项目页面：客户端支持时直接发送预压缩的字节并带上 Content-Encoding，
+    否则发送未压缩文件；只有压缩版本时边读边解压
+    """
+    filename, content_encoding = select_project_html_file(project_dir)
+    if filename is None:
+        html_file = os.path.join(project_dir, 'index.html.gz')
+
+        def generate():
+            with gzip.open(html_file, 'rb') as f:
+                while True:
+                    chunk = f.read(HTML_STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+        response = Response(generate(), mimetype='text/html')
+    else:
+        response = send_static_file(project_dir, filename, mimetype='text/html')
+        if content_encoding:
+            response.headers['Content-Encoding'] = content_encoding
+
+    response.vary.add('Accept-Encoding')
+    return response
+
 def save_project_metadata(project_id, metadata):
     """
     保存项目元数据到JSON文件
     """
     try:
-        metadata_file = os.path.join(app.config['UPLOAD_FOLDER'], project_id, 'metadata.json')
+        metadata_file = os.path.join(get_project_dir(project_id), 'metadata.json')
         metadata['created_at'] = datetime.datetime.now().isoformat()
         metadata['id'] = project_id
 
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        write_json_atomic(metadata_file, metadata)
         return True
     except Exception as e:
         logger.error(f"保存元数据失败: {e}")
         return False
 
-def load_project_metadata(project_id):
+def get_project_created_at(project_dir):
+    """
+    没有元数据时的创建时间：取 index.html 的 ctime
+    每次返回相同的值，保证项目列表排序稳定
+    """
+    html_file = get_project_html_path(project_dir)
+    try:
+        timestamp = os.path.getctime(html_file)
+    except OSError:
+        timestamp = 0
+    return datetime.datetime.fromtimestamp(timestamp).isoformat()
+
+def load_project_metadata(project_id, project_dir=None):
     """
     加载项目元数据
+    缺少 metadata.json 的旧项目不在这里解析 HTML，也不在读取路径上触发回填：
+    回填由 leader 的定时任务一次性补写，补写完成前先返回默认标题和稳定的创建时间
     """
+    project_dir = project_dir or get_project_dir(project_id)
     try:
-        metadata_file = os.path.join(app.config['UPLOAD_FOLDER'], project_id, 'metadata.json')
+        metadata_file = os.path.join(project_dir, 'metadata.json')
         if os.path.exists(metadata_file):
             with open(metadata_file, 'r', encoding='utf-8') as f:
                 return json.load(f)
     except Exception as e:
         logger.error(f"加载元数据失败: {e}")
 
-    # 如果没有元数据文件，尝试从HTML中提取
-    try:
-        html_file = os.path.join(app.config['UPLOAD_FOLDER'], project_id, 'index.html')
-        if os.path.exists(html_file):
-            with open(html_file, 'r', encoding='utf-8') as f:
-                html_content = f.read()
-            metadata = extract_html_metadata(html_content)
-            metadata['id'] = project_id
-            metadata['created_at'] = datetime.datetime.fromtimestamp(
-                os.path.getctime(html_file)
-            ).isoformat()
-            return metadata
-    except Exception as e:
-        logger.error(f"从HTML提取元数据失败: {e}")
-
     return {
         'id': project_id,
         'title': '未命名项目',
         'description': '暂无描述',
-        'created_at': datetime.datetime.now().isoformat()
+        'created_at': get_project_created_at(project_dir)
     }
 
-def save_thumbnail_from_base64(project_id, base64_data):
+def backfill_single_project(project_id):
     """
-    从base64数据保存缩略图
+    为单个旧项目提取元数据并原子写入 metadata.json
+    已有元数据的项目直接跳过，因此任务中断后重新运行是安全的
+    返回 True 表示已写入或无需写入
     """
+    project_dir = get_project_dir(project_id)
+    metadata_file = os.path.join(project_dir, 'metadata.json')
     try:
-        # 移除data:image/png;base64,前缀
-        if base64_data.startswith('data:image/'):
-            base64_data = base64_data.split(',')[1]
-
-        # 解码base64数据
-        image_data = base64.b64decode(base64_data)
+        if os.path.exists(metadata_file):
+            return True
 
-        # 保存到文件
-        thumbnail_path = os.path.join(app.config['UPLOAD_FOLDER'], project_id, 'thumbnail.png')
-        with open(thumbnail_path, 'wb') as f:
-            f.write(image_data)
+        html_content = read_project_html(project_dir)
+        metadata = extract_html_metadata(html_content)
+        metadata['id'] = project_id
+        metadata['created_at'] = get_project_created_at(project_dir)
 
+        write_json_atomic(metadata_file, metadata)
         return True
     except Exception as e:
-        logger.error(f"保存缩略图失败: {e}")
+        logger.error(f"回填项目元数据失败: 项目ID={project_id}, 错误={e}")
         return False
 
-def has_thumbnail(project_id):
-    """
-    检查项目是否有缩略图
-    """
-    thumbnail_path = os.path.join(app.config['UPLOAD_FOLDER'], project_id, 'thumbnail.png')
-    return os.path.exists(thumbnail_path) and os.path.getsize(thumbnail_path) > 0
+def is_metadata_backfill_done():
+    """项目索引中是否已记录回填完成（所有进程共享）"""
+    try:
+        return get_project_index().execute(
+            "SELECT 1 FROM index_meta WHERE key = 'metadata_backfilled_at'"
+        ).fetchone() is not None
+    except Exception as e:
+        logger.error(f"读取元数据回填标记失败: {e}")
+        return False
 
-def invalidate_projects_cache():
+def mark_metadata_backfill_done():
+    """在项目索引中记录回填已完成，之后的 leader 启动时不再遍历项目目录"""
+    try:
+        conn = get_project_index()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO index_meta (key, value) VALUES ('metadata_backfilled_at', ?)",
+                (str(time.time()),)
+            )
+    except Exception as e:
+        logger.error(f"记录元数据回填标记失败: {e}")
+
+def get_metadata_backfill_status():
+    """从项目索引读取最近一次回填的进度，从未运行过时返回 idle"""
+    return get_background_job('metadata_backfill', 'latest') or {
+        'status': 'idle',  # idle / running / completed / failed
+        'total': 0,
+        'done': 0,
+        'failed': 0,
+        'started_at': None,
+        'finished_at': None,
+    }
+
+def backfill_project_metadata():
     """
-    使项目列表缓存失效
-    在以下情况调用:上传项目、删除项目、清理过期项目、上传缩略图
+    为所有缺少 metadata.json 的旧项目补写元数据（leader 的定时任务）
+    项目索引中已记录回填完成时直接跳过；同一时间只运行一个回填任务，已有任务在运行时直接返回当前进度
     """
-    PROJECTS_CACHE['data'] = None
-    PROJECTS_CACHE['timestamp'] = 0
-    logger.info("项目列表缓存已失效")
+    if is_metadata_backfill_done():
+        return {'skipped': True}
+    if not metadata_backfill_lock.acquire(blocking=False):
+        return get_metadata_backfill_status()
+    return _run_metadata_backfill()
 
-def get_all_projects():
+def _run_metadata_backfill():
     """
-    获取所有已部署的项目列表
-    使用缓存机制减少文件系统遍历开销
+    回填任务主体（调用方须已持有 metadata_backfill_lock，结束时释放）
+    在线程池中并行处理，进度定期写入项目索引；其它进程正在回填时跳过
     """
-    # 检查缓存是否有效
-    current_time = time.time()
-    cache_age = current_time - PROJECTS_CACHE['timestamp']
-
-    if PROJECTS_CACHE['data'] is not None and cache_age < PROJECTS_CACHE['ttl']:
-        logger.debug(f"使用缓存的项目列表 (缓存年龄: {cache_age:.1f}秒)")
-        return PROJECTS_CACHE['data']
-
-    # 缓存无效或过期，重新获取项目列表
-    logger.info("重新获取项目列表并更新缓存")
-    projects = []
+    # 手动触发的回填可能落在任意 worker 上，用文件锁排除其它进程中正在运行的回填
+    lock_fd = try_lock_file(f"{app.config['PROJECT_INDEX_PATH']}.backfill.lock")
+    if lock_fd is None:
+        metadata_backfill_lock.release()
+        logger.info("其它进程正在回填元数据，跳过本次回填")
+        return dict(get_metadata_backfill_status(), skipped=True)
+
+    status = {
+        'status': 'running',
+        'total': 0,
+        'done': 0,
+        'failed': 0,
+        'pid': os.getpid(),
+        'started_at': datetime.datetime.now().isoformat(),
+        'finished_at': None,
+    }
     try:
-        static_dir = app.config['UPLOAD_FOLDER']
-        if not os.path.exists(static_dir):
-            return projects
-
-        for item in os.listdir(static_dir):
-            item_path = os.path.join(static_dir, item)
-            if os.path.isdir(item_path):
-                index_file = os.path.join(item_path, 'index.html')
-                if os.path.exists(index_file):
-                    # 加载项目元数据
-                    metadata = load_project_metadata(item)
-
-                    # 获取文件信息
-                    file_stat = os.stat(index_file)
-                    file_size = file_stat.st_size
-
-                    # 生成访问URL
-                    host_url = get_host_url()
-                    access_url = f"{host_url}/static/{item}/index.html"
-
-                    # 生成预览图URL
-                    thumbnail_url = f"{host_url}/static/{item}/thumbnail.png"
-
-                    project_info = {
-                        'id': item,
-                        'title': metadata.get('title', '未命名项目'),
-                        'description': metadata.get('description', '暂无描述'),
-                        'url': access_url,
-                        'thumbnail': thumbnail_url,
-                        'created_at': metadata.get('created_at'),
-                        'file_size': f"{file_size / 1024:.1f}KB" if file_size < 1024*1024 else f"{file_size / (1024*1024):.1f}MB"
-                    }
-                    projects.append(project_info)
-
-        # 按创建时间倒序排列
-        projects.sort(key=lambda x: x['created_at'], reverse=True)
-
-        # 更新缓存
-        PROJECTS_CACHE['data'] = projects
-        PROJECTS_CACHE['timestamp'] = time.time()
-        logger.info(f"项目列表已缓存 (共 {len(projects)} 个项目)")
+        save_background_job('metadata_backfill', 'latest', status)
+        pending = []
+        for project_id, project_dir in iter_project_dirs():
+            # 带有 .pending 标记的项目由上传后处理流水线负责写入元数据
+            if (has_project_html(project_dir)
+                    and not os.path.exists(os.path.join(project_dir, 'metadata.json'))
+                    and not os.path.exists(os.path.join(project_dir, UPLOAD_PENDING_MARKER))):
+                pending.append(project_id)
+
+        status['total'] = len(pending)
+        save_background_job('metadata_backfill', 'latest', status)
+        if pending:
+            logger.info(f"开始回填旧项目元数据 (共 {len(pending)} 个项目)")
+
+        with ThreadPoolExecutor(max_workers=METADATA_BACKFILL_WORKERS,
+                                thread_name_prefix='metadata-backfill') as pool:
+            for processed, success in enumerate(pool.map(backfill_single_project, pending), 1):
+                status['done' if success else 'failed'] += 1
+                if processed % METADATA_BACKFILL_SAVE_EVERY == 0:
+                    save_background_job('metadata_backfill', 'latest', status)
+
+        status['status'] = 'completed'
+        # 全部成功才记录完成，有失败的项目时下次 leader 启动会重试
+        if not status['failed']:
+            mark_metadata_backfill_done()
+        if pending:
+            logger.info(f"旧项目元数据回填完成，成功 {status['done']} 个，失败 {status['failed']} 个")
+        if status['done']:
+            invalidate_projects_cache()
 
     except Exception as e:
-        logger.error(f"获取项目列表失败: {e}")
-
-    return projects
+        logger.error(f"回填旧项目元数据失败: {e}")
+        status['status'] = 'failed'
+    finally:
+        status['finished_at'] = datetime.datetime.now().isoformat()
+        save_background_job('metadata_backfill', 'latest', status)
+        unlock_file(lock_fd)
+        metadata_backfill_lock.release()
 
-@app.route('/')
-def index():
-    """主页面 - 显示HTML输入表单"""
-    return render_template('index.html')
+    return status
 
-@app.route('/api/csrf-token', methods=['GET'])
-@csrf.exempt  # 获取token的端点需要豁免CSRF检查
-def get_csrf_token():
-    """获取CSRF令牌"""
-    token = generate_csrf()
-    return jsonify({'csrf_token': token})
+def start_metadata_backfill():
+    """
+    在后台线程中启动元数据回填（已在运行时不重复启动）
+    供手动触发接口使用，忽略项目索引中的完成标记
+    返回是否启动了新任务
+    """
+    if not metadata_backfill_lock.acquire(blocking=False):
+        return False
+    try:
+        threading.Thread(
+            target=_run_metadata_backfill,
+            name='metadata-backfill',
+            daemon=True
+        ).start()
+    except Exception:
+        metadata_backfill_lock.release()
+        raise
+    return True
+
+def pipeline_stage_rewrite(project_id, project_dir, context):
+    """后处理阶段：把 index.html 中的CDN链接替换为代理链接"""
+    html_content = read_project_html(project_dir)
+    context.setdefault('source_html', html_content)
+
+    # 注意: 这是一个HTML预览工具,用户需要能够使用JavaScript和完整HTML功能
+    # 安全措施通过以下方式实现:
+    # 1. 在 serve_static() 中添加 CSP 头限制恶意行为
+    # 2. X-Frame-Options 防止被恶意嵌入
+    # 3. 未来可以考虑将预览域名与主应用域名分离
+    # 如需启用HTML清理,请将下一行改为 sanitize_html(replace_cdn_links(html_content))
+    cleaned_html = replace_cdn_links(html_content)
+
+    # 替换后的内容按哈希去重保存，index.html 改为指向共享内容
+    store_project_html(project_id, project_dir, cleaned_html, context.get('source_hash'))
+
+def pipeline_stage_store(project_id, project_dir, context):
+    """后处理阶段：把 index.html 原样存入内容寻址存储（批量上传在解压时已替换过CDN链接）"""
+    store_project_html(project_id, project_dir, read_project_html(project_dir))
+
+def pipeline_stage_metadata(project_id, project_dir, context):
+    """后处理阶段：提取并保存项目元数据"""
+    metadata = extract_html_metadata(context['source_html'])
+    if not save_project_metadata(project_id, metadata):
+        raise IOError('保存元数据失败')
+
+def pipeline_stage_index(project_id, project_dir, context):
+    """后处理阶段：让新项目出现在项目列表中"""
+    invalidate_projects_cache()
+
+def pipeline_stage_prefetch(project_id, project_dir, context):
+    """
+    后处理阶段：预取页面引用的CDN资源到文件缓存（尽力而为，失败不影响项目）
+    默认关闭，通过 UPLOAD_PREFETCH_CDN=true 启用
+    """
+    if not UPLOAD_PREFETCH_CDN:
+        return
+    import requests
+
+    urls = list(OrderedDict.fromkeys(CDN_URL_PATTERN.findall(context['source_html'])))
+    for url in urls[:UPLOAD_PREFETCH_MAX_URLS]:
+        url_hash = get_url_hash(url)
+        if get_cdn_from_memory_cache(url_hash):
+            continue
+        try:
+            response = requests.get(url, timeout=10)
+            response.raise_for_status()
+            if len(response.content) > MAX_PROXY_SIZE:
+                continue
+            content_type = response.headers.get('Content-Type', 'text/plain')
+            if not get_cdn_from_file_cache(url_hash, content_type):
+                set_cdn_to_file_cache(url_hash, response.content, content_type)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"预取CDN资源失败: {url}, 错误: {e}")
+
+# 后处理阶段按顺序执行，每个阶段都可以安全地重复执行
+UPLOAD_PIPELINE_STAGES = [
+    ('rewrite', pipeline_stage_rewrite),
+    ('metadata', pipeline_stage_metadata),
+    ('index', pipeline_stage_index),
+    ('prefetch', pipeline_stage_prefetch),
+]
 
-@app.route('/proxy')
-@limiter.limit("100 per hour")  # CDN 代理速率限制
-@csrf.exempt  # GET请求且用于资源代理,可以豁免CSRF
-def proxy_resource():
-    """代理外部CDN资源（带两层缓存：内存 + 文件系统）"""
-    import urllib.parse
+# 批量上传在解压时已替换CDN链接、提取元数据，发布时统一刷新项目列表，后处理只需存入内容寻址存储
+BULK_UPLOAD_PIPELINE_STAGES = [
+    ('store', pipeline_stage_store),
+]
 
-    # 获取要代理的URL
-    target_url = request.args.get('url')
-    if not target_url:
-        return jsonify({'error': '缺少URL参数'}), 400
+def get_pipeline_stages(pipeline):
+    """按流水线类型（upload / bulk）返回要执行的后处理阶段"""
+    return BULK_UPLOAD_PIPELINE_STAGES if pipeline == 'bulk' else UPLOAD_PIPELINE_STAGES
 
+def run_upload_pipeline(project_id, job, context=None):
+    """
+    在后台线程中按顺序执行上传后处理的各个阶段
+    单个阶段失败时按指数退避重试，超过 UPLOAD_PIPELINE_MAX_RETRIES 次后标记为失败
+    （调用方须已占用一个 upload_pipeline_slots 名额，结束时释放）
+    """
+    project_dir = get_project_dir(project_id)
+    context = dict(context or {})
     try:
-        # URL解码
+        job['status'] = 'processing'
+        for stage_name, stage_func in get_pipeline_stages(job['pipeline']):
+            job['stage'] = stage_name
+            save_background_job('upload', project_id, job)
+            for attempt in range(1, UPLOAD_PIPELINE_MAX_RETRIES + 1):
+                job['attempts'] += 1
+                try:
+                    stage_func(project_id, project_dir, context)
+                    break
+                except Exception as e:
+                    if attempt >= UPLOAD_PIPELINE_MAX_RETRIES:
+                        raise
+                    logger.warning(
+                        f"上传后处理失败，准备重试: 项目ID={project_id}, 阶段={stage_name}, "
+                        f"第 {attempt} 次, 错误={e}"
+                    )
+                    time.sleep(UPLOAD_PIPELINE_RETRY_DELAY_SECONDS * 2 ** (attempt - 1))
+            job['completed_stages'].append(stage_name)
+
+        job['status'] = 'completed'
+        job['stage'] = None
+
+    except Exception as e:
+        logger.error(f"上传后处理失败: 项目ID={project_id}, 阶段={job['stage']}, 错误={e}")
+        job['status'] = 'failed'
+        job['error'] = f"{job['stage']} 阶段处理失败"
+    finally:
+        job['finished_at'] = datetime.datetime.now().isoformat()
+        # 先记录结果再删除标记：两步之间进程退出时，重启后会重新处理（各阶段可以安全地重复执行）
+        save_background_job('upload', project_id, job)
+        if project_dir:
+            marker_file = os.path.join(project_dir, UPLOAD_PENDING_MARKER)
+            if os.path.exists(marker_file):
+                os.remove(marker_file)
+        upload_pipeline_slots.release()
+
+def submit_upload_pipeline(project_id, context=None, pipeline='upload'):
+    """
+    提交上传后处理任务（调用方须已占用一个 upload_pipeline_slots 名额）
+    context 为传给各阶段的初始上下文，pipeline 为流水线类型（upload / bulk）
+    任务状态写入项目索引，只保留最近 MAX_UPLOAD_JOB_HISTORY 条；返回任务状态字典
+    """
+    job = {
+        'project_id': project_id,
+        'pipeline': pipeline,
+        'pid': os.getpid(),
+        'pid_started_at': get_process_start_time(os.getpid()),
+        'status': 'queued',  # queued / processing / completed / failed
+        'stage': None,
+        'completed_stages': [],
+        'attempts': 0,
+        'error': None,
+        'submitted_at': datetime.datetime.now().isoformat(),
+        'finished_at': None,
+    }
+    save_background_job('upload', project_id, job, history_limit=MAX_UPLOAD_JOB_HISTORY)
+    try:
+        upload_pipeline_executor.submit(run_upload_pipeline, project_id, job, context)
+    except Exception:
+        upload_pipeline_slots.release()
+        raise
+    return job
+
+class ArchiveError(Exception):
+    """上传的归档内容不合法"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+class _PrefixedStream:
+    """把已读出的开头几个字节放回流前面，供只能顺序读取的 tarfile 使用"""
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.stream.read(), b''
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+def iter_archive_files(stream):
+    """
+    逐个产出归档中的普通文件 (路径, 文件对象)
+    tar（含 gz/bz2/xz 压缩）以流式模式边读边解；zip 需要随机访问，
+    先分块写入磁盘临时文件，两种情况都不会把整个归档读入内存
+    """
+    head = stream.read(4)
+    try:
+        if head == b'PK\x03\x04':
+            with tempfile.TemporaryFile() as spool:
+                spool.write(head)
+                shutil.copyfileobj(stream, spool, BULK_UPLOAD_COPY_CHUNK_SIZE)
+                spool.seek(0)
+                with zipfile.ZipFile(spool) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir():
+                            continue
+                        with archive.open(info) as f:
+                            yield info.filename, f
+        else:
+            with tarfile.open(fileobj=_PrefixedStream(head, stream), mode='r|*') as archive:
+                for member in archive:
+                    if member.isdir():
+                        continue
+                    if not member.isfile():
+                        raise ArchiveError(f'不支持的归档条目类型: {member.name}')
+                    yield member.name, archive.extractfile(member)
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+        raise ArchiveError(f'无法解析归档文件: {e}')
+
+def split_archive_path(name):
+    """
+    把归档内的路径拆分为各级目录名，拒绝绝对路径和 ..（防止目录遍历）
+    隐藏文件、元数据文件等不属于用户内容的条目返回 None
+    """
+    normalized = name.replace('\\', '/')
+    parts = [part for part in normalized.split('/') if part not in ('', '.')]
+    if not parts or normalized.startswith('/') or '..' in parts or ':' in parts[0]:
+        raise ArchiveError(f'归档中包含非法路径: {name}')
+    if parts[0] == '__MACOSX' or any(part.startswith('.') for part in parts) or parts[-1] == 'metadata.json':
+        return None
+    return parts
+
+def extract_archive_to_staging(stream, staging_dir, max_total_size):
+    """
+    把归档解压到暂存目录，HTML 文件在写入前替换CDN链接，其它文件分块复制
+    返回 {index.html 相对路径: 元数据}（元数据从替换前的原始HTML提取）
+    """
+    metadata_by_path = {}
+    file_count = 0
+    total_size = 0
+
+    for name, source in iter_archive_files(stream):
+        parts = split_archive_path(name)
+        if parts is None:
+            continue
+
+        file_count += 1
+        if file_count > BULK_UPLOAD_MAX_FILES:
+            raise ArchiveError(f'归档内文件过多,最多允许{BULK_UPLOAD_MAX_FILES}个', 413)
+
+        target_path = os.path.join(staging_dir, *parts)
+        try:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            if parts[-1].lower().endswith(BULK_UPLOAD_HTML_EXTENSIONS):
+                raw = source.read(MAX_CONTENT_LENGTH + 1)
+                if len(raw) > MAX_CONTENT_LENGTH:
+                    raise ArchiveError(
+                        f'HTML文件过大: {name},最大允许{MAX_CONTENT_LENGTH / (1024*1024):.1f}MB', 413
+                    )
+                html_content = raw.decode('utf-8', errors='replace')
+                if parts[-1] == 'index.html':
+                    metadata_by_path['/'.join(parts)] = extract_html_metadata(html_content)
+                data = replace_cdn_links(html_content).encode('utf-8')
+                total_size += len(data)
+                if total_size > max_total_size:
+                    raise ArchiveError('解压后的内容超过允许的大小', 413)
+                with open(target_path, 'wb') as f:
+                    f.write(data)
+            else:
+                with open(target_path, 'wb') as f:
+                    while True:
+                        chunk = source.read(BULK_UPLOAD_COPY_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        total_size += len(chunk)
+                        if total_size > max_total_size:
+                            raise ArchiveError('解压后的内容超过允许的大小', 413)
+                        f.write(chunk)
+        except (IsADirectoryError, NotADirectoryError, FileExistsError):
+            raise ArchiveError(f'归档中的路径与已有文件冲突: {name}')
+
+    return metadata_by_path, total_size
+
+def find_staged_projects(staging_dir, metadata_by_path):
+    """
+    找出暂存目录中的项目
+    根目录有 index.html 时整个归档是一个项目，否则每个含 index.html 的顶层目录各是一个项目
+    返回 [(归档内目录名, 暂存目录, 元数据)]
+    """
+    if 'index.html' in metadata_by_path:
+        candidates = [('', staging_dir, metadata_by_path['index.html'])]
+    else:
+        candidates = [
+            (path.split('/')[0], os.path.join(staging_dir, path.split('/')[0]), metadata)
+            for path, metadata in sorted(metadata_by_path.items())
+            if path.count('/') == 1
+        ]
+    if not candidates:
+        raise ArchiveError('归档中没有找到 index.html')
+    if len(candidates) > BULK_UPLOAD_MAX_PROJECTS:
+        raise ArchiveError(f'项目过多,单次最多上传{BULK_UPLOAD_MAX_PROJECTS}个', 413)
+    return candidates
+
+def publish_staged_projects(candidates):
+    """
+    把暂存目录中的项目逐个 rename 到分片目录，生成新的项目ID
+    与单页上传相同，发布前写入 .pending 标记，发布后由调用方提交上传后处理，把 index.html
+    存入内容寻址存储（去重、压缩）
+    中途失败时删除已发布的项目再抛出异常，不会留下只发布了一部分的归档
+    返回 [(归档内目录名, 项目ID)]
+    """
+    published = []
+    try:
+        for name, source_dir, metadata in candidates:
+            project_id = generate_random_string()
+            while os.path.exists(get_project_dir(project_id)):
+                project_id = generate_random_string()
+
+            metadata = dict(metadata)
+            metadata['id'] = project_id
+            metadata['created_at'] = datetime.datetime.now().isoformat()
+            write_json_atomic(os.path.join(source_dir, 'metadata.json'), metadata)
+            # 标记中记录流水线类型，重启恢复时不会对批量项目执行完整流水线
+            with open(os.path.join(source_dir, UPLOAD_PENDING_MARKER), 'w') as f:
+                f.write('bulk')
+
+            target_dir = get_shard_path(project_id)
+            os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+            os.rename(source_dir, target_dir)
+            published.append((name, project_id))
+    except Exception:
+        for _, project_id in published:
+            logger.warning(f"批量发布失败，回滚已发布的项目: {project_id}")
+            shutil.rmtree(get_shard_path(project_id), ignore_errors=True)
+        raise
+    return published
+
+def resume_upload_pipeline():
+    """
+    重新提交上次退出时尚未完成后处理的项目（带有 .pending 标记的项目）
+    leader 切换时其它 worker 可能仍在处理这些项目，所属进程仍在运行的排队中/处理中任务跳过
+    队列已满时等待空位，不会突破排队上限
+    """
+    resumed = 0
+    try:
+        for project_id, project_dir in iter_project_dirs():
+            try:
+                with open(os.path.join(project_dir, UPLOAD_PENDING_MARKER)) as f:
+                    pipeline = f.read().strip() or 'upload'
+            except FileNotFoundError:
+                continue
+            job = get_background_job('upload', project_id)
+            if job and job['status'] in ('queued', 'processing') and is_job_owner_alive(job):
+                continue
+            upload_pipeline_slots.acquire()
+            submit_upload_pipeline(project_id, pipeline=pipeline)
+            resumed += 1
+        if resumed:
+            logger.info(f"已恢复 {resumed} 个未完成的上传后处理任务")
+    except Exception as e:
+        logger.error(f"恢复上传后处理任务失败: {e}")
+    return resumed
+
+class InvalidThumbnailError(Exception):
+    """上传的缩略图不是可接受的图片"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def thumbnail_too_large_error():
+    """缩略图超过大小上限时的错误"""
+    return InvalidThumbnailError(
+        f'缩略图过大,最大允许{THUMBNAIL_MAX_UPLOAD_SIZE / (1024*1024):.1f}MB', 413
+    )
+
+def detect_image_type(header):
+    """根据文件开头的魔数判断图片格式，返回 png / jpeg / webp 或 None"""
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def render_thumbnail_variants(source_path, project_dir, widths, png_width, webp_quality, max_pixels):
+    """
+    在缩略图进程池中执行：解码上传的图片，按宽度等比缩小（不放大），
+    写出 thumbnail-<宽度>.webp 和 thumbnail.png（最后写，存在即表示缩略图完整）
+    图片无法解析或像素过多时抛出 ValueError
+    """
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            with Image.open(source_path) as image:
+                if image.format not in ('PNG', 'JPEG', 'WEBP'):
+                    raise ValueError(f'不支持的图片格式: {image.format}')
+                image.load()
+                has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+                source = image.convert('RGBA' if has_alpha else 'RGB')
+    except (OSError, SyntaxError, Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        raise ValueError(f'无法解析图片: {e}')
+
+    def scale_to(width):
+        if source.width <= width:
+            return source
+        height = max(1, round(source.height * width / source.width))
+        return source.resize((width, height), Image.LANCZOS)
+
+    def save_atomic(image, file_name, **options):
+        file_path = os.path.join(project_dir, file_name)
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        try:
+            image.save(tmp_path, **options)
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    for width in widths:
+        save_atomic(scale_to(width), f'thumbnail-{width}.webp', format='WEBP', quality=webp_quality, method=6)
+    save_atomic(scale_to(png_width), 'thumbnail.png', format='PNG', optimize=True)
+    return source.width, source.height
+
+def get_thumbnail_pool():
+    """获取缩略图进程池（首次使用时创建，进程崩溃后重建）"""
+    global thumbnail_pool
+    with thumbnail_pool_lock:
+        if thumbnail_pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            thumbnail_pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+        return thumbnail_pool
+
+def run_in_thumbnail_pool(fn, *args):
+    """在缩略图进程池中执行任务并等待结果，进程崩溃时丢弃进程池以便下次重建"""
+    from concurrent.futures.process import BrokenProcessPool
+    global thumbnail_pool
+    future = get_thumbnail_pool().submit(fn, *args)
+    try:
+        return future.result(timeout=THUMBNAIL_PROCESS_TIMEOUT_SECONDS)
+    except BrokenProcessPool:
+        with thumbnail_pool_lock:
+            thumbnail_pool = None
+        raise
+
+def normalize_thumbnail(project_dir, source_path):
+    """
+    把上传到临时文件的图片规范化为项目缩略图，结束后临时文件已被移走或删除
+    安装了 Pillow 时在进程池中缩放并转码；未安装时无法转码，只接受 PNG，校验格式后原样保存为 thumbnail.png
+    """
+    try:
+        if os.path.getsize(source_path) > THUMBNAIL_MAX_UPLOAD_SIZE:
+            raise thumbnail_too_large_error()
+        with open(source_path, 'rb') as f:
+            image_type = detect_image_type(f.read(16))
+        if image_type is None:
+            raise InvalidThumbnailError('不支持的图片格式,仅支持 PNG/JPEG/WebP')
+
+        if not PILLOW_AVAILABLE:
+            # thumbnail.png 按 image/png 发送，JPEG/WebP 原样保存会与内容类型不符
+            if image_type != 'png':
+                raise InvalidThumbnailError('服务器未安装图片处理组件,仅支持 PNG 缩略图')
+            os.replace(source_path, os.path.join(project_dir, 'thumbnail.png'))
+            return
+
+        try:
+            run_in_thumbnail_pool(
+                render_thumbnail_variants, source_path, project_dir, THUMBNAIL_WIDTHS,
+                THUMBNAIL_PNG_WIDTH, THUMBNAIL_WEBP_QUALITY, THUMBNAIL_MAX_PIXELS
+            )
+        except ValueError as e:
+            raise InvalidThumbnailError(str(e))
+    finally:
+        if os.path.exists(source_path):
+            os.remove(source_path)
+
+def save_thumbnail_from_base64(project_id, base64_data):
+    """
+    从base64数据保存缩略图
+    图片不合法时抛出 InvalidThumbnailError
+    """
+    try:
+        # 移除data:image/png;base64,前缀
+        if base64_data.startswith('data:image/'):
+            base64_data = base64_data.split(',')[1]
+
+        # 解码前先按长度估算大小
+        if len(base64_data) * 3 // 4 > THUMBNAIL_MAX_UPLOAD_SIZE:
+            raise thumbnail_too_large_error()
+
+        # 解码base64数据
+        image_data = base64.b64decode(base64_data)
+
+        # 写入临时文件后交给规范化流程
+        project_dir = get_project_dir(project_id)
+        upload_path = os.path.join(project_dir, f'.thumbnail-{uuid.uuid4().hex}.upload')
+        with open(upload_path, 'wb') as f:
+            f.write(image_data)
+        normalize_thumbnail(project_dir, upload_path)
+
+        return True
+    except InvalidThumbnailError:
+        raise
+    except Exception as e:
+        logger.error(f"保存缩略图失败: {e}")
+        return False
+
+def save_thumbnail_from_stream(project_id, stream):
+    """
+    从二进制流保存缩略图：分块写入临时文件，边写边检查大小，开头不是图片魔数时立即停止读取
+    内存占用只有一个读取块，图片不合法时抛出 InvalidThumbnailError
+    """
+    project_dir = get_project_dir(project_id)
+    upload_path = os.path.join(project_dir, f'.thumbnail-{uuid.uuid4().hex}.upload')
+    try:
+        header = b''
+        total_size = 0
+        with open(upload_path, 'wb') as f:
+            while True:
+                chunk = stream.read(THUMBNAIL_STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(header) < 16:
+                    header += chunk[:16 - len(header)]
+                    if len(header) == 16 and detect_image_type(header) is None:
+                        raise InvalidThumbnailError('不支持的图片格式,仅支持 PNG/JPEG/WebP')
+                total_size += len(chunk)
+                if total_size > THUMBNAIL_MAX_UPLOAD_SIZE:
+                    raise thumbnail_too_large_error()
+                f.write(chunk)
+    except Exception as e:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        if isinstance(e, InvalidThumbnailError):
+            raise
+        if isinstance(e, RequestEntityTooLarge):
+            raise thumbnail_too_large_error()
+        logger.error(f"接收缩略图失败: {e}")
+        return False
+
+    try:
+        normalize_thumbnail(project_dir, upload_path)
+        return True
+    except InvalidThumbnailError:
+        raise
+    except Exception as e:
+        logger.error(f"保存缩略图失败: {e}")
+        return False
+
+def get_thumbnail_version(project_dir):
+    """
+    缩略图版本号：thumbnail.png 的修改时间（纳秒，十六进制）
+    thumbnail.png 在各尺寸中最后写入，重新生成缩略图后版本号一定变化；没有缩略图时返回 None
+    """
+    try:
+        file_stat = os.stat(os.path.join(project_dir, 'thumbnail.png'))
+    except OSError:
+        return None
+    return format(file_stat.st_mtime_ns, 'x') if file_stat.st_size > 0 else None
+
+def get_thumbnail_url(project_id, version, file_name='thumbnail.png'):
+    """生成缩略图地址，带版本号的地址可以被浏览器长期缓存"""
+    url = f"{get_host_url()}/static/{project_id}/{file_name}"
+    return f"{url}?v={version}" if version else url
+
+def get_thumbnail_srcset(project_id, project_dir, version=None):
+    """生成缩略图 WebP 版本的 srcset，没有 WebP 版本时返回 None"""
+    candidates = [
+        f"{get_thumbnail_url(project_id, version, f'thumbnail-{width}.webp')} {width}w"
+        for width in THUMBNAIL_WIDTHS
+        if os.path.exists(os.path.join(project_dir, f'thumbnail-{width}.webp'))
+    ]
+    return ', '.join(candidates) or None
+
+def render_thumbnail_sprite(sources, tile_width, max_tile_height, columns, webp_quality, max_pixels):
+    """
+    在缩略图进程池中执行：把多个缩略图按网格拼成一张 WebP
+    每个缩略图缩放到 tile_width 宽（不放大），超过 max_tile_height 的部分从底部裁掉（首页优先显示页面顶部）
+    返回 (拼图字节, {项目ID: (x, y, 宽, 高)})，无法解析的缩略图直接跳过
+    """
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    tiles = []
+    for project_id, path in sources:
+        try:
+            with Image.open(path) as image:
+                image.load()
+                tile = image.convert('RGB')
+        except (OSError, SyntaxError, Image.DecompressionBombError):
+            continue
+        if tile.width > tile_width:
+            height = max(1, round(tile.height * tile_width / tile.width))
+            tile = tile.resize((tile_width, height), Image.LANCZOS)
+        if tile.height > max_tile_height:
+            tile = tile.crop((0, 0, tile.width, max_tile_height))
+        tiles.append((project_id, tile))
+
+    if not tiles:
+        return None, {}
+
+    rows = (len(tiles) + columns - 1) // columns
+    sprite = Image.new('RGB', (min(len(tiles), columns) * tile_width, rows * max_tile_height), (255, 255, 255))
+    coordinates = {}
+    for position, (project_id, tile) in enumerate(tiles):
+        x = (position % columns) * tile_width
+        y = (position // columns) * max_tile_height
+        sprite.paste(tile, (x, y))
+        coordinates[project_id] = (x, y, tile.width, tile.height)
+
+    buffer = io.BytesIO()
+    sprite.save(buffer, format='WEBP', quality=webp_quality, method=4)
+    return buffer.getvalue(), coordinates
+
+def get_thumbnail_sprite(projects, wait=True):
+    """
+    获取一页项目的缩略图拼图，返回 (版本号, 拼图字节, 坐标)；没有可拼的缩略图或未安装 Pillow 时返回 None
+    版本号由页内项目及其缩略图版本决定，内容不变时命中缓存；多进程部署时未命中的进程按相同输入重新生成同一份拼图
+    wait=False 时未命中缓存不等待生成：提交到后台生成并返回 None
+    """
+    entries = [(project['id'], project['thumbnail_version']) for project in projects if project.get('thumbnail_version')]
+    if not PILLOW_AVAILABLE or not entries:
+        return None
+
+    layout = (THUMBNAIL_WIDTHS[0], THUMBNAIL_SPRITE_MAX_TILE_HEIGHT, THUMBNAIL_SPRITE_COLUMNS, THUMBNAIL_WEBP_QUALITY)
+    version = hashlib.sha256(json.dumps([entries, layout]).encode('utf-8')).hexdigest()[:16]
+    with thumbnail_sprite_lock:
+        cached = thumbnail_sprite_cache.get(version)
+        if cached is not None:
+            thumbnail_sprite_cache.move_to_end(version)
+            return (version,) + cached
+        if not wait:
+            if version not in thumbnail_sprite_building:
+                thumbnail_sprite_building.add(version)
+                thumbnail_sprite_executor.submit(build_thumbnail_sprite_in_background, version, entries, layout)
+            return None
+
+    built = build_thumbnail_sprite(version, entries, layout)
+    return (version,) + built if built else None
+
+def build_thumbnail_sprite(version, entries, layout):
+    """在缩略图进程池中生成拼图并放入缓存，返回 (拼图字节, 坐标)；没有可解析的缩略图时返回 None"""
+    sources = []
+    for project_id, _ in entries:
+        project_dir = get_project_dir(project_id)
+        if project_dir is None:
+            continue
+        webp_path = os.path.join(project_dir, f'thumbnail-{THUMBNAIL_WIDTHS[0]}.webp')
+        sources.append((project_id, webp_path if os.path.exists(webp_path) else os.path.join(project_dir, 'thumbnail.png')))
+
+    sprite_bytes, coordinates = run_in_thumbnail_pool(render_thumbnail_sprite, sources, *layout, THUMBNAIL_MAX_PIXELS)
+    if sprite_bytes is None:
+        return None
+
+    with thumbnail_sprite_lock:
+        thumbnail_sprite_cache[version] = (sprite_bytes, coordinates)
+        while len(thumbnail_sprite_cache) > THUMBNAIL_SPRITE_CACHE_SIZE:
+            thumbnail_sprite_cache.popitem(last=False)
+    logger.info(f"已生成缩略图拼图: 版本={version}, {len(coordinates)} 个缩略图, {len(sprite_bytes)} 字节")
+    return sprite_bytes, coordinates
+
+def build_thumbnail_sprite_in_background(version, entries, layout):
+    """后台生成拼图，失败只记录日志（项目列表此时已返回逐个缩略图的地址）"""
+    try:
+        build_thumbnail_sprite(version, entries, layout)
+    except Exception as e:
+        logger.warning(f"后台生成缩略图拼图失败: 版本={version}, 错误={e}")
+    finally:
+        with thumbnail_sprite_lock:
+            thumbnail_sprite_building.discard(version)
+
+def has_thumbnail(project_id):
+    """
+    检查项目是否有缩略图
+    """
+    project_dir = get_project_dir(project_id)
+    if project_dir is None:
+        return False
+    thumbnail_path = os.path.join(project_dir, 'thumbnail.png')
+    return os.path.exists(thumbnail_path) and os.path.getsize(thumbnail_path) > 0
+
+def claim_thumbnail_lease(project_id):
+    """
+    尝试获取项目缩略图的生成租约，租约记录在项目索引中，多个进程共享
+    没有租约或租约已过期时原子地写入新租约，返回 (租约令牌, 剩余秒数)；已被他人持有时令牌为 None
+    """
+    now = time.time()
+    token = secrets.token_urlsafe(16)
+    conn = get_project_index()
+    with conn:
+        cursor = conn.execute(
+            'INSERT INTO thumbnail_leases (project_id, token, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(project_id) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at '
+            'WHERE thumbnail_leases.expires_at <= ?',
+            (project_id, token, now + THUMBNAIL_LEASE_SECONDS, now)
+        )
+        if cursor.rowcount == 1:
+            return token, THUMBNAIL_LEASE_SECONDS
+        row = conn.execute('SELECT expires_at FROM thumbnail_leases WHERE project_id = ?', (project_id,)).fetchone()
+    return None, max(0.0, row[0] - now) if row else 0.0
+
+def check_thumbnail_lease(project_id, token):
+    """没有有效租约，或 token 就是当前租约时返回 True"""
+    row = get_project_index().execute(
+        'SELECT token, expires_at FROM thumbnail_leases WHERE project_id = ?', (project_id,)
+    ).fetchone()
+    return row is None or row[1] <= time.time() or row[0] == token
+
+def release_thumbnail_lease(project_id, token=None):
+    """释放租约；指定 token 时只释放该令牌对应的租约"""
+    conn = get_project_index()
+    with conn:
+        if token is None:
+            conn.execute('DELETE FROM thumbnail_leases WHERE project_id = ?', (project_id,))
+        else:
+            conn.execute('DELETE FROM thumbnail_leases WHERE project_id = ? AND token = ?', (project_id, token))
+
+def invalidate_projects_cache():
+    """
+    使项目列表缓存失效
+    在以下情况调用:上传项目、删除项目、清理过期项目、上传缩略图
+    """
+    PROJECTS_CACHE['data'] = None
+    PROJECTS_CACHE['timestamp'] = 0
+    # 递增共享计数器，其它进程下次读取时发现代数变化，重新生成列表
+    get_cdn_memory_cache().incr(PROJECTS_CACHE_COUNTER)
+    logger.info("项目列表缓存已失效")
+
+def get_all_projects():
+    """
+    获取所有已部署的项目列表
+    使用缓存机制减少文件系统遍历开销
+    """
+    # 检查缓存是否有效（未过期，且没有任何进程使其失效）
+    current_time = time.time()
+    cache_age = current_time - PROJECTS_CACHE['timestamp']
+    generation = get_cdn_memory_cache().counter(PROJECTS_CACHE_COUNTER)
+
+    if (PROJECTS_CACHE['data'] is not None and cache_age < PROJECTS_CACHE['ttl']
+            and PROJECTS_CACHE['generation'] == generation):
+        logger.debug(f"使用缓存的项目列表 (缓存年龄: {cache_age:.1f}秒)")
+        return PROJECTS_CACHE['data']
+
+    # 缓存无效或过期，重新获取项目列表
+    log_event('projects_cache_rebuild', "重新获取项目列表并更新缓存")
+    rebuild_started = time.perf_counter()
+    projects = []
+    try:
+        for item, item_path in iter_project_dirs():
+            index_file = get_project_html_path(item_path)
+            if os.path.exists(index_file):
+                # 加载项目元数据
+                metadata = load_project_metadata(item, item_path)
+
+                # 获取文件信息
+                file_stat = os.stat(index_file)
+                file_size = file_stat.st_size
+
+                # 生成访问URL
+                host_url = get_host_url()
+                access_url = f"{host_url}/static/{item}/index.html"
+
+                # 生成预览图URL（有缩略图时带版本号，浏览器可长期缓存）
+                thumbnail_version = get_thumbnail_version(item_path)
+                thumbnail_url = get_thumbnail_url(item, thumbnail_version)
+
+                project_info = {
+                    'id': item,
+                    'title': metadata.get('title', '未命名项目'),
+                    'description': metadata.get('description', '暂无描述'),
+                    'url': access_url,
+                    'thumbnail': thumbnail_url,
+                    'thumbnail_version': thumbnail_version,
+                    'thumbnail_srcset': get_thumbnail_srcset(item, item_path, thumbnail_version),
+                    'created_at': metadata.get('created_at'),
+                    'file_size': f"{file_size / 1024:.1f}KB" if file_size < 1024*1024 else f"{file_size / (1024*1024):.1f}MB"
+                }
+                projects.append(project_info)
+
+        # 按创建时间倒序排列
+        projects.sort(key=lambda x: x['created_at'], reverse=True)
+
+        # 更新缓存
+        PROJECTS_CACHE['data'] = projects
+        PROJECTS_CACHE['timestamp'] = time.time()
+        PROJECTS_CACHE['generation'] = generation
+        PROJECTS_REBUILD_SECONDS.observe(time.perf_counter() - rebuild_started)
+        log_event('projects_cache_stored', f"项目列表已缓存 (共 {len(projects)} 个项目)")
+
+    except Exception as e:
+        logger.error(f"获取项目列表失败: {e}")
+
+    return projects
+
+@app.route('/')
+def index():
+    """主页面 - 显示HTML输入表单"""
+    return render_template('index.html')
+
+@contextmanager
+def timing_span(name):
+    """
+    记录当前请求中一个处理阶段的耗时（同名阶段累加）
+    结束后由 record_request_metrics 计入指标，开启 SERVER_TIMING_ENABLED 时写入 Server-Timing 响应头
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans = g.setdefault('timing_spans', {})
+        spans[name] = spans.get(name, 0.0) + time.perf_counter() - started
+
+def format_server_timing(spans, total):
+    """生成 Server-Timing 头：各阶段和总耗时，单位毫秒"""
+    entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in spans.items()]
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+@app.before_request
+def start_request_timer():
+    """记录请求开始时间，供 record_request_metrics 计算耗时"""
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """
+    记录每个请求的耗时、状态码和响应字节数以及各阶段耗时；CDN 代理请求额外按缓存结果计数
+    总耗时到视图返回为止，文件和流式响应体的发送不计入
+    """
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_LATENCY.labels(endpoint, request.method).observe(elapsed)
+    spans = g.pop('timing_spans', None)
+    if spans:
+        for name, seconds in spans.items():
+            REQUEST_PHASE_LATENCY.labels(endpoint, name).observe(seconds)
+        if SERVER_TIMING_ENABLED:
+            response.headers['Server-Timing'] = format_server_timing(spans, elapsed)
+    REQUEST_COUNT.labels(endpoint, request.method, response.status_code).inc()
+    if response.content_length:
+        RESPONSE_BYTES.labels(endpoint).inc(response.content_length)
+    if endpoint == 'proxy_resource':
+        PROXY_RESULTS.labels(response.headers.get('X-Cache-Status', 'ERROR'), response.status_code).inc()
+    return response
+
+def check_profiling_token(value):
+    """分析已启用且令牌正确时返回 True（常数时间比较）"""
+    return PROFILING_TOKEN is not None and value is not None and secrets.compare_digest(value, PROFILING_TOKEN)
+
+@app.before_request
+def start_request_profile():
+    """按请求头或抽样率决定是否分析本次请求，是则启动采样线程"""
+    if PROFILING_TOKEN is None:
+        return
+    header = request.headers.get('X-Profile')
+    if header is not None:
+        if not check_profiling_token(header):
+            logger.warning(f"忽略令牌无效的分析请求: {request.path}")
+            return
+        trigger = 'header'
+    elif PROFILING_SAMPLE_RATE and request.endpoint in PROFILING_ENDPOINTS and random.random() < PROFILING_SAMPLE_RATE:
+        trigger = 'sampled'
+    else:
+        return
+    profiler = profiling.SamplingProfiler(threading.get_ident(), PROFILING_INTERVAL)
+    g.profile = (profiler, trigger, time.time(), time.perf_counter())
+    profiler.start()
+
+def save_request_profile(profiler, trigger, started_at, elapsed, status):
+    """保存分析结果（collapsed stacks 和元数据），超出 PROFILES_MAX_FILES 时删除最旧的，返回分析ID"""
+    stacks = profiler.stop()
+    endpoint = request.endpoint or 'unmatched'
+    profile_id = (f"{datetime.datetime.fromtimestamp(started_at).strftime('%Y%m%dT%H%M%S')}-"
+                  f"{endpoint}-{secrets.token_hex(4)}")
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    write_file_atomic(os.path.join(PROFILES_DIR, f'{profile_id}.folded'), profiling.format_collapsed(stacks))
+    write_json_atomic(os.path.join(PROFILES_DIR, f'{profile_id}.json'), {
+        'id': profile_id,
+        'endpoint': endpoint,
+        'method': request.method,
+        'path': request.path,
+        'status': status,
+        'trigger': trigger,
+        'created_at': datetime.datetime.fromtimestamp(started_at).isoformat(timespec='seconds'),
+        'duration_ms': round(elapsed * 1000, 2),
+        'samples': profiler.samples,
+        'interval_ms': PROFILING_INTERVAL * 1000,
+        'pid': os.getpid(),
+    })
+
+    # 文件名以时间开头，按名称排序即按时间排序
+    profile_ids = sorted(name[:-len('.json')] for name in os.listdir(PROFILES_DIR) if name.endswith('.json'))
+    for old_id in profile_ids[:max(0, len(profile_ids) - PROFILES_MAX_FILES)]:
+        for suffix in ('.json', '.folded'):
+            try:
+                os.remove(os.path.join(PROFILES_DIR, old_id + suffix))
+            except FileNotFoundError:
+                pass
+    return profile_id
+
+@app.after_request
+def finish_request_profile(response):
+    """停止本次请求的采样并保存结果，响应头 X-Profile-Id 返回分析ID（文件和流式响应体的发送不计入）"""
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    profiler, trigger, started_at, started = profile
+    try:
+        profile_id = save_request_profile(profiler, trigger, started_at, time.perf_counter() - started,
+                                          response.status_code)
+        response.headers['X-Profile-Id'] = profile_id
+        logger.info(f"请求分析已保存: {profile_id} ({profiler.samples} 次采样)")
+    except Exception as e:
+        logger.error(f"保存请求分析失败: {e}")
+    return response
+
+@app.teardown_request
+def stop_request_profile(exception=None):
+    """视图抛出未处理的异常时 after_request 不会执行，在这里停止采样线程"""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile[0].stop()
+
+@app.route('/metrics', methods=['GET'])
+@csrf.exempt  # GET请求,只读操作,可以豁免CSRF
+@limiter.exempt  # 由监控系统定期抓取
+def prometheus_metrics():
+    """Prometheus 文本格式的指标，计数和直方图为所有 worker 进程之和"""
+    return Response(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def profiling_unauthorized():
+    """分析未启用时返回 404（不暴露接口），令牌错误时返回 403；通过时返回 None"""
+    if PROFILING_TOKEN is None:
+        return jsonify({'success': False, 'error': '请求分析未启用'}), 404
+    authorization = request.headers.get('Authorization', '')
+    token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') else request.headers.get('X-Profile-Token')
+    if not check_profiling_token(token):
+        return jsonify({'success': False, 'error': '令牌无效'}), 403
+    return None
+
+@app.route('/api/profiles', methods=['GET'])
+@csrf.exempt  # GET请求,只读操作,可以豁免CSRF
+@limiter.limit("60 per hour")
+def list_profiles():
+    """列出已保存的请求分析（新的在前），需要 PROFILING_TOKEN"""
+    error = profiling_unauthorized()
+    if error:
+        return error
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    profiles = []
+    if os.path.isdir(PROFILES_DIR):
+        names = sorted((name for name in os.listdir(PROFILES_DIR) if name.endswith('.json')), reverse=True)
+        for name in names[:limit]:
+            try:
+                with open(os.path.join(PROFILES_DIR, name), 'r', encoding='utf-8') as f:
+                    profile = json.load(f)
+            except (OSError, ValueError):
+                continue
+            profile['folded_url'] = f"/api/profiles/{profile['id']}"
+            profile['flamegraph_url'] = f"/api/profiles/{profile['id']}?format=svg"
+            profiles.append(profile)
+    return jsonify({'success': True, 'profiles': profiles})
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+@csrf.exempt  # GET请求,只读操作,可以豁免CSRF
+@limiter.limit("60 per hour")
+def get_profile(profile_id):
+    """下载一次请求分析：默认为 collapsed stacks 文本，format=svg 时为火焰图"""
+    error = profiling_unauthorized()
+    if error:
+        return error
+    folded_path = os.path.join(PROFILES_DIR, f'{profile_id}.folded')
+    if not PROFILE_ID_PATTERN.match(profile_id) or not os.path.isfile(folded_path):
+        return jsonify({'success': False, 'error': '分析结果不存在'}), 404
+    with open(folded_path, 'r', encoding='utf-8') as f:
+        collapsed = f.read()
+    if request.args.get('format') == 'svg':
+        svg = profiling.render_flamegraph(profiling.parse_collapsed(collapsed), title=profile_id)
+        return Response(svg, mimetype='image/svg+xml')
+    return Response(collapsed, mimetype='text/plain')
+
+@app.route('/api/csrf-token', methods=['GET'])
+@csrf.exempt  # 获取token的端点需要豁免CSRF检查
+def get_csrf_token():
+    """获取CSRF令牌"""
+    token = generate_csrf()
+    return jsonify({'csrf_token': token})
+
+@app.route('/proxy')
+@limiter.limit("100 per hour")  # CDN 代理速率限制
+@csrf.exempt  # GET请求且用于资源代理,可以豁免CSRF
+def proxy_resource():
+    """代理外部CDN资源（带两层缓存：内存 + 文件系统）"""
+    import urllib.parse
+    import requests
+
+    # 获取要代理的URL
+    target_url = request.args.get('url')
+    if not target_url:
+        return jsonify({'error': '缺少URL参数'}), 400
+
+    try:
+        # URL解码
         decoded_url = urllib.parse.unquote(target_url)
 
         # 验证URL是否为允许的CDN域名
@@ -555,19 +2655,23 @@ def proxy_resource():
         for domain in CDN_DOMAINS:
             if domain in decoded_url:
                 allowed = True
+                cdn_domain = domain
                 break
 
         if not allowed:
             return jsonify({'error': '不允许的域名'}), 403
 
         # 生成 URL 哈希
-        url_hash = get_url_hash(decoded_url)
+        with timing_span('hash'):
+            url_hash = get_url_hash(decoded_url)
 
         # 1. 尝试从内存缓存获取
-        memory_cached = get_cdn_from_memory_cache(url_hash)
+        with timing_span('memory'):
+            memory_cached = get_cdn_from_memory_cache(url_hash)
         if memory_cached:
             content, content_type, _ = memory_cached
-            logger.info(f"CDN 缓存命中（内存）: {decoded_url}")
+            log_event('cdn_memory_hit', f"CDN 缓存命中（内存）: {decoded_url}",
+                      url=decoded_url, bytes=len(content), content_type=content_type)
             return Response(
                 content,
                 headers={
@@ -579,18 +2683,26 @@ def proxy_resource():
             )
 
         # 2. 请求外部资源获取 content_type
-        response = requests.get(decoded_url, timeout=10, stream=True)
+        upstream_started = time.perf_counter()
+        try:
+            with timing_span('upstream'):
+                response = requests.get(decoded_url, timeout=10, stream=True)
+        finally:
+            UPSTREAM_LATENCY.labels(cdn_domain).observe(time.perf_counter() - upstream_started)
         response.raise_for_status()
 
         content_type = response.headers.get('Content-Type', 'text/plain')
 
         # 3. 尝试从文件缓存获取
-        file_cached = get_cdn_from_file_cache(url_hash, content_type)
+        with timing_span('disk'):
+            file_cached = get_cdn_from_file_cache(url_hash, content_type)
         if file_cached:
             content, _ = file_cached
-            logger.info(f"CDN 缓存命中（文件）: {decoded_url}")
+            log_event('cdn_file_hit', f"CDN 缓存命中（文件）: {decoded_url}",
+                      url=decoded_url, bytes=len(content), content_type=content_type)
             # 同时写入内存缓存
-            set_cdn_to_memory_cache(url_hash, content, content_type)
+            with timing_span('store'):
+                set_cdn_to_memory_cache(url_hash, content, content_type)
             return Response(
                 content,
                 headers={
@@ -602,23 +2714,27 @@ def proxy_resource():
             )
 
         # 4. 缓存未命中，从外部获取资源
-        logger.info(f"CDN 缓存未命中，从外部获取: {decoded_url}")
+        content_length = response.headers.get('Content-Length')
+        log_event('cdn_miss', f"CDN 缓存未命中，从外部获取: {decoded_url}", url=decoded_url,
+                  bytes=int(content_length) if content_length and content_length.isdigit() else None,
+                  content_type=content_type)
 
         # 检查响应大小
-        content_length = response.headers.get('Content-Length')
         if content_length and int(content_length) > MAX_PROXY_SIZE:
             return jsonify({'error': '文件过大,超过10MB限制'}), 413
 
         # 读取内容,限制大小
         content = b''
-        for chunk in response.iter_content(chunk_size=8192):
-            content += chunk
-            if len(content) > MAX_PROXY_SIZE:
-                return jsonify({'error': '文件过大,超过10MB限制'}), 413
+        with timing_span('download'):
+            for chunk in response.iter_content(chunk_size=8192):
+                content += chunk
+                if len(content) > MAX_PROXY_SIZE:
+                    return jsonify({'error': '文件过大,超过10MB限制'}), 413
 
         # 5. 存储到缓存
-        set_cdn_to_memory_cache(url_hash, content, content_type)
-        set_cdn_to_file_cache(url_hash, content, content_type)
+        with timing_span('store'):
+            set_cdn_to_memory_cache(url_hash, content, content_type)
+            set_cdn_to_file_cache(url_hash, content, content_type)
 
         # 6. 返回响应
         flask_response = Response(
@@ -649,15 +2765,17 @@ def proxy_resource():
 def upload_html():
     """处理HTML上传请求"""
     try:
-        # 检查存储配额
-        is_within_quota, current_size, quota = check_storage_quota()
+        # 检查存储配额（使用短时缓存的用量，不在请求路径上遍历目录）
+        with timing_span('quota'):
+            is_within_quota, current_size, quota = check_storage_quota(max_age=STORAGE_USAGE_CACHE_TTL)
         if not is_within_quota:
             return jsonify({
                 'error': f'存储空间已满，当前使用: {current_size / (1024*1024):.1f}MB / {quota / (1024*1024):.1f}MB'
             }), 507  # 507 Insufficient Storage
 
         # 获取HTML内容
-        html_content = request.form.get('html_content', '')
+        with timing_span('parse'):
+            html_content = request.form.get('html_content', '')
         if not html_content.strip():
             return jsonify({'error': '请输入HTML内容'}), 400
 
@@ -666,46 +2784,63 @@ def upload_html():
         if content_size > MAX_CONTENT_LENGTH:
             return jsonify({'error': f'HTML内容过大,最大允许{MAX_CONTENT_LENGTH / (1024*1024):.1f}MB'}), 413
 
-        # 生成随机目录名
-        random_dir = generate_random_string()
-        dir_path = os.path.join(app.config['UPLOAD_FOLDER'], random_dir)
-
-        # 创建目录
-        os.makedirs(dir_path, exist_ok=True)
-
-        # 替换CDN链接为代理链接
-        html_with_proxy = replace_cdn_links(html_content)
-
-        # 注意: 这是一个HTML预览工具,用户需要能够使用JavaScript和完整HTML功能
-        # 安全措施通过以下方式实现:
-        # 1. 在 serve_static() 中添加 CSP 头限制恶意行为
-        # 2. X-Frame-Options 防止被恶意嵌入
-        # 3. 未来可以考虑将预览域名与主应用域名分离
-        # 如需启用HTML清理,请取消下面一行的注释:
-        # cleaned_html = sanitize_html(html_with_proxy)
-        cleaned_html = html_with_proxy
-
-        # 保存为index.html
-        file_path = os.path.join(dir_path, 'index.html')
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(cleaned_html)
-
-        # 提取并保存项目元数据
-        metadata = extract_html_metadata(html_content)
-        save_project_metadata(random_dir, metadata)
+        # 后处理队列已满时直接拒绝，避免积压无限增长
+        if not upload_pipeline_slots.acquire(blocking=False):
+            response = jsonify({'error': '服务器繁忙，请稍后重试'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+
+        try:
+            # 生成随机目录名
+            random_dir = generate_random_string()
+            while os.path.exists(get_project_dir(random_dir)):
+                random_dir = generate_random_string()
+            dir_path = get_project_dir(random_dir)
+
+            # 创建目录（新项目使用分片目录）
+            os.makedirs(dir_path, exist_ok=True)
+
+            # 先写标记再写入内容，进程中途退出时重启后可据标记恢复后处理
+            open(os.path.join(dir_path, UPLOAD_PENDING_MARKER), 'w').close()
+
+            # 重复上传的内容直接链接到已有的共享内容，不再写入新的副本
+            with timing_span('dedup'):
+                source_hash = get_source_hash(html_content)
+                blob_hash = find_blob_by_source(source_hash)
+            with timing_span('write'):
+                if blob_hash:
+                    try:
+                        attach_project_blob(random_dir, dir_path, blob_hash)
+                    except FileNotFoundError:
+                        # 共享内容恰好被并发释放，按普通上传处理
+                        blob_hash = None
+                if not blob_hash:
+                    write_file_atomic(os.path.join(dir_path, 'index.html'), html_content, durable=True)
+        except Exception:
+            upload_pipeline_slots.release()
+            raise
+
+        # 记录初始访问时间，从未被访问的项目从上传时刻开始计算过期
+        record_project_access(random_dir, views=0)
+        if not blob_hash:
+            add_storage_usage(content_size)
+
+        # CDN链接替换、元数据提取、索引更新和预取交给后台流水线
+        with timing_span('enqueue'):
+            submit_upload_pipeline(random_dir, {'source_hash': source_hash})
+        log_event('upload', f"项目已上传: {random_dir} ({content_size} bytes)",
+                  project_id=random_dir, bytes=content_size, deduplicated=bool(blob_hash))
 
         # 生成访问URL
         host_url = get_host_url()
         access_url = f"{host_url}/static/{random_dir}/index.html"
 
-        # 使项目列表缓存失效
-        invalidate_projects_cache()
-
         return jsonify({
             'success': True,
             'url': access_url,
             'project_id': random_dir,
-            'message': 'HTML文件已成功保存，CDN资源已自动代理'
+            'status_url': f"/api/projects/{random_dir}/status",
+            'message': 'HTML文件已成功保存，CDN资源代理和元数据提取正在后台处理'
         })
 
     except Exception as e:
@@ -718,34 +2853,142 @@ def upload_html():
         # 返回通用错误信息，避免泄漏系统细节
         return jsonify({'error': '保存失败,请稍后重试'}), 500
 
-@app.route('/api/projects', methods=['GET'])
-@csrf.exempt  # GET请求,只读操作,可以豁免CSRF
-def get_projects():
-    """获取已部署项目的API接口，支持分页"""
+@app.route('/api/projects/bulk', methods=['POST'])
+@limiter.limit("5 per hour")  # 批量上传速率限制
+def bulk_upload():
+    """
+    批量上传项目：请求体为 zip 或 tar(.gz) 归档，也可以用 multipart 的 archive 字段上传
+    归档边读边解到暂存目录，全部成功后才发布，统一写入一次访问索引；
+    各项目的 index.html 与单页上传一样由后处理流水线存入内容寻址存储
+    """
+    staging_dir = None
     try:
-        # 获取分页参数
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        is_within_quota, current_size, quota = check_storage_quota(max_age=STORAGE_USAGE_CACHE_TTL)
+        if not is_within_quota:
+            return jsonify({
+                'error': f'存储空间已满，当前使用: {current_size / (1024*1024):.1f}MB / {quota / (1024*1024):.1f}MB'
+            }), 507  # 507 Insufficient Storage
+
+        if request.mimetype == 'multipart/form-data':
+            archive_file = request.files.get('archive')
+            if archive_file is None:
+                return jsonify({'error': '请上传归档文件'}), 400
+            stream = archive_file.stream
+        else:
+            stream = request.stream
+
+        # 暂存目录放在 static/ 下，发布时 rename 不跨文件系统；
+        # 以 . 开头不是合法的项目ID，iter_project_dirs 不会把它当作项目
+        static_dir = app.config['UPLOAD_FOLDER']
+        os.makedirs(static_dir, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix='.bulk-', dir=static_dir)
+
+        max_total_size = min(BULK_UPLOAD_MAX_EXTRACTED_SIZE, quota - current_size)
+        metadata_by_path, total_size = extract_archive_to_staging(stream, staging_dir, max_total_size)
+        candidates = find_staged_projects(staging_dir, metadata_by_path)
+
+        # 每个项目占用一个后处理名额，名额不足时整个归档都不发布
+        acquired = 0
+        while acquired < len(candidates) and upload_pipeline_slots.acquire(blocking=False):
+            acquired += 1
+        if acquired < len(candidates):
+            for _ in range(acquired):
+                upload_pipeline_slots.release()
+            response = jsonify({'error': '服务器繁忙，请稍后重试'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        try:
+            published = publish_staged_projects(candidates)
+        except Exception:
+            for _ in candidates:
+                upload_pipeline_slots.release()
+            raise
+
+        # 批量记录初始访问时间并一次性写入索引，发布的项目立即出现在项目列表中
+        for _, project_id in published:
+            record_project_access(project_id, views=0)
+        flush_project_access_log()
+        invalidate_projects_cache()
+        add_storage_usage(total_size)
+
+        # 全部发布成功后才提交后处理，回滚时不会有处理中的任务
+        for _, project_id in published:
+            submit_upload_pipeline(project_id, pipeline='bulk')
+
+        host_url = get_host_url()
+        projects = [{
+            'name': name,
+            'project_id': project_id,
+            'url': f"{host_url}/static/{project_id}/index.html"
+        } for name, project_id in published]
+        logger.info(f"批量上传完成: {len(projects)} 个项目, {total_size} 字节")
+
+        return jsonify({
+            'success': True,
+            'projects': projects,
+            'count': len(projects),
+            'message': f'已成功发布 {len(projects)} 个项目，CDN资源已自动代理，压缩存储正在后台处理'
+        })
+
+    except ArchiveError as e:
+        logger.warning(f"批量上传被拒绝: {e}")
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        logger.error(f"批量上传失败: {e}")
+        return jsonify({'error': '批量上传失败,请稍后重试'}), 500
+    finally:
+        if staging_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+def get_projects_page():
+    """按请求参数取一页项目，返回 (页码, 每页数量, 本页项目, 项目总数)"""
+    # 获取分页参数
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
 
-        # 限制每页数量范围
-        per_page = max(1, min(per_page, 100))  # 1-100之间
-        page = max(1, page)  # 至少为1
+    # 限制每页数量范围
+    per_page = max(1, min(per_page, 100))  # 1-100之间
+    page = max(1, page)  # 至少为1
 
-        # 获取所有项目
-        all_projects = get_all_projects()
-        total = len(all_projects)
+    # 获取所有项目并计算分页
+    all_projects = get_all_projects()
+    start = (page - 1) * per_page
+    return page, per_page, all_projects[start:start + per_page], len(all_projects)
 
-        # 计算分页
-        start = (page - 1) * per_page
-        end = start + per_page
-        projects = all_projects[start:end]
+@app.route('/api/projects', methods=['GET'])
+@csrf.exempt  # GET请求,只读操作,可以豁免CSRF
+def get_projects():
+    """获取已部署项目的API接口，支持分页；本页缩略图拼图已生成时同时返回它的地址和坐标"""
+    try:
+        with timing_span('list'):
+            page, per_page, projects, total = get_projects_page()
 
         # 计算总页数
         total_pages = (total + per_page - 1) // per_page if total > 0 else 0
 
+        # 拼图只是优化：只使用已生成的拼图，未生成时在后台生成，本次由前端逐个加载缩略图
+        thumbnail_sprite = None
+        try:
+            with timing_span('sprite'):
+                sprite = get_thumbnail_sprite(projects, wait=False)
+        except Exception as e:
+            logger.warning(f"生成缩略图拼图失败: 第{page}页, 错误={e}")
+            sprite = None
+        if sprite:
+            version, _, coordinates = sprite
+            thumbnail_sprite = {
+                'url': f"/api/projects/thumbnails/sprite?page={page}&per_page={per_page}&v={version}",
+                'version': version,
+                'tiles': {
+                    project_id: {'x': x, 'y': y, 'width': width, 'height': height}
+                    for project_id, (x, y, width, height) in coordinates.items()
+                }
+            }
+
         return jsonify({
             'success': True,
             'projects': projects,
+            'thumbnail_sprite': thumbnail_sprite,
             'pagination': {
                 'page': page,
                 'per_page': per_page,
@@ -762,6 +3005,60 @@ def get_projects():
             'error': '获取项目列表失败,请稍后重试'
         }), 500
 
+@app.route('/api/projects/thumbnails/sprite', methods=['GET'])
+@csrf.exempt  # GET请求,只读操作,可以豁免CSRF
+def get_thumbnail_sprite_image():
+    """
+    获取一页项目的缩略图拼图（WebP）
+    地址中的版本号与当前拼图一致时长期缓存；页面内容已变化时返回 404，前端改为逐个加载缩略图
+    """
+    try:
+        _, _, projects, _ = get_projects_page()
+        sprite = get_thumbnail_sprite(projects)
+    except Exception as e:
+        logger.error(f"获取缩略图拼图失败: {e}")
+        return jsonify({'success': False, 'error': '获取缩略图拼图失败'}), 500
+
+    if sprite is None or sprite[0] != request.args.get('v'):
+        return jsonify({'success': False, 'error': '缩略图拼图不存在或已更新'}), 404
+
+    version, sprite_bytes, _ = sprite
+    response = Response(sprite_bytes, mimetype='image/webp')
+    response.headers['Cache-Control'] = THUMBNAIL_IMMUTABLE_CACHE_CONTROL
+    response.set_etag(version)
+    return response.make_conditional(request)
+
+@app.route('/api/projects/<project_id>/status', methods=['GET'])
+@csrf.exempt  # GET请求,只读操作,可以豁免CSRF
+def project_processing_status(project_id):
+    """
+    查询项目上传后处理的进度
+    进度记录在项目索引中，由哪个 worker 处理、由哪个 worker 查询都得到同一个结果
+    """
+    job = get_background_job('upload', project_id)
+    if job:
+        return jsonify({
+            'success': True,
+            'processing': job
+        })
+
+    project_dir = get_project_dir(project_id)
+    if project_dir is None or not has_project_html(project_dir):
+        return jsonify({
+            'success': False,
+            'error': '项目不存在'
+        }), 404
+    # 没有处理记录时以 .pending 标记为准：带标记的项目还在等待（恢复）处理，
+    # 没有标记的已有项目视为处理完成（例如记录已被淘汰的早期项目）
+    pending = os.path.exists(os.path.join(project_dir, UPLOAD_PENDING_MARKER))
+    return jsonify({
+        'success': True,
+        'processing': {
+            'project_id': project_id,
+            'status': 'pending' if pending else 'completed'
+        }
+    })
+
 @app.route('/api/storage/stats', methods=['GET'])
 @csrf.exempt  # GET请求,只读操作,可以豁免CSRF
 def get_storage_stats():
@@ -799,13 +3096,15 @@ def get_storage_stats():
 @app.route('/api/cleanup/run', methods=['POST'])
 @limiter.limit("5 per hour")  # 手动清理速率限制
 def manual_cleanup():
-    """手动触发清理过期项目"""
+    """手动触发清理过期项目（后台执行，返回任务ID）"""
     try:
-        cleanup_expired_projects()
+        job = submit_cleanup_job()
         return jsonify({
             'success': True,
-            'message': '清理任务已执行完成'
-        })
+            'job_id': job['id'],
+            'status_url': f"/api/cleanup/jobs/{job['id']}",
+            'message': '清理任务已提交，正在后台执行'
+        }), 202
     except Exception as e:
         logger.error(f"手动清理失败: {e}")
         return jsonify({
@@ -823,8 +3122,25 @@ def cleanup_status():
             'config': {
                 'expiry_days': PROJECT_EXPIRY_DAYS,
                 'cleanup_interval_hours': CLEANUP_INTERVAL_HOURS,
-                'enabled': scheduler.running
-            }
+                'access_flush_interval_seconds': ACCESS_FLUSH_INTERVAL_SECONDS,
+                'pending_access_records': len(project_access_log),
+                'max_seconds_per_run': CLEANUP_MAX_SECONDS_PER_RUN,
+                'max_deletions_per_run': CLEANUP_MAX_DELETIONS_PER_RUN,
+                'enabled': scheduler is not None and scheduler.running,
+                'cdn_cache_evict_interval_minutes': CDN_CACHE_EVICT_INTERVAL_MINUTES
+            },
+            'scheduler': {
+                'pid': os.getpid(),
+                'leader': is_scheduler_leader(),
+                'leader_pid': get_scheduler_leader_pid(),
+                'jobs': get_job_run_history()
+            },
+            'upload_pipeline': {
+                'workers': UPLOAD_PIPELINE_WORKERS,
+                'max_pending': UPLOAD_PIPELINE_MAX_PENDING,
+                'active': count_background_jobs('upload', ('queued', 'processing'))
+            },
+            'recent_jobs': list_background_jobs('cleanup', 5)
         })
     except Exception as e:
         logger.error(f"获取清理状态失败: {e}")
@@ -833,39 +3149,114 @@ def cleanup_status():
             'error': '获取清理状态失败,请稍后重试'
         }), 500
 
+@app.route('/api/cleanup/jobs/<job_id>', methods=['GET'])
+@csrf.exempt  # GET请求,只读操作,可以豁免CSRF
+def cleanup_job_status(job_id):
+    """查询后台清理任务的进度和结果（记录在项目索引中，由哪个 worker 执行都能查询到）"""
+    job = get_background_job('cleanup', job_id)
+    if not job:
+        return jsonify({
+            'success': False,
+            'error': '清理任务不存在'
+        }), 404
+    return jsonify({
+        'success': True,
+        'job': job
+    })
+
+@app.route('/api/metadata/backfill', methods=['POST'])
+@limiter.limit("5 per hour")
+def run_metadata_backfill():
+    """手动触发旧项目元数据回填（后台执行）"""
+    try:
+        start_metadata_backfill()
+        return jsonify({
+            'success': True,
+            'message': '元数据回填任务已在后台执行',
+            'status_url': '/api/metadata/backfill/status'
+        }), 202
+    except Exception as e:
+        logger.error(f"启动元数据回填失败: {e}")
+        return jsonify({
+            'success': False,
+            'error': '启动元数据回填失败,请稍后重试'
+        }), 500
+
+@app.route('/api/metadata/backfill/status', methods=['GET'])
+@csrf.exempt  # GET请求,只读操作,可以豁免CSRF
+def metadata_backfill_progress():
+    """查询旧项目元数据回填进度（记录在项目索引中，由哪个 worker 执行都能查询到）"""
+    return jsonify({
+        'success': True,
+        'backfill': get_metadata_backfill_status()
+    })
+
 @app.route('/api/projects/<project_id>/upload-thumbnail', methods=['POST'])
 def upload_thumbnail(project_id):
-    """上传项目缩略图"""
+    """
+    上传项目缩略图，支持三种请求体：
+    - image/png、image/webp、image/jpeg 原始图片
+    - multipart/form-data 的 thumbnail 文件字段
+    - JSON {"thumbnail": base64 数据}（兼容旧客户端）
+    """
     try:
         # 检查项目是否存在
-        project_path = os.path.join(app.config['UPLOAD_FOLDER'], project_id)
-        if not os.path.exists(project_path) or not os.path.isdir(project_path):
+        project_path = get_project_dir(project_id)
+        if project_path is None or not os.path.isdir(project_path):
             return jsonify({
                 'success': False,
                 'error': '项目不存在'
             }), 404
 
-        # 获取base64图片数据
-        data = request.get_json()
-        if not data or 'thumbnail' not in data:
+        # 其他客户端持有生成租约时拒绝，避免重复上传覆盖
+        lease_token = request.headers.get('X-Thumbnail-Lease')
+        if not check_thumbnail_lease(project_id, lease_token):
             return jsonify({
                 'success': False,
-                'error': '缺少缩略图数据'
-            }), 400
-
-        # 保存缩略图
-        success = save_thumbnail_from_base64(project_id, data['thumbnail'])
+                'error': '其他客户端正在生成该项目的缩略图'
+            }), 409
+
+        # 保存缩略图：二进制请求体直接流式写盘，JSON 请求体按 base64 解码
+        try:
+            if request.mimetype in THUMBNAIL_UPLOAD_MIMETYPES:
+                success = save_thumbnail_from_stream(project_id, request.stream)
+            elif request.mimetype == 'multipart/form-data':
+                try:
+                    thumbnail_file = request.files.get('thumbnail')
+                except RequestEntityTooLarge:
+                    raise thumbnail_too_large_error()
+                if thumbnail_file is None:
+                    return jsonify({
+                        'success': False,
+                        'error': '缺少缩略图数据'
+                    }), 400
+                success = save_thumbnail_from_stream(project_id, thumbnail_file.stream)
+            else:
+                data = request.get_json(silent=True)
+                if not data or 'thumbnail' not in data:
+                    return jsonify({
+                        'success': False,
+                        'error': '缺少缩略图数据'
+                    }), 400
+                success = save_thumbnail_from_base64(project_id, data['thumbnail'])
+        except InvalidThumbnailError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), e.status_code
 
         if success:
-            host_url = get_host_url()
-            thumbnail_url = f"{host_url}/static/{project_id}/thumbnail.png"
+            thumbnail_version = get_thumbnail_version(project_path)
+            release_thumbnail_lease(project_id)
 
-            # 使项目列表缓存失效(虽然缩略图不影响项目列表,但为了保持数据一致性)
+            # 使项目列表缓存失效（列表中包含缩略图的版本号和 srcset）
             invalidate_projects_cache()
 
             return jsonify({
                 'success': True,
-                'thumbnail_url': thumbnail_url,
+                'thumbnail_url': get_thumbnail_url(project_id, thumbnail_version),
+                'thumbnail_version': thumbnail_version,
+                'thumbnail_srcset': get_thumbnail_srcset(project_id, project_path, thumbnail_version),
                 'message': '缩略图上传成功'
             })
         else:
@@ -881,14 +3272,76 @@ def upload_thumbnail(project_id):
             'error': '上传缩略图失败,请稍后重试'
         }), 500
 
+@app.route('/api/projects/<project_id>/thumbnail-lease', methods=['POST'])
+@limiter.limit("600 per hour")  # 首页每个缺少缩略图的项目都会申请一次
+def claim_thumbnail_generation(project_id):
+    """
+    申请为项目生成缩略图，返回的 status：
+    - ready: 缩略图已存在，直接使用返回的地址
+    - granted: 获得租约，客户端截图后带 X-Thumbnail-Lease 头上传
+    - pending: 其他客户端正在生成，retry_after 秒后再来查询
+    """
+    try:
+        project_path = get_project_dir(project_id)
+        if project_path is None or not os.path.isdir(project_path):
+            return jsonify({
+                'success': False,
+                'error': '项目不存在'
+            }), 404
+
+        thumbnail_version = get_thumbnail_version(project_path)
+        if thumbnail_version:
+            return jsonify({
+                'success': True,
+                'status': 'ready',
+                'thumbnail_url': get_thumbnail_url(project_id, thumbnail_version),
+                'thumbnail_version': thumbnail_version,
+                'thumbnail_srcset': get_thumbnail_srcset(project_id, project_path, thumbnail_version)
+            })
+
+        lease_token, remaining = claim_thumbnail_lease(project_id)
+        if lease_token:
+            return jsonify({
+                'success': True,
+                'status': 'granted',
+                'lease_token': lease_token,
+                'expires_in': THUMBNAIL_LEASE_SECONDS
+            })
+        return jsonify({
+            'success': True,
+            'status': 'pending',
+            'retry_after': max(1, math.ceil(min(remaining, THUMBNAIL_LEASE_RETRY_SECONDS)))
+        })
+
+    except Exception as e:
+        logger.error(f"申请缩略图生成租约失败: 项目ID={project_id}, 错误={e}")
+        return jsonify({
+            'success': False,
+            'error': '申请缩略图生成失败,请稍后重试'
+        }), 500
+
+@app.route('/api/projects/<project_id>/thumbnail-lease', methods=['DELETE'])
+@limiter.limit("600 per hour")
+def release_thumbnail_generation(project_id):
+    """租约持有者截图失败时主动释放租约，让其他客户端接手"""
+    try:
+        release_thumbnail_lease(project_id, request.headers.get('X-Thumbnail-Lease', ''))
+        return jsonify({'success': True})
+    except Exception as e:
+        logger.error(f"释放缩略图生成租约失败: 项目ID={project_id}, 错误={e}")
+        return jsonify({
+            'success': False,
+            'error': '释放租约失败'
+        }), 500
+
 @app.route('/api/projects/<project_id>', methods=['DELETE'])
 @limiter.limit("20 per hour")  # 删除速率限制
 def delete_project(project_id):
     """删除项目"""
     try:
         # 检查项目是否存在
-        project_path = os.path.join(app.config['UPLOAD_FOLDER'], project_id)
-        if not os.path.exists(project_path) or not os.path.isdir(project_path):
+        project_path = get_project_dir(project_id)
+        if project_path is None or not os.path.isdir(project_path):
             return jsonify({
                 'success': False,
                 'error': '项目不存在'
@@ -905,6 +3358,7 @@ def delete_project(project_id):
 
         # 删除整个项目目录
         shutil.rmtree(project_path)
+        remove_from_project_index([project_id])
 
         # 使项目列表缓存失效
         invalidate_projects_cache()
@@ -921,105 +3375,578 @@ def delete_project(project_id):
             'error': '删除项目失败,请稍后重试'
         }), 500
 
-def cleanup_expired_projects():
+def evict_expired_cdn_cache():
+    """
+    删除超过 CDN_CACHE_TTL 的 CDN 缓存文件，返回删除的文件数
+    由 leader 进程定时执行，也可以通过 /api/cdn-cache/cleanup 手动触发
+    """
+    deleted_files = 0
+    if os.path.exists(CDN_CACHE_DIR):
+        current_time = time.time()
+        for filename in os.listdir(CDN_CACHE_DIR):
+            file_path = os.path.join(CDN_CACHE_DIR, filename)
+            try:
+                if os.path.isfile(file_path) and current_time - os.path.getmtime(file_path) > CDN_CACHE_TTL:
+                    os.remove(file_path)
+                    deleted_files += 1
+                    logger.info(f"删除过期缓存文件: {filename}")
+            except FileNotFoundError:
+                # 其它进程（手动清理）已删除
+                continue
+    return deleted_files
+
+def try_lock_file(path):
+    """
+    非阻塞地对文件加独占锁，成功时返回文件描述符（关闭即释放），已被其它进程持有时返回 None
+    不支持 fcntl 的平台上没有多进程部署，直接视为成功并返回 -1
+    """
+    if fcntl is None:
+        return -1
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+def unlock_file(fd):
+    """释放 try_lock_file 获取的锁"""
+    if fd is not None and fd >= 0:
+        os.close(fd)
+
+def cleanup_expired_projects(progress=None, on_progress=None):
     """
     清理过期项目的后台任务
     删除超过 PROJECT_EXPIRY_DAYS 天未访问的项目
+
+    按项目索引中的最后访问时间从旧到新分批删除，只触及已过期的项目，
+    单次运行受 CLEANUP_MAX_SECONDS_PER_RUN / CLEANUP_MAX_DELETIONS_PER_RUN 限制，
+    未删完的部分留给下一次运行
+    progress: 可选的字典，运行过程中实时更新进度（供后台任务状态查询）
+    on_progress: 可选的回调，每处理完一批后调用，用于把进度保存到别处
+    返回本次运行的统计信息
     """
+    progress = progress if progress is not None else {}
+    progress.update({'scanned': 0, 'deleted': 0, 'budget_exhausted': False})
+
+    # 同一时间只允许一个清理任务运行
+    if not cleanup_lock.acquire(blocking=False):
+        logger.info("已有清理任务在运行，跳过本次清理")
+        progress['skipped'] = True
+        return progress
+    # 手动触发的清理可能落在任意 worker 上，再用文件锁排除其它进程中正在运行的清理
+    cleanup_lock_fd = try_lock_file(f"{app.config['PROJECT_INDEX_PATH']}.cleanup.lock")
+    if cleanup_lock_fd is None:
+        cleanup_lock.release()
+        logger.info("其它进程正在执行清理任务，跳过本次清理")
+        progress['skipped'] = True
+        return progress
+
     try:
         logger.info(f"开始执行自动清理任务，过期天数: {PROJECT_EXPIRY_DAYS}")
         static_dir = app.config['UPLOAD_FOLDER']
 
         if not os.path.exists(static_dir):
             logger.info("静态文件目录不存在，跳过清理")
-            return
+            return progress
 
-        current_time = time.time()
-        expiry_seconds = PROJECT_EXPIRY_DAYS * 24 * 60 * 60
-        deleted_count = 0
+        # 先把内存中尚未落盘的访问记录写入索引，并补录索引中缺失的旧项目
+        flush_project_access_log()
+        sync_project_index()
 
-        for item in os.listdir(static_dir):
-            item_path = os.path.join(static_dir, item)
+        started = time.monotonic()
+        cutoff = time.time() - PROJECT_EXPIRY_DAYS * 24 * 60 * 60
+        deleted_projects = []
 
-            # 只处理目录
-            if not os.path.isdir(item_path):
-                continue
+        while True:
+            remaining = CLEANUP_MAX_DELETIONS_PER_RUN - progress['deleted']
+            if remaining <= 0 or time.monotonic() - started > CLEANUP_MAX_SECONDS_PER_RUN:
+                progress['budget_exhausted'] = True
+                break
 
-            try:
-                # 获取项目的最后修改时间
-                # 使用 index.html 的修改时间作为参考
-                index_file = os.path.join(item_path, 'index.html')
-                if not os.path.exists(index_file):
+            batch = get_expired_projects(cutoff, min(CLEANUP_BATCH_SIZE, remaining))
+            if not batch:
+                break
+
+            batch_ids = []
+            refreshed = 0
+            for item, last_access in batch:
+                progress['scanned'] += 1
+
+                # 落盘之后又被访问的项目不删除
+                pending = project_access_log.get(item)
+                if pending and pending[0] >= cutoff:
+                    flush_project_access_log()
+                    refreshed += 1
                     continue
 
-                # 获取文件的最后修改时间
-                last_modified = os.path.getmtime(index_file)
-                age_seconds = current_time - last_modified
+                item_path = get_project_dir(item)
+                try:
+                    if item_path is not None and os.path.isdir(item_path):
+                        idle_days = (time.time() - last_access) / (24 * 60 * 60)
+                        logger.info(f"删除过期项目: {item}, 未访问: {idle_days:.1f} 天")
+                        shutil.rmtree(item_path)
+                        deleted_projects.append(item)
+                        progress['deleted'] += 1
+                    # 目录已不存在的记录同样从索引中移除
+                    batch_ids.append(item)
+                except Exception as e:
+                    logger.error(f"清理项目 {item} 时出错: {e}")
+                    continue
 
-                # 如果项目过期，删除它
-                if age_seconds > expiry_seconds:
-                    logger.info(f"删除过期项目: {item}, 年龄: {age_seconds / (24*60*60):.1f} 天")
-                    shutil.rmtree(item_path)
-                    deleted_count += 1
+            remove_from_project_index(batch_ids)
+            if on_progress is not None:
+                on_progress()
+            if not batch_ids and not refreshed:
+                # 整批都删除失败，避免在同一批记录上空转
+                break
 
-            except Exception as e:
-                logger.error(f"清理项目 {item} 时出错: {e}")
-                continue
+            # 批次之间让出磁盘，避免影响并发的预览访问
+            if len(batch) == CLEANUP_BATCH_SIZE and CLEANUP_BATCH_PAUSE_SECONDS > 0:
+                time.sleep(CLEANUP_BATCH_PAUSE_SECONDS)
 
-        logger.info(f"自动清理任务完成，删除了 {deleted_count} 个过期项目")
+        progress['duration_seconds'] = round(time.monotonic() - started, 3)
+        CLEANUP_SECONDS.observe(progress['duration_seconds'])
+        CLEANUP_DELETED.inc(progress['deleted'])
+        logger.info(f"自动清理任务完成，删除了 {len(deleted_projects)} 个过期项目")
+        if progress['budget_exhausted']:
+            logger.info("已达到单次清理预算，剩余过期项目留待下次清理")
 
         # 如果删除了任何项目，使缓存失效
-        if deleted_count > 0:
+        if deleted_projects:
             invalidate_projects_cache()
 
     except Exception as e:
         logger.error(f"执行自动清理任务失败: {e}")
+        progress['error'] = str(e)
+    finally:
+        unlock_file(cleanup_lock_fd)
+        cleanup_lock.release()
 
-# 初始化后台调度器
-scheduler = BackgroundScheduler()
-scheduler.add_job(
-    func=cleanup_expired_projects,
-    trigger="interval",
-    hours=CLEANUP_INTERVAL_HOURS,
-    id='cleanup_expired_projects',
-    name='清理过期项目',
-    replace_existing=True
-)
-scheduler.start()
-logger.info(f"后台清理任务已启动，间隔: {CLEANUP_INTERVAL_HOURS} 小时")
+    return progress
 
-@app.route('/static/<path:filename>')
-@csrf.exempt  # 静态文件服务,可以豁免CSRF
-def serve_static(filename):
+def run_cleanup_job(job):
     """
-    提供静态文件访问
-    添加安全头以隔离用户内容
+    在后台线程中执行手动触发的清理任务，并把状态和每批之后的进度写入项目索引
     """
-    # 先获取文件响应
-    file_response = send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    job['status'] = 'running'
+    job['started_at'] = datetime.datetime.now().isoformat()
+    save_background_job('cleanup', job['id'], job)
+    try:
+        cleanup_expired_projects(progress=job['progress'],
+                                 on_progress=lambda: save_background_job('cleanup', job['id'], job))
+        job['status'] = 'failed' if 'error' in job['progress'] else 'completed'
+    except Exception as e:
+        logger.error(f"清理任务 {job['id']} 执行失败: {e}")
+        job['progress']['error'] = str(e)
+        job['status'] = 'failed'
+    finally:
+        job['finished_at'] = datetime.datetime.now().isoformat()
+        save_background_job('cleanup', job['id'], job)
 
-    # 使用 make_response 创建响应对象以便修改头信息
-    response = make_response(file_response)
+def is_process_alive(pid):
+    """同一台机器上 pid 对应的进程是否仍在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
 
-    # 添加 Content-Security-Policy 头
-    # 注意: 对于预览工具,我们允许脚本执行,因为这是用户的预期
-    # 但我们限制外部资源加载,除非通过代理
-    response.headers['Content-Security-Policy'] = (
-        "default-src 'self' 'unsafe-inline' 'unsafe-eval' data: blob:; "
-        "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://cdn.jsdelivr.net https://unpkg.com https://cdnjs.cloudflare.com https://cdn.tailwindcss.com; "
-        "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net https://unpkg.com https://cdnjs.cloudflare.com https://fonts.googleapis.com; "
-        "img-src 'self' data: https:; "
-        "font-src 'self' data: https://fonts.gstatic.com https://cdn.jsdelivr.net; "
-        "connect-src 'self' https:; "
-        "frame-ancestors 'none'; "
-        "base-uri 'self';"
+def get_process_start_time(pid):
+    """进程的启动时间（/proc/<pid>/stat 第 22 项，开机后的时钟滴答数），无法读取时返回 None"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return int(f.read().rsplit(')', 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+def is_job_owner_alive(job):
+    """
+    记录中的任务所属进程是否仍在运行
+    同时比较进程启动时间，容器重启后 pid 被新进程复用时不会误判为仍在运行
+    """
+    pid = job.get('pid')
+    if not pid or not is_process_alive(pid):
+        return False
+    started_at = job.get('pid_started_at')
+    return started_at is None or started_at == get_process_start_time(pid)
+
+def submit_cleanup_job():
+    """
+    提交一个后台清理任务
+    任何进程中已有排队或运行中的任务时直接返回该任务，不重复提交
+    （提交任务的进程已退出时，它留下的未完成记录不再算数）
+    返回任务状态字典
+    """
+    for job in reversed(list_background_jobs('cleanup', MAX_CLEANUP_JOB_HISTORY)):
+        if job['status'] in ('queued', 'running') and is_process_alive(job['pid']):
+            return job
+
+    job_id = uuid.uuid4().hex[:12]
+    job = {
+        'id': job_id,
+        'status': 'queued',
+        'pid': os.getpid(),
+        'created_at': datetime.datetime.now().isoformat(),
+        'started_at': None,
+        'finished_at': None,
+        'progress': {},
+    }
+    save_background_job('cleanup', job_id, job, history_limit=MAX_CLEANUP_JOB_HISTORY)
+
+    cleanup_executor.submit(run_cleanup_job, job)
+    return job
+
+# 后台调度器（首次启动后台服务时才创建，单纯导入 main 不加载 apscheduler、不启动线程）
+scheduler = None
+scheduler_lock_fd = None  # 持有调度锁的文件描述符，进程退出时由系统释放
+
+def get_scheduler():
+    """获取后台调度器，首次调用时创建"""
+    global scheduler
+    if scheduler is None:
+        from apscheduler.schedulers.background import BackgroundScheduler
+        scheduler = BackgroundScheduler()
+    return scheduler
+
+def get_scheduler_lock_path():
+    """调度锁文件位于项目索引旁，同一份数据目录上的所有进程竞争同一把锁"""
+    return f"{app.config['PROJECT_INDEX_PATH']}.scheduler.lock"
+
+def acquire_scheduler_lock():
+    """
+    非阻塞地获取调度锁（项目索引旁的 .scheduler.lock 文件），获取成功后在进程存活期间一直持有
+    多进程部署时只有拿到锁的进程（leader）运行清理、CDN 缓存淘汰等只需执行一次的任务；
+    leader 退出后锁自动释放，由其它进程在下一次竞选时接手。锁文件中写入 leader 的 pid
+    """
+    global scheduler_lock_fd
+    if scheduler_lock_fd is not None:
+        return True
+    fd = try_lock_file(get_scheduler_lock_path())
+    if fd is None:
+        return False
+    if fd >= 0:
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, str(os.getpid()).encode('ascii'), 0)
+    scheduler_lock_fd = fd
+    return True
+
+def is_scheduler_leader():
+    """当前进程是否持有调度锁"""
+    return scheduler_lock_fd is not None
+
+def get_scheduler_leader_pid():
+    """
+    返回当前持有调度锁的进程 pid，没有 leader 时返回 None
+    锁文件中的 pid 可能是已退出的旧 leader 留下的，只有锁确实被持有时才采信
+    """
+    if is_scheduler_leader():
+        return os.getpid()
+    if fcntl is None:
+        return None
+    try:
+        fd = os.open(get_scheduler_lock_path(), os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except OSError:
+            content = os.pread(fd, 32, 0).decode('ascii', 'ignore').strip()
+            return int(content) if content.isdigit() else None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return None
+    finally:
+        os.close(fd)
+
+def save_background_job(kind, job_id, job, history_limit=None):
+    """
+    把后台任务的状态写入项目索引（所有进程共享），写入失败只记录日志
+    history_limit 不为空时只保留该类任务最近创建的 history_limit 条记录
+    """
+    try:
+        now = time.time()
+        conn = get_project_index()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO background_jobs (kind, id, status, data, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(kind, id) DO UPDATE SET
+                    status = excluded.status, data = excluded.data, updated_at = excluded.updated_at
+                """,
+                (kind, job_id, job['status'], json.dumps(job, ensure_ascii=False), now, now)
+            )
+            if history_limit:
+                conn.execute(
+                    'DELETE FROM background_jobs WHERE kind = ? AND id IN ('
+                    'SELECT id FROM background_jobs WHERE kind = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                    (kind, kind, history_limit)
+                )
+    except Exception as e:
+        logger.error(f"保存后台任务状态失败: 类型={kind}, ID={job_id}, 错误={e}")
+
+def get_background_job(kind, job_id):
+    """从项目索引读取后台任务的状态，不存在或读取失败时返回 None"""
+    try:
+        row = get_project_index().execute(
+            'SELECT data FROM background_jobs WHERE kind = ? AND id = ?', (kind, job_id)
+        ).fetchone()
+    except Exception as e:
+        logger.error(f"读取后台任务状态失败: 类型={kind}, ID={job_id}, 错误={e}")
+        return None
+    return json.loads(row[0]) if row else None
+
+def list_background_jobs(kind, limit):
+    """返回某类后台任务最近创建的 limit 条记录（按创建先后排列，最新的在最后）"""
+    rows = get_project_index().execute(
+        'SELECT data FROM background_jobs WHERE kind = ? ORDER BY created_at DESC LIMIT ?', (kind, limit)
+    ).fetchall()
+    return [json.loads(row[0]) for row in reversed(rows)]
+
+def count_background_jobs(kind, statuses):
+    """统计项目索引中处于指定状态的某类后台任务数（所有进程合计）"""
+    placeholders = ', '.join('?' * len(statuses))
+    return get_project_index().execute(
+        f'SELECT COUNT(*) FROM background_jobs WHERE kind = ? AND status IN ({placeholders})',
+        (kind, *statuses)
+    ).fetchone()[0]
+
+def record_job_run_start(job_id, started_at):
+    """在项目索引中记录一次定时任务开始运行，返回记录 id（写入失败时返回 None）"""
+    try:
+        conn = get_project_index()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO job_runs (job_id, pid, started_at, status) VALUES (?, ?, ?, 'running')",
+                (job_id, os.getpid(), started_at)
+            )
+        return cursor.lastrowid
+    except Exception as e:
+        logger.error(f"记录定时任务 {job_id} 运行失败: {e}")
+        return None
+
+def record_job_run_finish(run_id, job_id, duration, status, error=None):
+    """更新运行记录的耗时和结果，并只保留每个任务最近 JOB_RUN_HISTORY_LIMIT 条记录"""
+    if run_id is None:
+        return
+    try:
+        conn = get_project_index()
+        with conn:
+            conn.execute(
+                'UPDATE job_runs SET duration = ?, status = ?, error = ? WHERE id = ?',
+                (round(duration, 3), status, error, run_id)
+            )
+            conn.execute(
+                'DELETE FROM job_runs WHERE job_id = ? AND id <= ('
+                'SELECT id FROM job_runs WHERE job_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                (job_id, job_id, JOB_RUN_HISTORY_LIMIT)
+            )
+    except Exception as e:
+        logger.error(f"记录定时任务 {job_id} 运行结果失败: {e}")
+
+def get_job_run_history(limit_per_job=5):
+    """
+    按任务汇总项目索引中的运行记录（所有进程共享），最近的在前
+    返回 {任务ID: {'last_run': ..., 'average_duration': ..., 'runs': [...]}}
+    """
+    conn = get_project_index()
+    rows = conn.execute(
+        'SELECT job_id, pid, started_at, duration, status, error FROM job_runs ORDER BY id DESC'
+    ).fetchall()
+    history = {}
+    for job_id, pid, started_at, duration, status, error in rows:
+        runs = history.setdefault(job_id, [])
+        runs.append({
+            'pid': pid,
+            'started_at': datetime.datetime.fromtimestamp(started_at).isoformat(),
+            'duration_seconds': duration,
+            'status': status,
+            'error': error,
+        })
+    result = {}
+    for job_id, runs in history.items():
+        durations = [run['duration_seconds'] for run in runs if run['duration_seconds'] is not None]
+        result[job_id] = {
+            'last_run': runs[0],
+            'average_duration': round(sum(durations) / len(durations), 3) if durations else None,
+            'runs': runs[:limit_per_job],
+        }
+    return result
+
+def get_last_job_run_at(job_id):
+    """返回任务最近一次开始运行的时间戳，没有记录时返回 None"""
+    try:
+        row = get_project_index().execute(
+            'SELECT started_at FROM job_runs WHERE job_id = ? ORDER BY id DESC LIMIT 1', (job_id,)
+        ).fetchone()
+    except Exception as e:
+        logger.error(f"读取定时任务 {job_id} 运行记录失败: {e}")
+        return None
+    return row[0] if row else None
+
+def run_scheduled_job(job_id, func):
+    """执行 leader 负责的定时任务，并把开始时间、耗时和结果写入项目索引"""
+    started = time.monotonic()
+    run_id = record_job_run_start(job_id, time.time())
+    status, error = 'completed', None
+    try:
+        result = func()
+        if isinstance(result, dict):
+            if result.get('error') or result.get('status') == 'failed':
+                status, error = 'failed', result.get('error')
+            elif result.get('skipped'):
+                status = 'skipped'
+    except Exception as e:
+        logger.error(f"定时任务 {job_id} 执行失败: {e}")
+        status, error = 'failed', str(e)
+    finally:
+        record_job_run_finish(run_id, job_id, time.monotonic() - started, status, error)
+
+def add_interval_leader_job(job_id, name, func, interval_seconds):
+    """
+    注册周期性的 leader 任务
+    接手的新 leader 根据运行记录续上原来的节奏：距上次运行已超过间隔时立即运行，否则等到原定时间
+    """
+    last_run_at = get_last_job_run_at(job_id)
+    next_run_at = time.time() + interval_seconds if last_run_at is None else max(time.time(), last_run_at + interval_seconds)
+    get_scheduler().add_job(
+        func=run_scheduled_job,
+        args=(job_id, func),
+        trigger="interval",
+        seconds=interval_seconds,
+        next_run_time=datetime.datetime.fromtimestamp(next_run_at),
+        id=job_id,
+        name=name,
+        replace_existing=True
+    )
+
+def start_leader_jobs():
+    """成为 leader 后注册整个部署中只需执行一次的任务"""
+    add_interval_leader_job('cleanup_expired_projects', '清理过期项目',
+                            cleanup_expired_projects, CLEANUP_INTERVAL_HOURS * 3600)
+    add_interval_leader_job('evict_expired_cdn_cache', '清理过期 CDN 缓存',
+                            evict_expired_cdn_cache, CDN_CACHE_EVICT_INTERVAL_MINUTES * 60)
+    # 立即恢复未完成的上传后处理（leader 切换时跳过仍在其它 worker 中处理的项目）
+    get_scheduler().add_job(
+        func=run_scheduled_job,
+        args=('resume_upload_pipeline', resume_upload_pipeline),
+        trigger="date",
+        id='resume_upload_pipeline',
+        name='恢复上传后处理',
+        replace_existing=True
+    )
+    # 立即在后台为旧项目回填一次元数据（项目索引中已记录完成时跳过）
+    get_scheduler().add_job(
+        func=run_scheduled_job,
+        args=('backfill_project_metadata', backfill_project_metadata),
+        trigger="date",
+        id='backfill_project_metadata',
+        name='回填旧项目元数据',
+        replace_existing=True
+    )
+
+def elect_scheduler_leader():
+    """
+    竞选 leader：拿到调度锁后注册 leader 任务并停止重试
+    非 leader 进程定期调用，原 leader 退出后由最先重试成功的进程接手
+    返回当前进程是否为 leader
+    """
+    if is_scheduler_leader():
+        return True
+    if not acquire_scheduler_lock():
+        return False
+    if get_scheduler().get_job('elect_scheduler_leader'):
+        get_scheduler().remove_job('elect_scheduler_leader')
+    start_leader_jobs()
+    logger.info(f"进程 {os.getpid()} 成为调度 leader，负责定时清理，清理间隔: {CLEANUP_INTERVAL_HOURS} 小时")
+    return True
+
+def start_background_services():
+    """
+    启动后台服务
+    访问记录落盘是每个进程自己的任务；过期清理、CDN 缓存淘汰、恢复上传后处理和元数据回填
+    只由 leader 运行，其它进程每隔 SCHEDULER_ELECTION_INTERVAL_SECONDS 秒重试获取调度锁
+    """
+    get_scheduler().add_job(
+        func=flush_project_access_log,
+        trigger="interval",
+        seconds=ACCESS_FLUSH_INTERVAL_SECONDS,
+        id='flush_project_access_log',
+        name='访问记录落盘',
+        replace_existing=True
     )
+    if not elect_scheduler_leader():
+        get_scheduler().add_job(
+            func=elect_scheduler_leader,
+            trigger="interval",
+            seconds=SCHEDULER_ELECTION_INTERVAL_SECONDS,
+            id='elect_scheduler_leader',
+            name='竞选调度 leader',
+            replace_existing=True
+        )
+        logger.info(f"调度锁由其它进程持有，每 {SCHEDULER_ELECTION_INTERVAL_SECONDS} 秒重试接手定时任务")
+    get_scheduler().start()
+
+def stop_background_services():
+    """停止调度器，等待上传后处理完成，并写入尚未落盘的访问记录"""
+    global scheduler_lock_fd
+    if scheduler is not None and scheduler.running:
+        scheduler.shutdown()
+    upload_pipeline_executor.shutdown(wait=True)
+    flush_project_access_log()
+    # 主动释放调度锁，其它进程在下一次竞选时即可接手
+    unlock_file(scheduler_lock_fd)
+    scheduler_lock_fd = None
+    logger.info("后台清理任务已停止")
+
+def _reset_after_fork():
+    """
+    fork 出的子进程不能沿用父进程的 SQLite 连接，重新按线程建立；
+    继承来的调度锁描述符属于父进程，子进程关闭它并自己参与竞选
+    """
+    global _project_index_local, scheduler_lock_fd
+    _project_index_local = threading.local()
+    unlock_file(scheduler_lock_fd)
+    scheduler_lock_fd = None
 
-    # 添加 X-Frame-Options 防止被嵌入
-    response.headers['X-Frame-Options'] = 'SAMEORIGIN'
+os.register_at_fork(after_in_child=_reset_after_fork)
 
-    # 添加 X-Content-Type-Options
-    response.headers['X-Content-Type-Options'] = 'nosniff'
+@app.route('/static/<path:filename>')
+@csrf.exempt  # 静态文件服务,可以豁免CSRF
+def serve_static(filename):
+    """
+    提供静态文件访问
+    添加安全头以隔离用户内容
+    """
+    # 公开URL保持 /static/<project_id>/<文件>，这里映射到实际的（分片）项目目录
+    project_id, _, rest = filename.partition('/')
+    with timing_span('resolve'):
+        project_dir = get_project_dir(project_id)
+    if project_dir is None or not rest:
+        abort(404)
+
+    # 先获取文件响应（预览页按客户端支持的编码发送预压缩版本）
+    # open 阶段只包含选择和打开文件，文件内容在视图返回后才发送
+    if rest == 'index.html':
+        with timing_span('open'):
+            response = send_project_html(project_dir)
+        # 记录预览页访问（只写内存，由后台任务批量落盘）
+        record_project_access(project_id)
+    else:
+        with timing_span('open'):
+            response = send_static_file(project_dir, rest)
+        # 带版本号的缩略图地址在缩略图更新后会变化，内容可以长期缓存
+        # 只有版本号与当前缩略图一致时才长期缓存，旧版本号或随意的 v 参数保持普通缓存策略
+        version = request.args.get('v')
+        if rest.startswith('thumbnail') and version and version == get_thumbnail_version(project_dir):
+            response.headers['Cache-Control'] = THUMBNAIL_IMMUTABLE_CACHE_CONTROL
+
+    # 添加预先计算好的安全头
+    for header, value in PREVIEW_SECURITY_HEADERS:
+        response.headers[header] = value
 
     return response
 
@@ -1031,8 +3958,9 @@ def get_cdn_cache_stats():
     """获取 CDN 缓存统计信息"""
     try:
         # 统计内存缓存
-        memory_items = len(cdn_memory_cache)
-        memory_size = sum(len(item[0]) for item in cdn_memory_cache.values())
+        memory_stats = get_cdn_memory_cache().stats()
+        memory_items = memory_stats['items']
+        memory_size = memory_stats['bytes']
 
         # 统计文件缓存
         file_items = 0
@@ -1049,7 +3977,9 @@ def get_cdn_cache_stats():
                 'items': memory_items,
                 'size_bytes': memory_size,
                 'size_mb': round(memory_size / (1024 * 1024), 2),
-                'max_items': CDN_CACHE_MAX_MEMORY_ITEMS,
+                'max_items': memory_stats['max_items'],
+                'capacity_mb': round(memory_stats['capacity_bytes'] / (1024 * 1024), 2),
+                'shared': memory_stats['shared'],
             },
             'file_cache': {
                 'items': file_items,
@@ -1073,7 +4003,7 @@ def clear_cdn_cache():
     """清空 CDN 缓存"""
     try:
         # 清空内存缓存
-        cdn_memory_cache.clear()
+        get_cdn_memory_cache().clear()
         logger.info("内存缓存已清空")
 
         # 清空文件缓存
@@ -1099,18 +4029,7 @@ def clear_cdn_cache():
 def cleanup_expired_cdn_cache():
     """清理过期的 CDN 缓存文件"""
     try:
-        deleted_files = 0
-        if os.path.exists(CDN_CACHE_DIR):
-            current_time = time.time()
-            for filename in os.listdir(CDN_CACHE_DIR):
-                file_path = os.path.join(CDN_CACHE_DIR, filename)
-                if os.path.isfile(file_path):
-                    file_mtime = os.path.getmtime(file_path)
-                    if current_time - file_mtime > CDN_CACHE_TTL:
-                        os.remove(file_path)
-                        deleted_files += 1
-                        logger.info(f"删除过期缓存文件: {filename}")
-
+        deleted_files = evict_expired_cdn_cache()
         return jsonify({
             'success': True,
             'message': f'清理完成，删除了 {deleted_files} 个过期文件'
@@ -1119,12 +4038,25 @@ def cleanup_expired_cdn_cache():
         logger.error(f"清理过期 CDN 缓存失败: {e}")
         return jsonify({'error': '清理过期缓存失败'}), 500
 
+@app.route('/api/logging/stats', methods=['GET'])
+@csrf.exempt  # GET 请求，可以豁免 CSRF
+@limiter.limit("30 per hour")
+def get_logging_stats():
+    """获取本进程日志队列的积压、丢弃和采样计数（每个 worker 进程各自统计）"""
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'format': LOG_FORMAT,
+        'logging': queue_logging.stats()
+    })
+
 # 错误处理器
 @app.errorhandler(413)
 def request_entity_too_large(error):
-    """处理请求体过大的错误"""
+    """处理请求体过大的错误（按当前接口实际生效的上限提示）"""
+    max_size = request.max_content_length or MAX_CONTENT_LENGTH
     return jsonify({
-        'error': f'请求内容过大,最大允许{MAX_CONTENT_LENGTH / (1024*1024):.1f}MB'
+        'error': f'请求内容过大,最大允许{max_size / (1024*1024):.1f}MB'
     }), 413
 
 @app.errorhandler(429)
@@ -1134,7 +4066,23 @@ def ratelimit_handler(error):
         'error': '请求过于频繁,请稍后再试'
     }), 429
 
+def create_app(start_services=True):
+    """
+    应用工厂：完成导入 main 时刻意不做的进程级初始化，返回配置好的 app
+    - 配置日志（app.log + 控制台）
+    - start_services 为 True 时启动后台服务（访问记录落盘、竞选调度 leader）
+    导入 main 只注册路由，不创建日志文件、不启动线程，测试直接使用 main.app 即可；
+    gunicorn 预加载时由 wsgi.py 以 start_services=False 调用，后台服务在 fork 之后启动
+    """
+    configure_logging()
+    if start_services:
+        start_background_services()
+    return app
+
 if __name__ == '__main__':
+    create_app()
+    # 清空上一次运行留下的指标文件
+    metrics_registry.clear()
     # 确保static目录存在
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     # 从环境变量读取调试模式设置,生产环境应设置 DEBUG=False
@@ -1142,6 +4090,6 @@ if __name__ == '__main__':
     try:
         app.run(debug=debug_mode, port=port, host='0.0.0.0')
     finally:
-        # 应用关闭时停止调度器
-        scheduler.shutdown()
-        logger.info("后台清理任务已停止") 
\ No newline at end of file
+        # 应用关闭时停止调度器，并写入尚未落盘的访问记录；单进程运行，可以直接删除共享缓存文件
+        stop_background_services()
+        remove_cdn_memory_cache() 
\ No newline at end of file
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程汇总的 Prometheus 指标
+每个 worker 进程只写自己的 mmap 文件（目录下的 metrics-<pid>.db），不需要跨进程加锁；
+/metrics 被访问时读取目录下所有进程的文件并求和，输出 Prometheus 文本格式（0.0.4）
+
+文件布局: 8 字节的已用长度，之后是依次追加的条目
+条目: 4 字节键长度 + JSON 编码的键（指标名、后缀、标签）+ 补齐到 8 字节 + 8 字节 double 值
+新条目先写完内容再更新已用长度，读取方只解析已用长度以内的部分，不会读到写了一半的条目
+
+- Counter / Histogram 的值在进程退出后仍保留在文件中，汇总结果单调递增；
+  目录应在部署启动时清空（gunicorn.conf.py 的 on_starting）
+- 直方图每次观测只更新所在桶、_sum 和 _count 三个值，累计桶在读取时计算
+- Gauge 在读取时由回调函数计算（例如共享内存缓存的占用），不写入文件
+- 未配置目录时退化为进程内的字典，只统计当前进程
+"""
+
+import bisect
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HEADER_SIZE = 8
+INITIAL_FILE_SIZE = 64 * 1024
+FILE_PATTERN = 'metrics-*.db'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class MmapValueStore:
+    """当前进程的指标文件，fork 后的子进程自动改写自己的文件"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._mm = None
+        self._positions = {}
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # 父进程的文件属于父进程，子进程在第一次写入时打开自己的文件
+        self._lock = threading.Lock()
+        self._mm = None
+        self._positions = {}
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.db')
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, INITIAL_FILE_SIZE)
+            self._mm = mmap.mmap(fd, INITIAL_FILE_SIZE)
+        finally:
+            os.close(fd)
+        struct.pack_into('<Q', self._mm, 0, HEADER_SIZE)
+
+    def _allocate(self, key):
+        encoded = json.dumps(key, ensure_ascii=False).encode('utf-8')
+        padded = (4 + len(encoded) + 7) // 8 * 8
+        used = struct.unpack_from('<Q', self._mm, 0)[0]
+        needed = used + padded + 8
+        if needed > len(self._mm):
+            size = len(self._mm)
+            while size < needed:
+                size *= 2
+            self._mm.resize(size)
+        struct.pack_into(f'<I{len(encoded)}s', self._mm, used, len(encoded), encoded)
+        position = used + padded
+        struct.pack_into('<d', self._mm, position, 0.0)
+        struct.pack_into('<Q', self._mm, 0, needed)
+        self._positions[key] = position
+        return position
+
+    def add(self, key, amount):
+        with self._lock:
+            if self._mm is None:
+                self._open()
+            position = self._positions.get(key)
+            if position is None:
+                position = self._allocate(key)
+            value = struct.unpack_from('<d', self._mm, position)[0]
+            struct.pack_into('<d', self._mm, position, value + amount)
+
+    def collect(self):
+        """读取目录下所有进程的文件，返回 {键: 各进程之和}"""
+        totals = {}
+        for path in glob.glob(os.path.join(self.directory, FILE_PATTERN)):
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            if len(data) < HEADER_SIZE:
+                continue
+            used = min(struct.unpack_from('<Q', data, 0)[0], len(data))
+            position = HEADER_SIZE
+            while position + 4 <= used:
+                length = struct.unpack_from('<I', data, position)[0]
+                key = json.loads(data[position + 4:position + 4 + length].decode('utf-8'))
+                position += (4 + length + 7) // 8 * 8
+                value = struct.unpack_from('<d', data, position)[0]
+                position += 8
+                key = (key[0], key[1], tuple(tuple(pair) for pair in key[2]))
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    def clear(self):
+        """删除目录下所有进程的指标文件（部署启动时调用）"""
+        for path in glob.glob(os.path.join(self.directory, FILE_PATTERN)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class LocalValueStore:
+    """进程内的指标存储，接口与 MmapValueStore 相同"""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        """返回绑定了标签值的子指标（按标签值缓存）"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} 需要标签 {self.labelnames}')
+            pairs = tuple(zip(self.labelnames, (str(value) for value in values)))
+            child = self._children.setdefault(values, self._make_child(pairs))
+        return child
+
+
+class _CounterChild:
+    def __init__(self, store, key):
+        self._store = store
+        self._key = key
+
+    def inc(self, amount=1):
+        self._store.add(self._key, amount)
+
+
+class Counter(_Metric):
+    """单调递增的计数，名称按惯例以 _total 结尾"""
+
+    metric_type = 'counter'
+
+    def _make_child(self, pairs):
+        return _CounterChild(self.registry.store, (self.name, '', pairs))
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _HistogramChild:
+    def __init__(self, store, name, pairs, buckets):
+        self._store = store
+        self._buckets = buckets
+        self._bucket_keys = [
+            (name, '_bucket', pairs + (('le', _format_value(bound)),)) for bound in buckets + (float('inf'),)
+        ]
+        self._sum_key = (name, '_sum', pairs)
+        self._count_key = (name, '_count', pairs)
+
+    def observe(self, value):
+        self._store.add(self._bucket_keys[bisect.bisect_left(self._buckets, value)], 1)
+        self._store.add(self._sum_key, value)
+        self._store.add(self._count_key, 1)
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _make_child(self, pairs):
+        return _HistogramChild(self.registry.store, self.name, pairs, self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Gauge(_Metric):
+    """读取时计算的指标：function 返回数值，或 {标签值元组: 数值}"""
+
+    metric_type = 'gauge'
+
+    def __init__(self, registry, name, documentation, function, labelnames=()):
+        super().__init__(registry, name, documentation, labelnames)
+        self.function = function
+
+
+class MetricsRegistry:
+    """指标注册表；directory 为空时只统计当前进程"""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.store = MmapValueStore(directory) if directory else LocalValueStore()
+        self.metrics = []
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, function, labelnames=()):
+        return self._register(Gauge(self, name, documentation, function, labelnames))
+
+    def clear(self):
+        self.store.clear()
+
+    def render(self):
+        """汇总所有进程的值，生成 Prometheus 文本格式"""
+        totals = self.store.collect()
+        samples_by_name = {}
+        for (name, suffix, pairs), value in totals.items():
+            samples_by_name.setdefault(name, []).append((suffix, pairs, value))
+
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.metric_type}')
+            if isinstance(metric, Gauge):
+                lines.extend(self._render_gauge(metric))
+            elif isinstance(metric, Histogram):
+                lines.extend(self._render_histogram(metric, samples_by_name.get(metric.name, [])))
+            else:
+                for suffix, pairs, value in sorted(samples_by_name.get(metric.name, [])):
+                    lines.append(f'{metric.name}{suffix}{_format_labels(pairs)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_gauge(metric):
+        try:
+            result = metric.function()
+        except Exception:
+            return []
+        if not isinstance(result, dict):
+            result = {(): result}
+        return [
+            f'{metric.name}{_format_labels(tuple(zip(metric.labelnames, map(str, values))))} {_format_value(value)}'
+            for values, value in sorted(result.items())
+        ]
+
+    @staticmethod
+    def _render_histogram(metric, samples):
+        # 按标签组合分组，桶的计数在这里累加为 Prometheus 要求的累计值
+        series = {}
+        for suffix, pairs, value in samples:
+            if suffix == '_bucket':
+                labels, le = pairs[:-1], pairs[-1][1]
+                series.setdefault(labels, {'buckets': {}, 'sum': 0.0, 'count': 0.0})['buckets'][le] = value
+            else:
+                series.setdefault(pairs, {'buckets': {}, 'sum': 0.0, 'count': 0.0})[suffix[1:]] = value
+
+        lines = []
+        bounds = [_format_value(bound) for bound in metric.buckets + (float('inf'),)]
+        for labels in sorted(series):
+            data = series[labels]
+            cumulative = 0.0
+            for le in bounds:
+                cumulative += data['buckets'].get(le, 0.0)
+                lines.append(f'{metric.name}_bucket{_format_labels(labels + (("le", le),))} {_format_value(cumulative)}')
+            lines.append(f'{metric.name}_sum{_format_labels(labels)} {_format_value(data["sum"])}')
+            lines.append(f'{metric.name}_count{_format_labels(labels)} {_format_value(data["count"])}')
+        return lines
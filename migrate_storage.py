@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+项目存储分片迁移工具
+把 static/<project_id>/ 下的旧项目迁移到 static/shards/<xx>/<yy>/<project_id>/
+
+迁移可以在服务运行时进行，无需停机：
+- 每个项目通过一次 os.rename 整体移动，同一文件系统内是原子操作
+- get_project_dir() 先查分片目录、再查旧目录、最后再查一次分片目录，
+  rename 前后的请求都能找到项目，公开的 /static/<project_id>/index.html 地址不变
+- 已迁移的项目会被跳过，中断后重新运行即可继续
+
+用法:
+    python migrate_storage.py [--dry-run] [--limit N] [--batch-size N] [--pause SECONDS]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from main import app, logger, get_shard_path, is_valid_project_id
+
+
+def find_legacy_projects():
+    """列出仍位于 static/ 根目录下的旧项目ID"""
+    static_dir = app.config['UPLOAD_FOLDER']
+    if not os.path.isdir(static_dir):
+        return []
+    with os.scandir(static_dir) as entries:
+        return sorted(
+            entry.name for entry in entries
+            if entry.is_dir() and is_valid_project_id(entry.name)
+        )
+
+
+def migrate_legacy_projects(limit=None, batch_size=100, pause=0.0, dry_run=False):
+    """
+    把旧项目逐个移动到分片目录
+    每迁移 batch_size 个项目暂停 pause 秒，降低对线上磁盘 I/O 的影响
+    返回 {'migrated': 成功数, 'skipped': 跳过数, 'failed': 失败数}
+    """
+    result = {'migrated': 0, 'skipped': 0, 'failed': 0}
+    static_dir = app.config['UPLOAD_FOLDER']
+
+    for project_id in find_legacy_projects()[:limit]:
+        legacy_path = os.path.join(static_dir, project_id)
+        target_path = get_shard_path(project_id)
+
+        if os.path.exists(target_path):
+            logger.warning(f"分片目录已存在，跳过: {project_id}")
+            result['skipped'] += 1
+            continue
+
+        if dry_run:
+            print(f"[dry-run] {legacy_path} -> {target_path}")
+            result['migrated'] += 1
+            continue
+
+        try:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.rename(legacy_path, target_path)
+            result['migrated'] += 1
+        except OSError as e:
+            logger.error(f"迁移项目失败: 项目ID={project_id}, 错误={e}")
+            result['failed'] += 1
+            continue
+
+        if pause > 0 and result['migrated'] % batch_size == 0:
+            time.sleep(pause)
+
+    logger.info(
+        f"存储迁移完成: 迁移 {result['migrated']} 个, 跳过 {result['skipped']} 个, 失败 {result['failed']} 个"
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='把旧项目迁移到分片目录布局')
+    parser.add_argument('--static-dir', default=app.config['UPLOAD_FOLDER'], help='项目存储目录')
+    parser.add_argument('--dry-run', action='store_true', help='只打印计划，不实际移动')
+    parser.add_argument('--limit', type=int, default=None, help='本次最多迁移的项目数')
+    parser.add_argument('--batch-size', type=int, default=100, help='每批迁移的项目数')
+    parser.add_argument('--pause', type=float, default=0.5, help='批次之间暂停的秒数')
+    args = parser.parse_args()
+
+    app.config['UPLOAD_FOLDER'] = args.static_dir
+    pending = len(find_legacy_projects())
+    print(f"待迁移项目: {pending} 个")
+
+    result = migrate_legacy_projects(
+        limit=args.limit,
+        batch_size=args.batch_size,
+        pause=args.pause,
+        dry_run=args.dry_run
+    )
+    print(f"迁移: {result['migrated']}  跳过: {result['skipped']}  失败: {result['failed']}")
+    return 0 if result['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
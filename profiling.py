@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按需的请求采样分析
+分析某个请求时，后台线程每隔固定间隔读取处理该请求的线程的调用栈（sys._current_frames），
+按相同调用栈计数，得到统计意义上的耗时分布；处理线程本身不插桩，开销只来自采样线程
+
+- 结果保存为 collapsed stacks 格式（每行 "根;...;叶 次数"），可直接用于 flamegraph.pl、speedscope 等工具
+- render_flamegraph 生成自包含的 SVG 火焰图（根在底部，宽度与采样次数成正比）
+"""
+
+import html
+import os
+import sys
+import threading
+import zlib
+from collections import Counter
+
+FLAMEGRAPH_WIDTH = 1200
+FLAMEGRAPH_FRAME_HEIGHT = 16
+FLAMEGRAPH_MIN_TEXT_WIDTH = 40
+
+
+def format_frame(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """对一个线程定时采样调用栈"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(format_frame(frame))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        """停止采样，返回 {调用栈: 次数}"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.stacks
+
+
+def format_collapsed(stacks):
+    """生成 collapsed stacks 文本"""
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+
+
+def parse_collapsed(text):
+    stacks = Counter()
+    for line in text.splitlines():
+        stack, _, count = line.rpartition(' ')
+        if stack and count.isdigit():
+            stacks[stack] += int(count)
+    return stacks
+
+
+def _frame_color(name):
+    # 同名函数颜色固定，便于在多个火焰图之间对照
+    value = zlib.crc32(name.encode('utf-8'))
+    return f'rgb({205 + value % 50},{(value >> 8) % 180 + 50},{(value >> 16) % 55})'
+
+
+def render_flamegraph(stacks, title='火焰图'):
+    """把 {调用栈: 次数} 渲染为 SVG 火焰图"""
+    root = {'children': {}, 'value': 0}
+    for stack, count in stacks.items():
+        node = root
+        node['value'] += count
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'children': {}, 'value': 0})
+            node['value'] += count
+
+    total = root['value'] or 1
+    rects = []
+
+    def depth_of(node):
+        return 1 + max((depth_of(child) for child in node['children'].values()), default=0)
+
+    depth = depth_of(root) - 1
+    height = (depth + 2) * FLAMEGRAPH_FRAME_HEIGHT + 30
+
+    def layout(node, x, level):
+        for name, child in sorted(node['children'].items()):
+            width = child['value'] / total * FLAMEGRAPH_WIDTH
+            y = height - (level + 1) * FLAMEGRAPH_FRAME_HEIGHT - 10
+            label = html.escape(name)
+            rect = (f'<g><title>{label} ({child["value"]} 次, {child["value"] / total * 100:.1f}%)</title>'
+                    f'<rect x="{x:.2f}" y="{y}" width="{max(width - 0.5, 0.1):.2f}" '
+                    f'height="{FLAMEGRAPH_FRAME_HEIGHT - 1}" fill="{_frame_color(name)}"/>')
+            if width >= FLAMEGRAPH_MIN_TEXT_WIDTH:
+                characters = int(width / 7)
+                text = name if len(name) <= characters else name[:max(characters - 2, 1)] + '..'
+                rect += f'<text x="{x + 3:.2f}" y="{y + FLAMEGRAPH_FRAME_HEIGHT - 4}">{html.escape(text)}</text>'
+            rects.append(rect + '</g>')
+            layout(child, x, level + 1)
+            x += width
+
+    layout(root, 0.0, 0)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAMEGRAPH_WIDTH}" height="{height}" '
+        f'font-family="monospace" font-size="11">'
+        f'<text x="{FLAMEGRAPH_WIDTH / 2}" y="16" text-anchor="middle" font-size="14">'
+        f'{html.escape(title)}（{root["value"]} 次采样）</text>'
+        + ''.join(rects) + '</svg>\n'
+    )
@@ -10,6 +10,20 @@ import unittest
 
 # 导入所有单元测试模块
 from test_cdn_cache import TestCDNCacheFunctionality, TestCDNCacheHelpers
+from test_access_tracking import TestProjectAccessTracking
+from test_metadata_extract import TestHTMLMetadataExtraction, TestMetadataBackfill
+from test_storage_layout import TestShardedStorage
+from test_upload_pipeline import TestUploadPipeline
+from test_bulk_upload import TestBulkUpload
+from test_content_dedup import TestContentDeduplication
+from test_compressed_storage import TestCompressedStorage
+from test_static_offload import TestStaticOffload
+from test_thumbnails import TestThumbnailNormalization
+from test_shared_cache import TestSharedMemoryCache
+from test_background_services import TestBackgroundServices
+from test_app_logging import TestQueueLogging
+from test_metrics import TestMetricsRegistry, TestMetricsEndpoint, TestServerTiming
+from test_profiling import TestRequestProfiling
 
 if __name__ == '__main__':
     print("=" * 70)
@@ -26,6 +40,65 @@ if __name__ == '__main__':
     suite.addTests(loader.loadTestsFromTestCase(TestCDNCacheFunctionality))
     suite.addTests(loader.loadTestsFromTestCase(TestCDNCacheHelpers))
 
+    # 添加访问记录测试
+    print("添加访问记录测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestProjectAccessTracking))
+
+    # 添加元数据提取测试
+    print("添加元数据提取测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestHTMLMetadataExtraction))
+    suite.addTests(loader.loadTestsFromTestCase(TestMetadataBackfill))
+
+    # 添加存储布局测试
+    print("添加存储布局测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestShardedStorage))
+
+    # 添加上传后处理流水线测试
+    print("添加上传后处理流水线测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestUploadPipeline))
+
+    # 添加批量上传测试
+    print("添加批量上传测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestBulkUpload))
+
+    # 添加内容去重测试
+    print("添加内容去重测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestContentDeduplication))
+
+    # 添加压缩存储测试
+    print("添加压缩存储测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestCompressedStorage))
+
+    # 添加静态文件发送卸载测试
+    print("添加静态文件发送卸载测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestStaticOffload))
+
+    # 添加缩略图测试
+    print("添加缩略图测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestThumbnailNormalization))
+
+    # 添加跨进程共享缓存测试
+    print("添加跨进程共享缓存测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestSharedMemoryCache))
+
+    # 添加后台服务测试
+    print("添加后台服务测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestBackgroundServices))
+
+    # 添加日志队列测试
+    print("添加日志队列测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestQueueLogging))
+
+    # 添加指标测试
+    print("添加指标测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestMetricsRegistry))
+    suite.addTests(loader.loadTestsFromTestCase(TestMetricsEndpoint))
+    suite.addTests(loader.loadTestsFromTestCase(TestServerTiming))
+
+    # 添加请求分析测试
+    print("添加请求分析测试...")
+    suite.addTests(loader.loadTestsFromTestCase(TestRequestProfiling))
+
     print(f"总共 {suite.countTestCases()} 个测试用例\n")
 
     # 运行测试
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨进程共享的内存缓存
+多个 worker 进程映射同一个文件（Linux 上默认位于 /dev/shm，即共享内存），
+缓存内容只保存一份，任何一个进程写入或失效后其它进程立即可见
+
+文件布局:
+- 头部（4KB）: 魔数、布局版本、槽位数、数据区大小、累计写入偏移、最大条目数、条目计数、若干共享计数器
+- 槽位表: 开放寻址的哈希表，每个槽位记录键摘要、数据位置、长度和写入时间
+- 数据区: 环形缓冲区，新数据追加写入，写满后从头覆盖最旧的数据
+
+槽位记录的是逻辑偏移（累计写入字节数），逻辑偏移落后当前写入位置超过一个数据区大小
+的条目说明已被覆盖，读取时视为不存在，因此淘汰不需要额外的链表维护。
+条目数上限（max_items）与进程内缓存含义相同：头部的条目计数只在写入新条目时增加，
+被环形缓冲区覆盖的条目不会及时扣减，计数超过上限时扫描槽位表重新计数，并淘汰最旧的条目。
+
+读取返回的是数据区的一份拷贝（bytes），而不是指向共享内存的 memoryview：
+锁释放后其它进程随时可能覆盖这段环形缓冲区，调用方（响应发送）持有的视图会读到别的条目的数据。
+
+进程间用 fcntl.flock 加锁（读共享、写独占），进程内再用线程锁串行化；
+fork 出的子进程会重新打开锁文件，避免与父进程共用同一个文件描述（共用时 flock 互不排斥）。
+没有 fcntl 的平台（Windows）或共享文件无法创建时，退化为进程内的 LRU 缓存，接口相同。
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只能使用进程内缓存
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PVSHMC01'
+LAYOUT_VERSION = 2
+HEADER_SIZE = 4096
+HEADER_FORMAT = '<8sIIQQIQ'  # 魔数, 布局版本, 槽位数, 数据区大小, 累计写入偏移, 最大条目数, 条目计数
+WRITE_OFFSET_POSITION = struct.calcsize('<8sIIQ')
+ITEM_COUNT_POSITION = struct.calcsize('<8sIIQQI')
+COUNTER_COUNT = 8
+COUNTERS_POSITION = 64
+SLOT_FORMAT = '<16sQIH2xd'  # 键摘要, 逻辑偏移, 数据长度, 元数据长度, 写入时间
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT)
+EMPTY_DIGEST = bytes(16)
+MAX_PROBES = 8  # 开放寻址的最大探测次数，探测范围内都被占用时淘汰其中最旧的条目
+MAX_ENTRY_FRACTION = 4  # 单个条目最多占数据区的 1/4，避免一个大文件冲掉整个缓存
+REFRESH_FRACTION = 0.75  # 命中的条目已落到环形缓冲区最旧的 1/4 时重新追加，近似 LRU
+
+
+def _digest(key):
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+
+class SharedMemoryCache:
+    """基于 mmap 文件的跨进程缓存"""
+
+    shared = True
+
+    def __init__(self, path, data_size, slot_count, max_items):
+        self.path = path
+        self._lock_path = f"{path}.lock"
+        self._pid = None
+        self._lock_fd = None
+        self._thread_lock = threading.Lock()
+        self._ensure_process()
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                header = os.pread(fd, struct.calcsize(HEADER_FORMAT), 0)
+                existing = struct.unpack(HEADER_FORMAT, header) if len(header) == struct.calcsize(HEADER_FORMAT) else None
+                if existing and existing[0] == MAGIC and existing[1] == LAYOUT_VERSION:
+                    # 其它进程已初始化，沿用文件中的布局，保证所有进程看到同一张表
+                    _, _, slot_count, data_size, _, max_items, _ = existing
+                    total_size = HEADER_SIZE + slot_count * SLOT_SIZE + data_size
+                    if os.fstat(fd).st_size < total_size:
+                        os.ftruncate(fd, total_size)
+                else:
+                    total_size = HEADER_SIZE + slot_count * SLOT_SIZE + data_size
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, total_size)
+                    os.pwrite(fd, struct.pack(HEADER_FORMAT, MAGIC, LAYOUT_VERSION, slot_count, data_size, 0,
+                                              max_items, 0), 0)
+                self._mm = mmap.mmap(fd, total_size)
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+        self.slot_count = slot_count
+        self.data_size = data_size
+        self.max_items = max_items
+        self._slots_start = HEADER_SIZE
+        self._data_start = HEADER_SIZE + slot_count * SLOT_SIZE
+
+    def _ensure_process(self):
+        """fork 后的子进程重新打开锁文件并重建线程锁"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self._thread_lock = threading.Lock()
+        self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._pid = pid
+
+    @contextmanager
+    def _locked(self, exclusive):
+        self._ensure_process()
+        with self._thread_lock:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _write_offset(self):
+        return struct.unpack_from('<Q', self._mm, WRITE_OFFSET_POSITION)[0]
+
+    def _item_count(self):
+        return struct.unpack_from('<Q', self._mm, ITEM_COUNT_POSITION)[0]
+
+    def _set_item_count(self, count):
+        struct.pack_into('<Q', self._mm, ITEM_COUNT_POSITION, count)
+
+    def _enforce_max_items(self, write_offset):
+        """重新统计存活的条目数，超过 max_items 时按写入先后淘汰最旧的条目（调用方须持有写锁）"""
+        live = sorted(
+            (slot[1], index)
+            for index, slot in enumerate(struct.iter_unpack(SLOT_FORMAT, self._mm[self._slots_start:self._data_start]))
+            if self._is_live(slot, write_offset)
+        )
+        excess = max(len(live) - self.max_items, 0)
+        for _, index in live[:excess]:
+            self._write_slot(index, EMPTY_DIGEST)
+        self._set_item_count(len(live) - excess)
+
+    def _read_slot(self, index):
+        return struct.unpack_from(SLOT_FORMAT, self._mm, self._slots_start + index * SLOT_SIZE)
+
+    def _write_slot(self, index, digest, offset=0, length=0, meta_length=0, stored_at=0.0):
+        struct.pack_into(SLOT_FORMAT, self._mm, self._slots_start + index * SLOT_SIZE,
+                         digest, offset, length, meta_length, stored_at)
+
+    def _is_live(self, slot, write_offset):
+        """条目的数据还没有被环形缓冲区覆盖"""
+        return slot[0] != EMPTY_DIGEST and slot[1] >= write_offset - self.data_size
+
+    def _probe(self, digest):
+        start = int.from_bytes(digest[:8], 'little') % self.slot_count
+        for i in range(min(MAX_PROBES, self.slot_count)):
+            yield (start + i) % self.slot_count
+
+    def _find(self, digest, write_offset):
+        for index in self._probe(digest):
+            slot = self._read_slot(index)
+            if slot[0] == digest:
+                return (index, slot) if self._is_live(slot, write_offset) else None
+        return None
+
+    def get(self, key):
+        """返回 (值, 元数据, 写入时间)，值和元数据是数据区的拷贝；不存在时返回 None"""
+        digest = _digest(key)
+        with self._locked(exclusive=False):
+            write_offset = self._write_offset()
+            found = self._find(digest, write_offset)
+            if found is None:
+                return None
+            _, (_, offset, length, meta_length, stored_at) = found
+            position = self._data_start + offset % self.data_size
+            meta = self._mm[position:position + meta_length]
+            value = self._mm[position + meta_length:position + length]
+            stale = offset < write_offset - self.data_size * REFRESH_FRACTION
+
+        if stale:
+            self.set(key, value, meta, stored_at)
+        return value, meta, stored_at
+
+    def set(self, key, value, meta=b'', stored_at=None):
+        """写入条目，条目过大时不缓存并返回 False"""
+        length = len(meta) + len(value)
+        if length > self.data_size // MAX_ENTRY_FRACTION:
+            return False
+        digest = _digest(key)
+        stored_at = time.time() if stored_at is None else stored_at
+
+        with self._locked(exclusive=True):
+            write_offset = self._write_offset()
+            position = write_offset % self.data_size
+            if position + length > self.data_size:
+                # 条目不跨越缓冲区末尾，剩余空间直接跳过
+                write_offset += self.data_size - position
+                position = 0
+            start = self._data_start + position
+            self._mm[start:start + len(meta)] = meta
+            self._mm[start + len(meta):start + length] = value
+            new_write_offset = write_offset + length
+            struct.pack_into('<Q', self._mm, WRITE_OFFSET_POSITION, new_write_offset)
+
+            # 选择槽位：同一个键 > 空槽或已失效的槽 > 探测范围内最旧的槽
+            target = None
+            oldest = None
+            for index in self._probe(digest):
+                slot = self._read_slot(index)
+                if slot[0] == digest:
+                    target = index
+                    break
+                if target is None and not self._is_live(slot, new_write_offset):
+                    target = index
+                if oldest is None or slot[1] < oldest[1]:
+                    oldest = (index, slot[1])
+            if target is None:
+                target = oldest[0]
+            replaced = self._is_live(self._read_slot(target), new_write_offset)
+            self._write_slot(target, digest, write_offset, length, len(meta), stored_at)
+            if not replaced:
+                count = self._item_count() + 1
+                self._set_item_count(count)
+                if count > self.max_items:
+                    self._enforce_max_items(new_write_offset)
+        return True
+
+    def delete(self, key):
+        digest = _digest(key)
+        with self._locked(exclusive=True):
+            found = self._find(digest, self._write_offset())
+            if found is not None:
+                self._write_slot(found[0], EMPTY_DIGEST)
+                self._set_item_count(max(self._item_count() - 1, 0))
+
+    def clear(self):
+        """清空所有条目（共享计数器保持不变），所有进程立即可见"""
+        with self._locked(exclusive=True):
+            self._mm[self._slots_start:self._data_start] = bytes(self._data_start - self._slots_start)
+            self._set_item_count(0)
+
+    def __contains__(self, key):
+        digest = _digest(key)
+        with self._locked(exclusive=False):
+            return self._find(digest, self._write_offset()) is not None
+
+    def __len__(self):
+        return self.stats()['items']
+
+    def stats(self):
+        with self._locked(exclusive=False):
+            write_offset = self._write_offset()
+            live = [slot for slot in (self._read_slot(i) for i in range(self.slot_count))
+                    if self._is_live(slot, write_offset)]
+        return {
+            'shared': True,
+            'items': len(live),
+            'bytes': sum(slot[2] for slot in live),
+            'max_items': self.max_items,
+            'capacity_bytes': self.data_size,
+        }
+
+    def counter(self, index):
+        """读取共享计数器，例如各进程本地缓存的失效代数"""
+        with self._locked(exclusive=False):
+            return struct.unpack_from('<Q', self._mm, COUNTERS_POSITION + index * 8)[0]
+
+    def incr(self, index):
+        """共享计数器加一并返回新值"""
+        with self._locked(exclusive=True):
+            value = struct.unpack_from('<Q', self._mm, COUNTERS_POSITION + index * 8)[0] + 1
+            struct.pack_into('<Q', self._mm, COUNTERS_POSITION + index * 8, value)
+        return value
+
+
+class LocalMemoryCache:
+    """进程内的 LRU 缓存，接口与 SharedMemoryCache 相同"""
+
+    shared = False
+
+    def __init__(self, max_items, data_size):
+        self.max_items = max_items
+        self.data_size = data_size
+        self._entries = OrderedDict()
+        self._counters = [0] * COUNTER_COUNT
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, meta=b'', stored_at=None):
+        if len(meta) + len(value) > self.data_size // MAX_ENTRY_FRACTION:
+            return False
+        with self._lock:
+            self._entries[key] = (value, meta, time.time() if stored_at is None else stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            size = sum(len(value) + len(meta) for value, meta, _ in self._entries.values())
+            items = len(self._entries)
+        return {
+            'shared': False,
+            'items': items,
+            'bytes': size,
+            'max_items': self.max_items,
+            'capacity_bytes': self.data_size,
+        }
+
+    def counter(self, index):
+        return self._counters[index]
+
+    def incr(self, index):
+        with self._lock:
+            self._counters[index] += 1
+            return self._counters[index]
+
+
+def open_cache(path, data_size, max_items):
+    """
+    打开共享缓存；path 为空、平台不支持或文件无法创建时返回进程内缓存
+    槽位数取不小于 2 * max_items 的 2 的幂，保持较低的装载率
+    """
+    if path and fcntl is not None:
+        slot_count = 64
+        while slot_count < max_items * 2:
+            slot_count *= 2
+        try:
+            return SharedMemoryCache(path, data_size, slot_count, max_items)
+        except OSError as e:
+            logger.warning(f"无法打开共享缓存 {path}，改用进程内缓存: {e}")
+    return LocalMemoryCache(max_items, data_size)
+
+
+def remove_cache(path):
+    """删除共享缓存文件及其锁文件（只应在使用它的进程都退出后调用），返回是否删除了缓存文件"""
+    removed = False
+    for file_path in (path, f"{path}.lock"):
+        try:
+            os.remove(file_path)
+            removed = removed or file_path == path
+        except FileNotFoundError:
+            pass
+    return removed
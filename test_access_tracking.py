@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+项目访问记录测试套件
+测试访问时间的内存记录、批量落盘以及基于最后访问时间的过期清理
+"""
+
+import os
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from main import project_access_log
+from test_support import TempStorageTestCase
+
+
+def create_project(static_dir, project_id, age_days=0):
+    """在指定目录下创建一个测试项目，并把 index.html 的修改时间调到 age_days 天前"""
+    project_dir = os.path.join(static_dir, project_id)
+    os.makedirs(project_dir, exist_ok=True)
+    index_file = os.path.join(project_dir, 'index.html')
+    with open(index_file, 'w', encoding='utf-8') as f:
+        f.write('<html><head><title>测试</title></head><body></body></html>')
+    if age_days:
+        old_time = time.time() - age_days * 24 * 3600
+        os.utime(index_file, (old_time, old_time))
+    return project_dir
+
+
+class TestProjectAccessTracking(TempStorageTestCase):
+    """测试访问记录与过期清理"""
+
+    def test_serve_static_records_access_in_memory(self):
+        """测试访问预览页只写内存，不直接写索引"""
+        create_project(self.static_dir, 'proj0001')
+
+        response = self.client.get('/static/proj0001/index.html')
+        response.close()
+        self.client.get('/static/proj0001/index.html').close()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('proj0001', project_access_log)
+        self.assertEqual(project_access_log['proj0001'][1], 2)
+        self.assertEqual(main.get_project_index().execute('SELECT id FROM projects').fetchall(), [])
+
+    def test_flush_writes_batch_to_index(self):
+        """测试访问记录批量写入索引并累加访问次数"""
+        main.record_project_access('proj0001')
+        main.record_project_access('proj0002')
+        self.assertEqual(main.flush_project_access_log(), 2)
+        self.assertEqual(len(project_access_log), 0)
+
+        main.record_project_access('proj0001')
+        main.flush_project_access_log()
+
+        conn = main.get_project_index()
+        counts = dict(conn.execute('SELECT id, access_count FROM projects'))
+        self.assertEqual(counts, {'proj0001': 2, 'proj0002': 1})
+
+    def test_cleanup_uses_last_access(self):
+        """测试清理以最后访问时间为准，而不是文件修改时间"""
+        expired_days = main.PROJECT_EXPIRY_DAYS + 5
+        create_project(self.static_dir, 'popular1', age_days=expired_days)
+        create_project(self.static_dir, 'deadproj', age_days=expired_days)
+
+        # 旧项目最近仍有人访问
+        self.client.get('/static/popular1/index.html').close()
+
+        main.cleanup_expired_projects()
+
+        self.assertTrue(os.path.exists(os.path.join(self.static_dir, 'popular1')))
+        self.assertFalse(os.path.exists(os.path.join(self.static_dir, 'deadproj')))
+        remaining = [row[0] for row in main.get_project_index().execute('SELECT id FROM projects')]
+        self.assertNotIn('deadproj', remaining)
+
+    def test_cleanup_respects_deletion_budget(self):
+        """测试单次清理受删除数量预算限制，剩余的留给下一次"""
+        expired_days = main.PROJECT_EXPIRY_DAYS + 5
+        for i in range(5):
+            create_project(self.static_dir, f'expired{i}', age_days=expired_days + i)
+
+        with patch.object(main, 'CLEANUP_MAX_DELETIONS_PER_RUN', 2):
+            result = main.cleanup_expired_projects()
+            self.assertEqual(result['deleted'], 2)
+            self.assertTrue(result['budget_exhausted'])
+
+            # 最久未访问的项目最先被删除
+            self.assertFalse(os.path.exists(os.path.join(self.static_dir, 'expired4')))
+            self.assertFalse(os.path.exists(os.path.join(self.static_dir, 'expired3')))
+            self.assertTrue(os.path.exists(os.path.join(self.static_dir, 'expired0')))
+
+            main.cleanup_expired_projects()
+            main.cleanup_expired_projects()
+
+        self.assertEqual(os.listdir(self.static_dir), [])
+
+    def test_manual_cleanup_runs_as_background_job(self):
+        """测试手动清理以后台任务执行，并可查询任务状态"""
+        create_project(self.static_dir, 'expired0', age_days=main.PROJECT_EXPIRY_DAYS + 1)
+        csrf_token = self.client.get('/api/csrf-token').json['csrf_token']
+
+        response = self.client.post('/api/cleanup/run', headers={'X-CSRFToken': csrf_token})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json['job_id']
+
+        # 等待后台任务完成
+        main.cleanup_executor.submit(lambda: None).result(timeout=10)
+
+        response = self.client.get(f'/api/cleanup/jobs/{job_id}')
+        self.assertEqual(response.status_code, 200)
+        job = response.json['job']
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['progress']['deleted'], 1)
+
+        self.assertEqual(self.client.get('/api/cleanup/jobs/unknown').status_code, 404)
+
+    def test_cleanup_jobs_shared_through_index(self):
+        """测试清理任务记录保存在项目索引中，其它进程提交的任务同样可以查询，已退出进程留下的未完成任务不阻塞新任务"""
+        # 模拟另一个 worker 提交的任务：只存在于项目索引中
+        other_job = {'id': 'otherjob0001', 'status': 'running', 'pid': os.getpid(), 'created_at': None,
+                     'started_at': None, 'finished_at': None, 'progress': {'deleted': 0}}
+        main.save_background_job('cleanup', other_job['id'], other_job)
+        response = self.client.get('/api/cleanup/jobs/otherjob0001')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['job']['status'], 'running')
+        self.assertEqual(self.client.get('/api/cleanup/status').json['recent_jobs'][-1]['id'], 'otherjob0001')
+
+        # 运行中的任务不会被重复提交
+        self.assertEqual(main.submit_cleanup_job()['id'], 'otherjob0001')
+
+        # 提交任务的进程已退出时，重新提交新任务
+        with patch.object(main, 'is_process_alive', return_value=False):
+            job = main.submit_cleanup_job()
+        self.assertNotEqual(job['id'], 'otherjob0001')
+        main.cleanup_executor.submit(lambda: None).result(timeout=10)
+        self.assertEqual(main.get_background_job('cleanup', job['id'])['status'], 'completed')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+非阻塞日志测试套件
+测试日志经过队列由后台线程输出、JSON 格式、队列写满时丢弃计数、热点日志采样，以及 fork 后重建写入线程
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+import multiprocessing
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app_logging
+from app_logging import QueueLogging, JsonFormatter
+
+
+class BlockingHandler(logging.Handler):
+    """在放行之前阻塞的处理器，模拟缓慢的磁盘"""
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+        self.unblocked = threading.Event()
+
+    def emit(self, record):
+        self.unblocked.wait(timeout=10)
+        self.stream.write(self.format(record) + '\n')
+
+
+def log_in_child(logger, queue_logging):
+    """在子进程中记录一条日志并等待写出"""
+    logger.info('来自子进程')
+    queue_logging.stop()
+
+
+class TestQueueLogging(unittest.TestCase):
+    """测试经过队列的日志输出"""
+
+    def setUp(self):
+        """测试前设置：使用独立的日志记录器，不影响根记录器"""
+        self.logger = logging.getLogger(f'test_app_logging.{self._testMethodName}')
+        self.logger.propagate = False
+        self.stream = io.StringIO()
+        self.queue_logging = QueueLogging()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """测试后清理"""
+        self.queue_logging.stop()
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+        shutil.rmtree(self.temp_dir)
+
+    def install(self, handler, **kwargs):
+        handler.setFormatter(JsonFormatter())
+        self.queue_logging.install([handler], logger=self.logger, **kwargs)
+
+    def read_entries(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_json_output(self):
+        """测试日志由写入线程输出为 JSON，包含事件名、采样率和异常堆栈"""
+        self.install(logging.StreamHandler(self.stream))
+        self.logger.info('命中 %s', 'a.js', extra=self.queue_logging.extra('cdn_memory_hit'))
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            self.logger.exception('出错了')
+        self.queue_logging.stop()
+
+        hit, error = self.read_entries()
+        self.assertEqual(hit['message'], '命中 a.js')
+        self.assertEqual((hit['event'], hit['sample_rate'], hit['level']), ('cdn_memory_hit', 1, 'INFO'))
+        self.assertEqual(hit['pid'], os.getpid())
+        self.assertEqual(error['level'], 'ERROR')
+        self.assertIn('ValueError: boom', error['exception'])
+
+    def test_event_fields(self):
+        """测试 main.log_event 的附加字段作为独立的 JSON 字段输出（回放工具依赖这些字段）"""
+        import main
+
+        handler = logging.StreamHandler(self.stream)
+        handler.setFormatter(JsonFormatter())
+        main.logger.addHandler(handler)
+        self.addCleanup(main.logger.removeHandler, handler)
+        self.addCleanup(main.logger.setLevel, main.logger.level)
+        main.logger.setLevel(logging.INFO)
+        main.log_event('cdn_miss', '未命中', url='https://cdn.jsdelivr.net/a.js', bytes=10, content_type='text/css')
+
+        entry, = self.read_entries()
+        self.assertEqual(entry['event'], 'cdn_miss')
+        self.assertEqual((entry['url'], entry['bytes'], entry['content_type']),
+                         ('https://cdn.jsdelivr.net/a.js', 10, 'text/css'))
+
+    def test_full_queue_drops_without_blocking(self):
+        """测试写入线程卡住、队列写满时调用方不阻塞，丢弃数被计数并在之后补记"""
+        handler = BlockingHandler(self.stream)
+        self.addCleanup(handler.unblocked.set)
+        self.install(handler, queue_size=5)
+
+        started = time.monotonic()
+        for i in range(50):
+            self.logger.info(f'消息 {i}')
+        self.assertLess(time.monotonic() - started, 1)
+
+        stats = self.queue_logging.stats()
+        self.assertGreater(stats['dropped'], 0)
+        self.assertLessEqual(stats['queued'], 5)
+
+        handler.unblocked.set()
+        self.queue_logging.stop()
+        entries = self.read_entries()
+        reported = [entry for entry in entries if 'dropped' in entry]
+        self.assertEqual(sum(entry['dropped'] for entry in reported), stats['dropped'])
+        self.assertEqual(len(entries) - len(reported) + stats['dropped'], 50)
+
+    def test_sampling(self):
+        """测试按事件采样：每 N 次只记录 1 次，未配置的事件总是记录"""
+        self.install(logging.StreamHandler(self.stream), sample_rates=app_logging.parse_sample_rates('hot=10, bad=x'))
+        kept = sum(self.queue_logging.should_log('hot') for _ in range(100))
+        self.assertEqual(kept, 10)
+        self.assertTrue(all(self.queue_logging.should_log('cold') for _ in range(5)))
+        stats = self.queue_logging.stats()
+        self.assertEqual(stats['sample_rates'], {'hot': 10})
+        self.assertEqual(stats['sampled_out'], {'hot': 90})
+        self.assertEqual(self.queue_logging.extra('hot'), {'event': 'hot', 'sample_rate': 10})
+
+    def test_writer_restarted_after_fork(self):
+        """测试 fork 出的子进程启动自己的写入线程，日志不会滞留在队列中"""
+        log_path = os.path.join(self.temp_dir, 'app.log')
+        self.install(logging.FileHandler(log_path))
+
+        process = multiprocessing.get_context('fork').Process(target=log_in_child,
+                                                              args=(self.logger, self.queue_logging))
+        process.start()
+        process.join(timeout=10)
+        self.assertEqual(process.exitcode, 0)
+
+        self.logger.info('来自父进程')
+        self.queue_logging.stop()
+        with open(log_path, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual({entry['message'] for entry in entries}, {'来自子进程', '来自父进程'})
+        self.assertEqual({entry['pid'] for entry in entries}, {process.pid, os.getpid()})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台服务测试套件
+测试多进程部署时调度锁的归属：同一时间只有一个进程运行定时清理等任务，
+leader 退出后其它进程自动接手，定时任务运行记录的保存和查询，
+以及导入 main 时不产生启动线程、创建日志文件等副作用
+"""
+
+import os
+import sys
+import time
+import subprocess
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+from unittest.mock import patch
+from apscheduler.schedulers.background import BackgroundScheduler
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from main import app
+
+
+def try_lock_in_child(results):
+    """在子进程中尝试获取调度锁"""
+    main.scheduler_lock_fd = None
+    results.put(main.acquire_scheduler_lock())
+
+
+def hold_lock_in_child(acquired, release):
+    """在子进程中持有调度锁，直到父进程通知释放"""
+    main.scheduler_lock_fd = None
+    acquired.put(main.acquire_scheduler_lock())
+    release.wait(timeout=10)
+
+
+@unittest.skipUnless(main.fcntl, '当前平台不支持文件锁')
+class TestBackgroundServices(unittest.TestCase):
+    """测试后台服务的启动与调度锁"""
+
+    def setUp(self):
+        """测试前设置：使用临时目录存放项目索引和调度锁"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.original_index_path = app.config['PROJECT_INDEX_PATH']
+        app.config['PROJECT_INDEX_PATH'] = os.path.join(self.temp_dir, 'project_index.db')
+        self.fork = multiprocessing.get_context('fork')
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """测试后清理"""
+        app.config['PROJECT_INDEX_PATH'] = self.original_index_path
+        shutil.rmtree(self.temp_dir)
+
+    def release_lock(self):
+        main.unlock_file(main.scheduler_lock_fd)
+        main.scheduler_lock_fd = None
+
+    def lock_in_child(self):
+        results = self.fork.Queue()
+        process = self.fork.Process(target=try_lock_in_child, args=(results,))
+        process.start()
+        acquired = results.get(timeout=10)
+        process.join(timeout=10)
+        return acquired
+
+    def test_scheduler_lock_is_exclusive(self):
+        """测试调度锁同一时间只属于一个进程，持有者退出后其它进程可以接手"""
+        # 子进程先拿到锁，退出后锁自动释放
+        self.assertTrue(self.lock_in_child())
+
+        with patch.object(main, 'scheduler_lock_fd', None):
+            self.assertTrue(main.acquire_scheduler_lock())
+            lock_fd = main.scheduler_lock_fd
+            try:
+                # 本进程持有锁期间，其它进程拿不到
+                self.assertFalse(self.lock_in_child())
+                self.assertTrue(main.acquire_scheduler_lock())
+            finally:
+                os.close(lock_fd)
+
+        self.assertTrue(self.lock_in_child())
+
+    def test_import_has_no_side_effects(self):
+        """测试导入 main 不启动线程、不创建日志文件和共享缓存文件，也不加载按需导入的模块"""
+        probe = (
+            "import sys, threading, time\n"
+            "import main\n"
+            "time.sleep(0.1)\n"
+            "lazy = sorted(name for name in main.LAZY_MODULES.values() if name in sys.modules)\n"
+            "print(threading.active_count(), main.scheduler, 'apscheduler' in sys.modules, lazy)\n"
+        )
+        cache_path = os.path.join(self.temp_dir, 'shared-cache')
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)), SHARED_CACHE_PATH=cache_path)
+        result = subprocess.run([sys.executable, '-c', probe], cwd=self.temp_dir, env=env,
+                                capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.split(), ['1', 'None', 'False', '[]'])
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'app.log')))
+        self.assertFalse(os.path.exists(cache_path))
+        self.assertFalse(os.path.exists(cache_path + '.lock'))
+
+    def test_lazy_module_attribute(self):
+        """测试按需导入的模块仍可以通过 main.<名称> 访问"""
+        import requests
+        self.assertIs(main.requests, requests)
+        with self.assertRaises(AttributeError):
+            main.no_such_module
+
+    def test_failover_to_waiting_process(self):
+        """测试 leader 持锁期间其它进程竞选失败，leader 退出后重试的进程接手定时任务"""
+        acquired = self.fork.Queue()
+        release = self.fork.Event()
+        holder = self.fork.Process(target=hold_lock_in_child, args=(acquired, release))
+        holder.start()
+        self.assertTrue(acquired.get(timeout=10))
+
+        standby = BackgroundScheduler()
+        with patch.object(main, 'scheduler', standby), patch.object(main, 'scheduler_lock_fd', None):
+            try:
+                self.assertFalse(main.elect_scheduler_leader())
+                self.assertEqual(main.get_scheduler_leader_pid(), holder.pid)
+                self.assertIsNone(standby.get_job('cleanup_expired_projects'))
+
+                release.set()
+                holder.join(timeout=10)
+                self.assertIsNone(main.get_scheduler_leader_pid())
+
+                self.assertTrue(main.elect_scheduler_leader())
+                self.assertEqual(main.get_scheduler_leader_pid(), os.getpid())
+                job_ids = {job.id for job in standby.get_jobs()}
+                self.assertTrue({'cleanup_expired_projects', 'evict_expired_cdn_cache',
+                                 'resume_upload_pipeline', 'backfill_project_metadata'} <= job_ids)
+            finally:
+                self.release_lock()
+
+    def test_new_leader_keeps_cleanup_cadence(self):
+        """测试接手的 leader 按运行记录安排下一次清理，而不是重新等待一个完整间隔"""
+        def next_cleanup_after_takeover():
+            standby = BackgroundScheduler()
+            with patch.object(main, 'scheduler', standby):
+                main.start_leader_jobs()
+            return standby.get_job('cleanup_expired_projects').next_run_time.timestamp()
+
+        # 上次清理刚刚完成，下次运行仍在一个间隔之后
+        main.run_scheduled_job('cleanup_expired_projects', lambda: {'deleted': 0})
+        expected = time.time() + main.CLEANUP_INTERVAL_HOURS * 3600
+        self.assertLess(abs(next_cleanup_after_takeover() - expected), 5)
+
+        # 上次清理已是一个多间隔之前，接手后立即运行
+        conn = main.get_project_index()
+        with conn:
+            conn.execute('UPDATE job_runs SET started_at = started_at - ?', (main.CLEANUP_INTERVAL_HOURS * 3600 + 60,))
+        self.assertLess(abs(next_cleanup_after_takeover() - time.time()), 5)
+
+    def test_job_run_history(self):
+        """测试定时任务的运行记录（耗时、结果）写入索引、按任务限量保留，并通过状态接口返回"""
+        def failing_job():
+            raise RuntimeError('disk full')
+
+        with patch.object(main, 'JOB_RUN_HISTORY_LIMIT', 2):
+            for _ in range(3):
+                main.run_scheduled_job('cleanup_expired_projects', lambda: {'deleted': 1})
+            main.run_scheduled_job('cleanup_expired_projects', lambda: {'skipped': True})
+            main.run_scheduled_job('evict_expired_cdn_cache', failing_job)
+
+        history = main.get_job_run_history()
+        cleanup = history['cleanup_expired_projects']
+        self.assertEqual([run['status'] for run in cleanup['runs']], ['skipped', 'completed'])
+        self.assertEqual(cleanup['last_run']['pid'], os.getpid())
+        self.assertIsNotNone(cleanup['average_duration'])
+        evict = history['evict_expired_cdn_cache']['last_run']
+        self.assertEqual((evict['status'], evict['error']), ('failed', 'disk full'))
+
+        with patch.object(main, 'scheduler_lock_fd', None):
+            response = self.client.get('/api/cleanup/status')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(data['scheduler']['leader'])
+        self.assertIsNone(data['scheduler']['leader_pid'])
+        self.assertEqual(data['scheduler']['jobs']['evict_expired_cdn_cache']['last_run']['status'], 'failed')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
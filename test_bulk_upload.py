@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量上传测试套件
+测试 zip/tar 归档的流式解压、多项目发布、CDN链接替换以及非法归档的拒绝
+"""
+
+import io
+import os
+import sys
+import json
+import tarfile
+import threading
+import zipfile
+import unittest
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from test_support import TempStorageTestCase, wait_for_pipeline
+
+
+def page(title):
+    return (
+        f'<html><head><title>{title}</title>'
+        '<script src="https://unpkg.com/vue@3/dist/vue.global.js"></script>'
+        '<link rel="stylesheet" href="style.css"></head><body></body></html>'
+    )
+
+
+def build_tar(files, compression='gz'):
+    """在内存中构建 tar 归档，files 为 {路径: 内容}"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=f'w:{compression}') as archive:
+        for name, content in files.items():
+            data = content.encode('utf-8') if isinstance(content, str) else content
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def build_zip(files):
+    """在内存中构建 zip 归档，files 为 {路径: 内容}"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+class TestBulkUpload(TempStorageTestCase):
+    """测试批量上传接口"""
+
+    def setUp(self):
+        """测试前设置：获取上传用的 CSRF 令牌"""
+        super().setUp()
+        self.csrf_token = self.fetch_csrf_token()
+
+    def post_archive(self, data, content_type='application/gzip'):
+        return self.client.post(
+            '/api/projects/bulk',
+            data=data,
+            content_type=content_type,
+            headers={'X-CSRFToken': self.csrf_token}
+        )
+
+    def test_tar_with_multiple_projects(self):
+        """测试 tar.gz 中的每个顶层目录发布为一个项目"""
+        archive = build_tar({
+            'alpha/index.html': page('项目A'),
+            'alpha/style.css': 'body { color: red; }',
+            'alpha/img/logo.bin': b'\x00\x01\x02',
+            'beta/index.html': page('项目B'),
+            'beta/.DS_Store': b'junk',
+        })
+        flushed = []
+        original_flush = main.flush_project_access_log
+
+        def counting_flush():
+            flushed.append(original_flush())
+            return flushed[-1]
+
+        with patch.object(main, 'flush_project_access_log', side_effect=counting_flush):
+            response = self.post_archive(archive)
+        self.assertEqual(response.status_code, 200, response.json)
+
+        projects = {p['name']: p for p in response.json['projects']}
+        self.assertEqual(sorted(projects), ['alpha', 'beta'])
+        for project in projects.values():
+            self.assertEqual(wait_for_pipeline(project['project_id'])['status'], 'completed')
+
+        alpha_id = projects['alpha']['project_id']
+        self.assertTrue(projects['alpha']['url'].endswith(f'/static/{alpha_id}/index.html'))
+        html = self.client.get(f'/static/{alpha_id}/index.html').get_data(as_text=True)
+        self.assertIn('/proxy?url=https%3A%2F%2Funpkg.com', html)
+        response = self.client.get(f'/static/{alpha_id}/style.css')
+        self.assertEqual(response.data, b'body { color: red; }')
+        response.close()
+        response = self.client.get(f'/static/{alpha_id}/img/logo.bin')
+        self.assertEqual(response.data, b'\x00\x01\x02')
+        response.close()
+
+        beta_dir = main.get_project_dir(projects['beta']['project_id'])
+        self.assertFalse(os.path.exists(os.path.join(beta_dir, '.DS_Store')))
+        with open(os.path.join(beta_dir, 'metadata.json'), encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['title'], '项目B')
+
+        # 与单页上传一样经过后处理：index.html 存入内容寻址存储（压缩保存），.pending 标记已删除
+        self.assertTrue(os.path.exists(os.path.join(beta_dir, 'index.html.gz')))
+        self.assertFalse(os.path.exists(os.path.join(beta_dir, main.UPLOAD_PENDING_MARKER)))
+        self.assertEqual(len(main.get_project_index().execute('SELECT hash FROM blobs').fetchall()), 2)
+
+        # 所有项目的访问记录在一次写入中落盘，暂存目录已清理
+        self.assertEqual(flushed, [2])
+        indexed = {row[0] for row in main.get_project_index().execute('SELECT id FROM projects')}
+        self.assertEqual(indexed, {p['project_id'] for p in projects.values()})
+        self.assertEqual(sorted(os.listdir(self.static_dir)), ['blobs', 'shards'])
+        self.assertEqual(len(main.get_all_projects()), 2)
+
+    def test_identical_projects_share_content(self):
+        """测试归档中内容相同的项目共享同一份存储"""
+        response = self.post_archive(build_tar({'one/index.html': page('相同'), 'two/index.html': page('相同')}))
+        self.assertEqual(response.status_code, 200, response.json)
+        for project in response.json['projects']:
+            wait_for_pipeline(project['project_id'])
+        self.assertEqual(
+            [refcount for _, refcount in main.get_project_index().execute('SELECT hash, refcount FROM blobs')], [2]
+        )
+
+    def test_pipeline_only_stores_content(self):
+        """测试批量项目的后处理只存入内容寻址存储：项目列表只刷新一次，发布时写入的创建时间不变"""
+        release = threading.Event()
+        original_store = main.store_project_html
+
+        def blocked_store(*args, **kwargs):
+            release.wait(10)
+            return original_store(*args, **kwargs)
+
+        archive = build_tar({f'p{i}/index.html': page(f'项目{i}') for i in range(5)})
+        with patch.object(main, 'invalidate_projects_cache', wraps=main.invalidate_projects_cache) as invalidate, \
+                patch.object(main, 'store_project_html', side_effect=blocked_store):
+            response = self.post_archive(archive)
+            self.assertEqual(response.status_code, 200, response.json)
+            project_ids = [project['project_id'] for project in response.json['projects']]
+
+            def created_at(project_id):
+                with open(os.path.join(main.get_project_dir(project_id), 'metadata.json'), encoding='utf-8') as f:
+                    return json.load(f)['created_at']
+
+            published_at = {project_id: created_at(project_id) for project_id in project_ids}
+            release.set()
+            for project_id in project_ids:
+                job = wait_for_pipeline(project_id)
+                self.assertEqual(job['status'], 'completed')
+                self.assertEqual(job['completed_stages'], ['store'])
+            self.assertEqual(invalidate.call_count, 1)
+        self.assertEqual({project_id: created_at(project_id) for project_id in project_ids}, published_at)
+
+    def test_failed_publish_rolls_back(self):
+        """测试发布中途失败时回滚已发布的项目，不提交后处理，也不占用后处理名额"""
+        original_rename = os.rename
+        renames = []
+
+        def failing_rename(source, target):
+            renames.append(target)
+            if len(renames) == 2:
+                raise OSError('磁盘错误')
+            original_rename(source, target)
+
+        slots_before = main.upload_pipeline_slots._value
+        archive = build_tar({'alpha/index.html': page('项目A'), 'beta/index.html': page('项目B')})
+        with patch.object(main.os, 'rename', side_effect=failing_rename):
+            response = self.post_archive(archive)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(renames), 2)
+        self.assertFalse(os.path.exists(renames[0]))
+        self.assertEqual(main.get_all_projects(), [])
+        self.assertEqual(main.upload_pipeline_slots._value, slots_before)
+
+    def test_rejected_when_pipeline_queue_full(self):
+        """测试后处理名额不足以容纳归档中的所有项目时整体返回 503"""
+        archive = build_tar({'alpha/index.html': page('项目A'), 'beta/index.html': page('项目B')})
+        with patch.object(main, 'upload_pipeline_slots', main.threading.BoundedSemaphore(1)) as slots:
+            response = self.post_archive(archive)
+            self.assertEqual(slots._value, 1)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(main.get_all_projects(), [])
+
+    def test_zip_single_project_via_multipart(self):
+        """测试根目录含 index.html 的 zip 作为单个项目发布"""
+        archive = build_zip({'index.html': page('单项目'), 'app.js': 'console.log(1);'})
+        response = self.client.post(
+            '/api/projects/bulk',
+            data={'archive': (io.BytesIO(archive), 'site.zip')},
+            content_type='multipart/form-data',
+            headers={'X-CSRFToken': self.csrf_token}
+        )
+        self.assertEqual(response.status_code, 200, response.json)
+        self.assertEqual(response.json['count'], 1)
+        project_id = response.json['projects'][0]['project_id']
+        wait_for_pipeline(project_id)
+        project_dir = main.get_project_dir(project_id)
+        expected = ['app.js', 'index.html.gz', 'metadata.json']
+        if main.PREVIEW_BROTLI_ENABLED:
+            expected.append('index.html.br')
+        if main.PREVIEW_KEEP_RAW_HTML:
+            expected.append('index.html')
+        self.assertEqual(sorted(os.listdir(project_dir)), sorted(expected))
+
+    def test_staging_dir_not_listed_as_project(self):
+        """测试解压中的暂存目录（根目录含 index.html）不会被当作项目列出或同步进索引"""
+        staging_dir = os.path.join(self.static_dir, '.bulk-test')
+        os.makedirs(staging_dir)
+        with open(os.path.join(staging_dir, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(page('暂存'))
+
+        self.assertEqual(list(main.iter_project_dirs()), [])
+        self.assertEqual(main.get_all_projects(), [])
+        main.sync_project_index()
+        self.assertEqual(main.get_project_index().execute('SELECT id FROM projects').fetchall(), [])
+
+    def test_rejects_path_traversal(self):
+        """测试包含 .. 的归档被拒绝，且不会写出任何文件"""
+        archive = build_tar({'good/index.html': page('好'), '../evil.html': 'x'}, compression='')
+        response = self.post_archive(archive, content_type='application/x-tar')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(os.listdir(self.static_dir), [])
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'evil.html')))
+
+    def test_rejects_invalid_archives(self):
+        """测试无法解析的归档、缺少 index.html 以及超出解压大小上限"""
+        self.assertEqual(self.post_archive(b'not an archive').status_code, 400)
+        self.assertEqual(self.post_archive(build_zip({'readme.txt': 'hi'}), 'application/zip').status_code, 400)
+
+        with patch.object(main, 'BULK_UPLOAD_MAX_EXTRACTED_SIZE', 100):
+            response = self.post_archive(build_tar({'index.html': page('大'), 'big.bin': b'x' * 1000}))
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(os.listdir(self.static_dir), [])
+
+    def test_bulk_limit_is_separate_from_upload_limit(self):
+        """测试批量上传的请求体上限独立于单页上传的 MAX_CONTENT_LENGTH"""
+        payload = b'y' * (main.MAX_CONTENT_LENGTH + 1024)
+        response = self.post_archive(build_tar({'index.html': page('大资源'), 'blob.bin': payload}, compression=''),
+                                     content_type='application/x-tar')
+        self.assertEqual(response.status_code, 200, response.json)
+        wait_for_pipeline(response.json['projects'][0]['project_id'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
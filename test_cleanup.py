@@ -16,11 +16,11 @@ def test_imports():
         import main
         print("✓ 主模块导入成功")
 
-        # 检查调度器是否已启动
-        if hasattr(main, 'scheduler') and main.scheduler.running:
-            print("✓ 后台调度器已启动")
+        # 导入时不应启动调度器，后台服务由 create_app / gunicorn 显式启动
+        if main.scheduler is None or not main.scheduler.running:
+            print("✓ 导入时未启动后台调度器")
         else:
-            print("✗ 后台调度器未启动")
+            print("✗ 导入时启动了后台调度器")
             return False
 
         # 检查清理函数是否存在
@@ -85,17 +85,24 @@ def test_scheduler_jobs():
     print("\n测试调度器任务...")
     try:
         import main
+        from unittest.mock import patch
+        from apscheduler.schedulers.background import BackgroundScheduler
 
-        jobs = main.scheduler.get_jobs()
+        # 在未启动的独立调度器上注册 leader 任务，只检查任务配置，不启动线程
+        scheduler = BackgroundScheduler()
+        with patch.object(main, 'scheduler', scheduler):
+            main.start_leader_jobs()
+
+        jobs = scheduler.get_jobs()
         print(f"  调度器中的任务数: {len(jobs)}")
 
         for job in jobs:
             print(f"  - 任务ID: {job.id}")
             print(f"    任务名称: {job.name}")
-            print(f"    下次运行: {job.next_run_time}")
+            print(f"    下次运行: {getattr(job, 'next_run_time', '调度器启动后立即运行')}")
 
         # 检查是否有清理任务
-        cleanup_job = main.scheduler.get_job('cleanup_expired_projects')
+        cleanup_job = scheduler.get_job('cleanup_expired_projects')
         if cleanup_job:
             print("✓ 清理任务已注册到调度器")
             return True
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+压缩存储测试套件
+测试预览页以压缩形式保存、按 Accept-Encoding 发送以及为不支持压缩的客户端解压
+"""
+
+import os
+import sys
+import gzip
+import unittest
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from test_support import TempStorageTestCase, wait_for_pipeline
+
+HTML_CONTENT = '<html><head><title>压缩测试</title></head><body>' + '<p>重复内容</p>' * 500 + '</body></html>'
+
+
+class TestCompressedStorage(TempStorageTestCase):
+    """测试预览页压缩存储与发送"""
+
+    def setUp(self):
+        """测试前设置：获取上传用的 CSRF 令牌"""
+        super().setUp()
+        self.csrf_token = self.fetch_csrf_token()
+
+    def upload(self):
+        response = self.client.post(
+            '/upload',
+            data={'html_content': HTML_CONTENT},
+            headers={'X-CSRFToken': self.csrf_token}
+        )
+        project_id = response.json['project_id']
+        self.assertEqual(wait_for_pipeline(project_id)['status'], 'completed')
+        return project_id
+
+    def get_preview(self, project_id, accept_encoding=None):
+        headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+        response = self.client.get(f'/static/{project_id}/index.html', headers=headers)
+        data = response.get_data()
+        response.close()
+        return response, data
+
+    def test_stored_compressed_only(self):
+        """测试默认只保存压缩版本，占用空间小于原文"""
+        project_id = self.upload()
+        project_dir = main.get_project_dir(project_id)
+
+        self.assertFalse(os.path.exists(os.path.join(project_dir, 'index.html')))
+        compressed_file = os.path.join(project_dir, 'index.html.gz')
+        self.assertLess(os.path.getsize(compressed_file), len(HTML_CONTENT.encode('utf-8')) // 10)
+        self.assertEqual(main.read_project_html(project_dir), HTML_CONTENT)
+        self.assertEqual([p['title'] for p in main.get_all_projects()], ['压缩测试'])
+
+    def test_serves_precompressed_bytes(self):
+        """测试支持 gzip 的客户端直接收到预压缩的字节"""
+        project_id = self.upload()
+        response, data = self.get_preview(project_id, 'gzip, deflate, br')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'br' if main.PREVIEW_BROTLI_ENABLED else 'gzip')
+        self.assertEqual(response.mimetype, 'text/html')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertIn('Content-Security-Policy', response.headers)
+        if response.headers['Content-Encoding'] == 'gzip':
+            self.assertEqual(gzip.decompress(data).decode('utf-8'), HTML_CONTENT)
+
+        response, data = self.get_preview(project_id, 'gzip')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        with open(os.path.join(main.get_project_dir(project_id), 'index.html.gz'), 'rb') as f:
+            self.assertEqual(data, f.read())
+
+    def test_decompresses_for_identity_clients(self):
+        """测试不支持压缩的客户端收到解压后的页面"""
+        project_id = self.upload()
+        response, data = self.get_preview(project_id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.mimetype, 'text/html')
+        self.assertEqual(data.decode('utf-8'), HTML_CONTENT)
+        self.assertIn(project_id, main.project_access_log)
+
+    def test_keep_raw_html(self):
+        """测试配置保留原文时同时保存未压缩版本"""
+        with patch.object(main, 'PREVIEW_KEEP_RAW_HTML', True):
+            project_id = self.upload()
+        project_dir = main.get_project_dir(project_id)
+        self.assertTrue(os.path.exists(os.path.join(project_dir, 'index.html')))
+        self.assertTrue(os.path.exists(os.path.join(project_dir, 'index.html.gz')))
+
+        response, data = self.get_preview(project_id)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(data.decode('utf-8'), HTML_CONTENT)
+
+    def test_legacy_raw_project(self):
+        """测试只有未压缩 index.html 的旧项目照常发送"""
+        project_dir = os.path.join(self.static_dir, 'legacy01')
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(HTML_CONTENT)
+
+        response, data = self.get_preview('legacy01', 'gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(data.decode('utf-8'), HTML_CONTENT)
+
+    @unittest.skipUnless(main.brotli, '未安装 brotli')
+    def test_brotli_variant(self):
+        """测试安装 brotli 时保存并发送 br 版本"""
+        with patch.object(main, 'PREVIEW_BROTLI_ENABLED', True):
+            project_id = self.upload()
+        response, data = self.get_preview(project_id, 'br')
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(main.brotli.decompress(data).decode('utf-8'), HTML_CONTENT)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内容去重测试套件
+测试重复上传共享同一份内容、引用计数以及删除项目互不影响
+"""
+
+import os
+import sys
+import hashlib
+import threading
+import unittest
+import multiprocessing
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from test_support import TempStorageTestCase, wait_for_pipeline
+
+HTML_CONTENT = (
+    '<html><head><title>去重测试</title>'
+    '<script src="https://cdn.tailwindcss.com"></script>'
+    '</head><body>' + ''.join(hashlib.sha256(str(i).encode()).hexdigest() for i in range(128)) + '</body></html>'
+)
+
+
+def hold_blob_lock_in_child(acquired, release):
+    """在子进程中持有内容寻址存储的锁，直到父进程通知释放"""
+    with main.blob_store_locked():
+        acquired.put(True)
+        release.wait(10)
+
+
+class TestContentDeduplication(TempStorageTestCase):
+    """测试内容寻址存储"""
+
+    def setUp(self):
+        """测试前设置：获取上传用的 CSRF 令牌"""
+        super().setUp()
+        self.csrf_token = self.fetch_csrf_token()
+
+    def upload(self, html_content=HTML_CONTENT):
+        response = self.client.post(
+            '/upload',
+            data={'html_content': html_content},
+            headers={'X-CSRFToken': self.csrf_token}
+        )
+        self.assertEqual(response.status_code, 200)
+        project_id = response.json['project_id']
+        self.assertEqual(wait_for_pipeline(project_id)['status'], 'completed')
+        return project_id
+
+    def delete(self, project_id):
+        response = self.client.delete(f'/api/projects/{project_id}', headers={'X-CSRFToken': self.csrf_token})
+        self.assertEqual(response.status_code, 200)
+
+    def get_blobs(self):
+        return dict(main.get_project_index().execute('SELECT hash, refcount FROM blobs'))
+
+    def test_duplicate_uploads_share_content(self):
+        """测试重复上传共享同一份内容，项目ID和元数据仍各自独立"""
+        first = self.upload()
+        second = self.upload()
+        self.assertNotEqual(first, second)
+
+        blobs = self.get_blobs()
+        self.assertEqual(list(blobs.values()), [2])
+        blob_path = main.get_blob_path(next(iter(blobs)))
+
+        first_html = os.path.join(main.get_project_dir(first), 'index.html.gz')
+        second_html = os.path.join(main.get_project_dir(second), 'index.html.gz')
+        self.assertTrue(os.path.samefile(first_html, blob_path))
+        self.assertTrue(os.path.samefile(second_html, blob_path))
+        self.assertIn(b'/proxy?url=https%3A%2F%2Fcdn.tailwindcss.com', main.read_blob_html(next(iter(blobs))))
+
+        # 共享内容只计入一次存储用量
+        html_size = os.path.getsize(blob_path)
+        self.assertLess(main.get_directory_size(self.static_dir), 2 * html_size)
+
+        # 每个项目仍有独立的元数据
+        self.assertTrue(os.path.exists(os.path.join(main.get_project_dir(first), 'metadata.json')))
+        self.assertTrue(os.path.exists(os.path.join(main.get_project_dir(second), 'metadata.json')))
+        self.assertEqual(sorted(p['id'] for p in main.get_all_projects()), sorted([first, second]))
+
+        # 不同内容保存为新的共享内容
+        self.upload(HTML_CONTENT + '<!-- 不同内容 -->')
+        self.assertEqual(len(self.get_blobs()), 2)
+
+    def test_delete_keeps_other_references(self):
+        """测试删除一个项目不影响共享同一内容的其它项目，最后一个引用删除后回收内容"""
+        first = self.upload()
+        second = self.upload()
+        content_hash = next(iter(self.get_blobs()))
+        blob_path = main.get_blob_path(content_hash)
+
+        self.delete(first)
+        self.assertEqual(self.get_blobs(), {content_hash: 1})
+        self.assertTrue(os.path.exists(blob_path))
+        response = self.client.get(f'/static/{second}/index.html')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('去重测试'.encode('utf-8'), response.data)
+        response.close()
+
+        self.delete(second)
+        self.assertEqual(self.get_blobs(), {})
+        self.assertFalse(os.path.exists(blob_path))
+
+    def test_falls_back_to_copy_without_hard_links(self):
+        """测试文件系统不支持硬链接时退化为复制"""
+        with patch.object(main.os, 'link', side_effect=OSError('不支持硬链接')):
+            first = self.upload()
+            second = self.upload()
+
+        first_html = os.path.join(main.get_project_dir(first), 'index.html.gz')
+        second_html = os.path.join(main.get_project_dir(second), 'index.html.gz')
+        self.assertFalse(os.path.samefile(first_html, second_html))
+        with open(first_html, 'rb') as f1, open(second_html, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+        self.assertEqual(list(self.get_blobs().values()), [2])
+
+    @unittest.skipUnless(main.fcntl, '当前平台不支持文件锁')
+    def test_blob_store_lock_is_cross_process(self):
+        """测试其它进程持有存储锁时，本进程释放引用（检查引用计数并删除文件）要等锁释放后才进行"""
+        project_id = self.upload()
+        content_hash = next(iter(self.get_blobs()))
+
+        fork = multiprocessing.get_context('fork')
+        acquired, release = fork.Queue(), fork.Event()
+        holder = fork.Process(target=hold_blob_lock_in_child, args=(acquired, release))
+        holder.start()
+        try:
+            self.assertTrue(acquired.get(timeout=10))
+            releaser = threading.Thread(target=main.release_project_blob, args=(project_id,))
+            releaser.start()
+            releaser.join(0.3)
+            self.assertTrue(releaser.is_alive())
+            self.assertEqual(self.get_blobs(), {content_hash: 1})
+        finally:
+            release.set()
+            holder.join(10)
+        releaser.join(10)
+        self.assertEqual(self.get_blobs(), {})
+        self.assertFalse(os.path.exists(main.get_blob_path(content_hash)))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
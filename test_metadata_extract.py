@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTML 元数据测试套件
+验证流式提取器与原先基于 BeautifulSoup 的实现输出完全一致，以及旧项目元数据回填
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from main import app, extract_html_metadata, HTMLMetadataParser
+from benchmarks.bench_extract_metadata import extract_html_metadata_bs4, build_document
+
+# 随机拼接文档用的片段，覆盖各种容易出现差异的写法
+FRAGMENTS = [
+    '<title>', '</title>', '<TITLE>', '<title/>', '<h1>', '</h1>', '<h1/>', '<p>', '</p>', '<P class=x>', '<p/>',
+    '<br>', '<br/>', '</br>', '<meta>', '<meta name="description" content=" 描述 ">', '<meta name=description>',
+    '<meta name="Description" content="no">', '<meta content="x" name="description"/>',
+    '<script>', '</script>', '<script>var a = "<p>x</p>";</script>', '<style>p {}</style>',
+    '<template>', '</template>', '<rt>', '</rt>', '<pre>', '</pre>', '<textarea>', '</textarea>',
+    '<!-- c -->', '<!---->', '<![CDATA[cd]]>', '<!DOCTYPE html>', '<?pi x?>',
+    '&amp;', '&nbsp;', '&#65;', '&#x42;', '&#150;', '&#129;', '&bogus;', '&amp', '&', '<',
+    ' ', '  \n ', '\t', 'hello', '标题', '<b>', '</b>', '<div>', '</div>', '<img src=x>',
+    'x' * 120, '<svg><title>s</title></svg>', '<head>', '</head>', '<body>', '</body>',
+]
+
+
+class TestHTMLMetadataExtraction(unittest.TestCase):
+    """测试流式元数据提取"""
+
+    def assertSameAsBeautifulSoup(self, html_content):
+        expected = extract_html_metadata_bs4(html_content)
+        self.assertEqual(extract_html_metadata(html_content), expected, repr(html_content))
+        # 分块边界不能影响结果
+        for chunk_size in (1, 7):
+            parser = HTMLMetadataParser()
+            parser.parse(html_content, chunk_size=chunk_size)
+            try:
+                result = parser.get_metadata()
+            except Exception:
+                result = {'title': '未命名项目', 'description': '暂无描述'}
+            self.assertEqual(result, expected, f'chunk_size={chunk_size}: {html_content!r}')
+
+    def test_basic_fields(self):
+        """测试标题、描述及其回退规则"""
+        result = extract_html_metadata(
+            '<html><head><title> 我的页面 </title>'
+            '<meta name="description" content="页面描述"></head>'
+            '<body><h1>标题</h1><p>段落</p></body></html>'
+        )
+        self.assertEqual(result, {'title': '我的页面', 'description': '页面描述'})
+
+        result = extract_html_metadata('<h1>Hello <b>World</b></h1><p>' + 'a' * 150 + '</p>')
+        self.assertEqual(result, {'title': 'Hello World', 'description': 'a' * 100 + '...'})
+
+        self.assertEqual(extract_html_metadata(''), {'title': '未命名项目', 'description': '暂无描述'})
+
+    def test_beautifulsoup_quirks(self):
+        """测试 BeautifulSoup 的特殊行为同样被保留"""
+        cases = [
+            '<title>a<b>b</b></title><p>p</p>',  # title 有多个子节点时整体回退默认值
+            '<title><b>nested</b></title>',
+            '<title><!--comment--></title>',
+            '<h1>a<script>hidden</script>b<rt>r</rt></h1>',
+            '<p>a<b>x</b>   <i>y</i></p>',  # 纯空白片段折叠为一个空格
+            '<pre><p>a<b>x</b>   <i>y</i></p></pre>',
+            '<p/>text<meta name="description">',
+            '<br><br/><h1>a</h1>',
+            '<p>&bogus; &#150; &#129; &amp</p>',
+            '<h1>unclosed<div>x</div>tail',
+            '<body><h1>late</h1><svg><title>svg title</title></svg>',
+        ]
+        for html_content in cases:
+            self.assertSameAsBeautifulSoup(html_content)
+
+    def test_random_documents(self):
+        """随机文档与 BeautifulSoup 实现逐一对比"""
+        rng = random.Random(20240501)
+        for _ in range(300):
+            html_content = ''.join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 40)))
+            self.assertSameAsBeautifulSoup(html_content)
+
+    def test_large_documents(self):
+        """测试大文档（提前结束与完整解析两种路径）"""
+        for kwargs in ({}, {'with_meta': False}, {'with_meta': False, 'trailing_meta': True}):
+            html_content = build_document(256 * 1024, **kwargs)
+            self.assertEqual(extract_html_metadata(html_content), extract_html_metadata_bs4(html_content))
+
+
+class TestMetadataBackfill(unittest.TestCase):
+    """测试旧项目元数据回填"""
+
+    def setUp(self):
+        """测试前设置：在临时目录中创建没有 metadata.json 的旧项目"""
+        self.static_dir = tempfile.mkdtemp()
+        self.original_upload_folder = app.config['UPLOAD_FOLDER']
+        self.original_index_path = app.config['PROJECT_INDEX_PATH']
+        app.config['UPLOAD_FOLDER'] = self.static_dir
+        app.config['PROJECT_INDEX_PATH'] = os.path.join(self.static_dir, 'project_index.db')
+        main.invalidate_projects_cache()
+
+        for project_id, title in (('legacy01', '旧项目一'), ('legacy02', '旧项目二')):
+            project_dir = os.path.join(self.static_dir, project_id)
+            os.makedirs(project_dir)
+            with open(os.path.join(project_dir, 'index.html'), 'w', encoding='utf-8') as f:
+                f.write(f'<html><head><title>{title}</title></head><body><p>内容</p></body></html>')
+
+    def tearDown(self):
+        """测试后清理"""
+        app.config['UPLOAD_FOLDER'] = self.original_upload_folder
+        app.config['PROJECT_INDEX_PATH'] = self.original_index_path
+        main.invalidate_projects_cache()
+        shutil.rmtree(self.static_dir)
+
+    def test_list_rebuild_does_not_parse_html(self):
+        """测试项目列表重建不解析 HTML、不在读取路径上启动回填，且创建时间保持稳定"""
+        with patch.object(main, 'start_metadata_backfill') as start_backfill, \
+                patch.object(main, 'extract_html_metadata') as extract:
+            first = main.get_all_projects()
+            main.invalidate_projects_cache()
+            second = main.get_all_projects()
+
+        extract.assert_not_called()
+        start_backfill.assert_not_called()
+        self.assertEqual(len(first), 2)
+        self.assertEqual([p['created_at'] for p in first], [p['created_at'] for p in second])
+
+    def test_backfill_writes_metadata_once(self):
+        """测试回填写入 metadata.json，之后列表直接使用回填结果"""
+        status = main.backfill_project_metadata()
+        self.assertEqual(status['status'], 'completed')
+        self.assertEqual((status['total'], status['done'], status['failed']), (2, 2, 0))
+
+        with open(os.path.join(self.static_dir, 'legacy01', 'metadata.json'), encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['title'], '旧项目一')
+
+        # 项目索引中记录了完成标记，再次运行（例如新 leader 启动）直接跳过，不再遍历项目目录
+        self.assertTrue(main.is_metadata_backfill_done())
+        with patch.object(main, 'iter_project_dirs') as iter_dirs:
+            self.assertTrue(main.backfill_project_metadata().get('skipped'))
+        iter_dirs.assert_not_called()
+
+        with patch.object(main, 'extract_html_metadata') as extract:
+            titles = sorted(p['title'] for p in main.get_all_projects())
+        extract.assert_not_called()
+        self.assertEqual(titles, ['旧项目一', '旧项目二'])
+
+    def test_backfill_status_shared_through_index(self):
+        """测试回填进度保存在项目索引中，查询接口由任何进程调用都返回同一份进度"""
+        self.assertEqual(main.get_metadata_backfill_status()['status'], 'idle')
+        main.backfill_project_metadata()
+        response = app.test_client().get('/api/metadata/backfill/status')
+        self.assertEqual(response.json['backfill']['status'], 'completed')
+        self.assertEqual(response.json['backfill']['done'], 2)
+        self.assertEqual(main.get_background_job('metadata_backfill', 'latest')['done'], 2)
+
+    @unittest.skipUnless(main.fcntl, '当前平台不支持文件锁')
+    def test_backfill_skipped_while_other_process_runs(self):
+        """测试其它进程正在回填时跳过本次回填"""
+        lock_fd = os.open(f"{app.config['PROJECT_INDEX_PATH']}.backfill.lock", os.O_RDWR | os.O_CREAT)
+        try:
+            main.fcntl.flock(lock_fd, main.fcntl.LOCK_EX)
+            with patch.object(main, 'backfill_single_project') as backfill:
+                self.assertTrue(main.backfill_project_metadata().get('skipped'))
+            backfill.assert_not_called()
+        finally:
+            os.close(lock_fd)
+        self.assertFalse(main.metadata_backfill_lock.locked())
+
+    def test_failed_backfill_is_retried(self):
+        """测试有项目回填失败时不记录完成标记，下次运行会重试"""
+        with patch.object(main, 'backfill_single_project', return_value=False):
+            self.assertEqual(main.backfill_project_metadata()['failed'], 2)
+        self.assertFalse(main.is_metadata_backfill_done())
+        self.assertEqual(main.backfill_project_metadata()['done'], 2)
+        self.assertTrue(main.is_metadata_backfill_done())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+指标测试套件
+测试计数器和直方图的累计输出、多进程汇总，/metrics 接口记录的请求、代理和清理指标，以及 Server-Timing 分阶段耗时
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+from unittest.mock import patch, Mock
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+import metrics
+from main import app
+
+
+def record_in_child(counter, histogram):
+    """在子进程中写入指标"""
+    counter.labels('child').inc(2)
+    histogram.observe(3)
+
+
+def parse_samples(text):
+    """把 Prometheus 文本格式解析为 {样本名和标签: 值}"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, _, value = line.rpartition(' ')
+            samples[name] = float(value)
+    return samples
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    """测试指标注册表"""
+
+    def setUp(self):
+        """测试前设置：指标文件写入临时目录"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry = metrics.MetricsRegistry(self.temp_dir)
+
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+
+    def test_histogram_buckets_are_cumulative(self):
+        """测试直方图输出累计桶、_sum 和 _count，等于桶上限的值计入该桶"""
+        histogram = self.registry.histogram('demo_seconds', '演示', ('route',), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.labels('/a').observe(value)
+
+        samples = parse_samples(self.registry.render())
+        self.assertEqual(samples['demo_seconds_bucket{route="/a",le="0.1"}'], 2)
+        self.assertEqual(samples['demo_seconds_bucket{route="/a",le="1"}'], 3)
+        self.assertEqual(samples['demo_seconds_bucket{route="/a",le="+Inf"}'], 4)
+        self.assertEqual(samples['demo_seconds_count{route="/a"}'], 4)
+        self.assertAlmostEqual(samples['demo_seconds_sum{route="/a"}'], 5.65)
+
+    def test_values_aggregated_across_processes(self):
+        """测试各进程写入自己的文件，读取时求和；清空后从零开始"""
+        counter = self.registry.counter('demo_total', '演示', ('source',))
+        histogram = self.registry.histogram('demo_seconds', '演示')
+        counter.labels('parent').inc()
+        counter.labels('child').inc()
+        histogram.observe(1)
+
+        for _ in range(2):
+            process = multiprocessing.get_context('fork').Process(target=record_in_child, args=(counter, histogram))
+            process.start()
+            process.join(timeout=10)
+            self.assertEqual(process.exitcode, 0)
+
+        self.assertEqual(len(os.listdir(self.temp_dir)), 3)
+        samples = parse_samples(self.registry.render())
+        self.assertEqual(samples['demo_total{source="parent"}'], 1)
+        self.assertEqual(samples['demo_total{source="child"}'], 5)
+        self.assertEqual(samples['demo_seconds_count'], 3)
+        self.assertEqual(samples['demo_seconds_sum'], 7)
+
+        self.registry.clear()
+        self.assertNotIn('demo_total{source="parent"}', parse_samples(self.registry.render()))
+
+    def test_file_grows_and_labels_escaped(self):
+        """测试条目超过初始文件大小时自动扩展，标签值中的特殊字符被转义"""
+        counter = self.registry.counter('demo_total', '演示', ('key',))
+        for i in range(2000):
+            counter.labels(f'key-{i:04d}-' + 'x' * 40).inc()
+        counter.labels('a"b\\c').inc()
+
+        samples = parse_samples(self.registry.render())
+        self.assertEqual(sum(1 for name in samples if name.startswith('demo_total')), 2001)
+        self.assertEqual(samples['demo_total{key="a\\"b\\\\c"}'], 1)
+
+    def test_gauge_and_local_store(self):
+        """测试 Gauge 在读取时计算；未配置目录时只统计当前进程"""
+        registry = metrics.MetricsRegistry()
+        registry.gauge('demo_bytes', '演示', lambda: 42)
+        registry.gauge('demo_items', '演示', lambda: {('a',): 1, ('b',): 2}, ('tier',))
+        registry.counter('demo_total', '演示').inc(3)
+
+        text = registry.render()
+        self.assertIn('# TYPE demo_bytes gauge', text)
+        samples = parse_samples(text)
+        self.assertEqual(samples['demo_bytes'], 42)
+        self.assertEqual(samples['demo_items{tier="b"}'], 2)
+        self.assertEqual(samples['demo_total'], 3)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    """测试 /metrics 接口"""
+
+    def setUp(self):
+        """测试前设置"""
+        self.temp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        main.limiter.enabled = False
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """测试后清理"""
+        main.limiter.enabled = True
+        shutil.rmtree(self.temp_dir)
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        return parse_samples(response.get_data(as_text=True))
+
+    def test_request_and_proxy_metrics(self):
+        """测试请求耗时、状态码、响应字节数、代理缓存结果和回源耗时被记录"""
+        before = self.scrape()
+        self.client.get('/api/csrf-token')
+
+        upstream = Mock(status_code=200, headers={'Content-Type': 'text/css'})
+        upstream.iter_content.return_value = [b'body{}']
+        with patch('main.requests.get', return_value=upstream), \
+                patch.object(main, 'get_cdn_from_memory_cache', return_value=None), \
+                patch.object(main, 'get_cdn_from_file_cache', return_value=None), \
+                patch.object(main, 'set_cdn_to_file_cache'):
+            self.client.get('/proxy?url=https://cdn.jsdelivr.net/npm/demo.css')
+        self.client.get('/proxy?url=https://evil.example.com/a.js')
+
+        after = self.scrape()
+
+        def delta(name):
+            return after.get(name, 0) - before.get(name, 0)
+
+        self.assertEqual(delta('preview_http_requests_total{endpoint="get_csrf_token",method="GET",status="200"}'), 1)
+        self.assertEqual(delta('preview_http_request_duration_seconds_count{endpoint="get_csrf_token",method="GET"}'), 1)
+        self.assertGreater(delta('preview_http_response_bytes_total{endpoint="get_csrf_token"}'), 0)
+        self.assertEqual(delta('preview_proxy_requests_total{cache_status="MISS",status="200"}'), 1)
+        self.assertEqual(delta('preview_proxy_requests_total{cache_status="ERROR",status="403"}'), 1)
+        self.assertEqual(delta('preview_proxy_upstream_duration_seconds_count{domain="cdn.jsdelivr.net"}'), 1)
+        self.assertIn('preview_memory_cache_resident_bytes', after)
+
+    def test_rebuild_and_cleanup_metrics(self):
+        """测试项目列表重建和过期清理的耗时被记录"""
+        upload_dir = os.path.join(self.temp_dir, 'static')
+        os.makedirs(upload_dir)
+        before = self.scrape()
+        with patch.dict(app.config, {'UPLOAD_FOLDER': upload_dir}):
+            main.invalidate_projects_cache()
+            main.get_all_projects()
+            main.cleanup_expired_projects()
+        after = self.scrape()
+
+        self.assertEqual(after['preview_projects_cache_rebuild_seconds_count']
+                         - before.get('preview_projects_cache_rebuild_seconds_count', 0), 1)
+        self.assertEqual(after['preview_cleanup_duration_seconds_count']
+                         - before.get('preview_cleanup_duration_seconds_count', 0), 1)
+
+
+class TestServerTiming(unittest.TestCase):
+    """测试分阶段耗时和 Server-Timing 响应头"""
+
+    def setUp(self):
+        """测试前设置"""
+        app.config['TESTING'] = True
+        main.limiter.enabled = False
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """测试后清理"""
+        main.limiter.enabled = True
+
+    def get_phases(self, response):
+        header = response.headers.get('Server-Timing')
+        self.assertIsNotNone(header)
+        phases = {}
+        for entry in header.split(', '):
+            name, _, duration = entry.partition(';dur=')
+            phases[name] = float(duration)
+        return phases
+
+    def test_proxy_phases(self):
+        """测试代理请求按命中路径返回各阶段耗时，总耗时不小于各阶段之和"""
+        url = '/proxy?url=https://cdn.jsdelivr.net/npm/timing.js'
+        upstream = Mock(status_code=200, headers={'Content-Type': 'application/javascript'})
+        upstream.iter_content.return_value = [b'1;']
+        with patch.object(main, 'SERVER_TIMING_ENABLED', True), \
+                patch('main.requests.get', return_value=upstream), \
+                patch.object(main, 'get_cdn_from_memory_cache', return_value=None), \
+                patch.object(main, 'get_cdn_from_file_cache', return_value=None), \
+                patch.object(main, 'set_cdn_to_memory_cache'), \
+                patch.object(main, 'set_cdn_to_file_cache'):
+            miss = self.client.get(url)
+        phases = self.get_phases(miss)
+        self.assertEqual(list(phases), ['hash', 'memory', 'upstream', 'disk', 'download', 'store', 'total'])
+        self.assertGreaterEqual(phases['total'] + 0.05, sum(v for k, v in phases.items() if k != 'total'))
+
+        with patch.object(main, 'SERVER_TIMING_ENABLED', True), \
+                patch.object(main, 'get_cdn_from_memory_cache', return_value=(b'1;', 'application/javascript', 0)):
+            hit = self.client.get(url)
+        self.assertEqual(hit.headers['X-Cache-Status'], 'HIT-MEMORY')
+        self.assertEqual(list(self.get_phases(hit)), ['hash', 'memory', 'total'])
+
+    def test_disabled_by_default_and_recorded_in_metrics(self):
+        """测试未开启时不返回响应头，但阶段耗时仍计入指标"""
+        before = parse_samples(main.metrics_registry.render())
+        response = self.client.get('/api/projects')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response.headers)
+
+        after = parse_samples(main.metrics_registry.render())
+        name = 'preview_http_request_phase_seconds_count{endpoint="get_projects",phase="list"}'
+        self.assertEqual(after[name] - before.get(name, 0), 1)
+
+    def test_static_phases(self):
+        """测试预览页返回路径解析和打开文件的耗时；项目不存在时只有路径解析"""
+        project_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, project_dir)
+        with open(os.path.join(project_dir, 'index.html'), 'w') as f:
+            f.write('<p>timing</p>')
+
+        with patch.object(main, 'SERVER_TIMING_ENABLED', True), \
+                patch.object(main, 'get_project_dir', return_value=project_dir), \
+                patch.object(main, 'record_project_access'):
+            response = self.client.get('/static/timing01/index.html')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(self.get_phases(response)), ['resolve', 'open', 'total'])
+        response.close()
+
+        with patch.object(main, 'SERVER_TIMING_ENABLED', True), \
+                patch.object(main, 'get_project_dir', return_value=None):
+            response = self.client.get('/static/missing01/index.html')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(list(self.get_phases(response)), ['resolve', 'total'])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求分析测试套件
+测试按请求头或抽样率分析请求、保存 collapsed stacks 和火焰图，以及分析结果接口的鉴权
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+import profiling
+from main import app
+
+TOKEN = 'test-profiling-token'
+
+
+def slow_project_listing():
+    """模拟耗时的项目列表生成，应出现在采样到的调用栈中"""
+    time.sleep(0.05)
+    return []
+
+
+class TestRequestProfiling(unittest.TestCase):
+    """测试按需请求分析"""
+
+    def setUp(self):
+        """测试前设置：分析结果写入临时目录"""
+        self.temp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        main.limiter.enabled = False
+        self.client = app.test_client()
+        self.patches = [
+            patch.object(main, 'PROFILES_DIR', self.temp_dir),
+            patch.object(main, 'PROFILING_TOKEN', TOKEN),
+            patch.object(main, 'PROFILING_INTERVAL', 0.002),
+            patch.object(main, 'get_all_projects', slow_project_listing),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        """测试后清理"""
+        for patcher in self.patches:
+            patcher.stop()
+        main.limiter.enabled = True
+        shutil.rmtree(self.temp_dir)
+
+    def list_profiles(self, token=TOKEN):
+        return self.client.get('/api/profiles', headers={'Authorization': f'Bearer {token}'})
+
+    def test_header_triggers_profile(self):
+        """测试带正确令牌的 X-Profile 请求被分析，结果可以列出并下载为 collapsed stacks 和 SVG"""
+        response = self.client.get('/api/projects', headers={'X-Profile': TOKEN})
+        self.assertEqual(response.status_code, 200)
+        profile_id = response.headers['X-Profile-Id']
+
+        listing = self.list_profiles().get_json()
+        profile, = listing['profiles']
+        self.assertEqual((profile['id'], profile['endpoint'], profile['trigger']), (profile_id, 'get_projects', 'header'))
+        self.assertGreater(profile['samples'], 0)
+        self.assertGreaterEqual(profile['duration_ms'], 50)
+
+        folded = self.client.get(profile['folded_url'], headers={'X-Profile-Token': TOKEN})
+        stacks = profiling.parse_collapsed(folded.get_data(as_text=True))
+        self.assertEqual(sum(stacks.values()), profile['samples'])
+        self.assertTrue(any('get_projects' in stack and 'slow_project_listing' in stack for stack in stacks))
+
+        svg = self.client.get(profile['flamegraph_url'], headers={'X-Profile-Token': TOKEN})
+        self.assertEqual(svg.mimetype, 'image/svg+xml')
+        self.assertIn('slow_project_listing', svg.get_data(as_text=True))
+
+    def test_invalid_token_and_disabled(self):
+        """测试令牌错误时不分析、接口返回 403；未设置令牌时接口返回 404"""
+        response = self.client.get('/api/projects', headers={'X-Profile': 'wrong'})
+        self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertEqual(os.listdir(self.temp_dir), [])
+        self.assertEqual(self.list_profiles('wrong').status_code, 403)
+        self.assertEqual(self.client.get('/api/profiles').status_code, 403)
+        self.assertEqual(self.client.get('/api/profiles/../main', headers={'X-Profile-Token': TOKEN}).status_code, 404)
+
+        with patch.object(main, 'PROFILING_TOKEN', None):
+            response = self.client.get('/api/projects', headers={'X-Profile': TOKEN})
+            self.assertNotIn('X-Profile-Id', response.headers)
+            self.assertEqual(self.list_profiles().status_code, 404)
+
+    def test_sampling_and_retention(self):
+        """测试按抽样率只分析配置的路由，超过保留数量时删除最旧的结果"""
+        with patch.object(main, 'PROFILING_SAMPLE_RATE', 1.0), patch.object(main, 'PROFILES_MAX_FILES', 2):
+            self.assertNotIn('X-Profile-Id', self.client.get('/api/csrf-token').headers)
+            profile_ids = []
+            for _ in range(3):
+                profile_ids.append(self.client.get('/api/projects').headers['X-Profile-Id'])
+                time.sleep(1.01)  # 分析ID精确到秒，保证按名称排序即按时间排序
+
+        listing = self.list_profiles().get_json()['profiles']
+        self.assertEqual([profile['id'] for profile in listing], profile_ids[:0:-1])
+        self.assertEqual([profile['trigger'] for profile in listing], ['sampled', 'sampled'])
+        self.assertEqual(len(os.listdir(self.temp_dir)), 4)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨进程共享缓存测试套件
+测试共享缓存的读写、环形缓冲区淘汰、多进程可见性，以及项目列表缓存的跨进程失效
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+import shared_cache
+
+
+def write_in_child(cache, key, value):
+    """在子进程中写入条目并递增计数器"""
+    cache.set(key, value, b'text/plain')
+    cache.incr(0)
+
+
+def invalidate_in_child():
+    """在子进程中使项目列表缓存失效"""
+    main.invalidate_projects_cache()
+
+
+@unittest.skipUnless(shared_cache.fcntl, '当前平台不支持共享缓存')
+class TestSharedMemoryCache(unittest.TestCase):
+    """测试跨进程共享缓存"""
+
+    def setUp(self):
+        """测试前设置：在临时目录中创建共享缓存文件"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'cache')
+        self.cache = shared_cache.open_cache(self.path, 64 * 1024, 16)
+        self.fork = multiprocessing.get_context('fork')
+
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+
+    def run_child(self, target, *args):
+        process = self.fork.Process(target=target, args=args)
+        process.start()
+        process.join(timeout=10)
+        self.assertEqual(process.exitcode, 0)
+
+    def test_set_get_delete_clear(self):
+        """测试基本读写、删除和清空"""
+        self.assertTrue(self.cache.shared)
+        self.assertIsNone(self.cache.get('missing'))
+
+        self.cache.set('a', b'alpha', b'text/css', stored_at=123.0)
+        self.assertEqual(self.cache.get('a'), (b'alpha', b'text/css', 123.0))
+        self.assertIn('a', self.cache)
+        self.cache.set('a', b'alpha-2', b'text/css')
+        self.assertEqual(self.cache.get('a')[0], b'alpha-2')
+        self.assertEqual(len(self.cache), 1)
+
+        self.cache.set('b', b'beta')
+        self.cache.delete('a')
+        self.assertNotIn('a', self.cache)
+
+        self.cache.incr(0)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.counter(0), 1)
+
+    def test_ring_buffer_evicts_oldest(self):
+        """测试数据区写满后最旧的条目被覆盖，过大的条目不缓存"""
+        value = b'x' * 4000
+        for i in range(40):
+            self.cache.set(f'key{i}', value)
+
+        self.assertIsNone(self.cache.get('key0'))
+        self.assertEqual(self.cache.get('key39')[0], value)
+        stats = self.cache.stats()
+        self.assertLessEqual(stats['bytes'], stats['capacity_bytes'])
+        self.assertGreater(stats['items'], 5)
+
+        self.assertFalse(self.cache.set('huge', b'x' * (self.cache.data_size // 2)))
+        self.assertNotIn('huge', self.cache)
+
+    def test_max_items_limit(self):
+        """测试条目数不超过 max_items（与进程内缓存含义相同），超出时淘汰最旧的条目"""
+        for i in range(40):
+            self.cache.set(f'key{i}', b'small')
+        stats = self.cache.stats()
+        self.assertEqual(stats['max_items'], 16)
+        self.assertEqual(stats['items'], 16)
+        self.assertIsNone(self.cache.get('key23'))
+        self.assertEqual(self.cache.get('key39')[0], b'small')
+
+        # 删除和清空后计数同步减少，之后可以重新写满
+        self.cache.delete('key39')
+        self.assertEqual(len(self.cache), 15)
+        self.cache.clear()
+        for i in range(16):
+            self.cache.set(f'new{i}', b'small')
+        self.assertEqual(len(self.cache), 16)
+        self.assertEqual(self.cache.get('new0')[0], b'small')
+
+    def test_visible_across_processes(self):
+        """测试子进程写入的条目和计数器对父进程立即可见，反之亦然"""
+        self.cache.set('from-parent', b'parent')
+        self.run_child(write_in_child, self.cache, 'from-child', b'child')
+
+        self.assertEqual(self.cache.get('from-child')[:2], (b'child', b'text/plain'))
+        self.assertEqual(self.cache.counter(0), 1)
+
+        # 另一个进程（这里用新打开的实例模拟）看到同一份数据，并沿用已有文件的布局
+        other = shared_cache.open_cache(self.path, 1024 * 1024, 1000)
+        self.assertEqual(other.data_size, self.cache.data_size)
+        self.assertEqual(other.max_items, 16)
+        self.assertEqual(other.get('from-parent')[0], b'parent')
+        other.clear()
+        self.assertIsNone(self.cache.get('from-parent'))
+
+    def test_projects_cache_invalidated_across_processes(self):
+        """测试一个进程使项目列表缓存失效后，其它进程不再使用旧列表"""
+        with patch.object(main, '_cdn_memory_cache', self.cache):
+            main.invalidate_projects_cache()
+            main.get_all_projects()
+            self.assertEqual(main.PROJECTS_CACHE['generation'], self.cache.counter(main.PROJECTS_CACHE_COUNTER))
+            cached_at = main.PROJECTS_CACHE['timestamp']
+
+            self.run_child(invalidate_in_child)
+
+            # 本进程的列表仍在，但代数已过期，下次读取会重新生成
+            self.assertEqual(main.PROJECTS_CACHE['timestamp'], cached_at)
+            self.assertNotEqual(main.PROJECTS_CACHE['generation'], self.cache.counter(main.PROJECTS_CACHE_COUNTER))
+            main.get_all_projects()
+            self.assertEqual(main.PROJECTS_CACHE['generation'], self.cache.counter(main.PROJECTS_CACHE_COUNTER))
+        main.invalidate_projects_cache()
+
+    def test_remove_cache_files(self):
+        """测试删除共享缓存文件和锁文件"""
+        self.cache.set('a', b'alpha')
+        self.assertTrue(os.path.exists(self.path + '.lock'))
+        self.assertTrue(shared_cache.remove_cache(self.path))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.lock'))
+        self.assertFalse(shared_cache.remove_cache(self.path))
+
+    def test_local_fallback(self):
+        """测试未配置共享文件时退化为进程内 LRU 缓存"""
+        cache = shared_cache.open_cache(None, 64 * 1024, 2)
+        self.assertFalse(cache.shared)
+        cache.set('a', b'1')
+        cache.set('b', b'2')
+        cache.get('a')
+        cache.set('c', b'3')
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.incr(0), 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
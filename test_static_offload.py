@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态文件发送卸载测试套件
+用一个模拟 nginx / Apache 行为的 WSGI 中间件测试 X-Accel-Redirect 与 X-Sendfile 模式
+"""
+
+import os
+import sys
+import gzip
+import unittest
+import urllib.parse
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from main import app
+from test_support import TempStorageTestCase
+
+HTML_CONTENT = '<html><head><title>卸载测试</title></head><body>' + '<p>内容</p>' * 200 + '</body></html>'
+
+
+class FrontServerStandIn:
+    """
+    前端服务器替身：拦截 X-Accel-Redirect / X-Sendfile 响应，按头信息读取文件作为响应体
+    """
+
+    def __init__(self, wsgi_app, static_root):
+        self.wsgi_app = wsgi_app
+        self.static_root = static_root
+        self.offloaded = []
+
+    def __call__(self, environ, start_response):
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            return lambda data: None
+
+        body = b''.join(self.wsgi_app(environ, capture))
+        headers = dict(captured['headers'])
+        file_path = None
+        if 'X-Accel-Redirect' in headers:
+            location = headers.pop('X-Accel-Redirect')
+            relative_path = urllib.parse.unquote(location[len(main.STATIC_OFFLOAD_PREFIX):])
+            file_path = os.path.join(self.static_root, relative_path)
+        elif 'X-Sendfile' in headers:
+            file_path = headers.pop('X-Sendfile')
+
+        if file_path is not None:
+            self.offloaded.append(file_path)
+            with open(file_path, 'rb') as f:
+                body = f.read()
+            headers['Content-Length'] = str(len(body))
+        start_response(captured['status'], list(headers.items()))
+        return [body]
+
+
+class TestStaticOffload(TempStorageTestCase):
+    """测试静态文件发送卸载"""
+
+    def setUp(self):
+        """测试前设置：在应用前面挂上前端服务器替身，并准备测试项目"""
+        super().setUp()
+        # 测试中会打开 USE_X_SENDFILE，结束后恢复
+        self.patch_config(USE_X_SENDFILE=False)
+        self.front_server = FrontServerStandIn(app.wsgi_app, self.static_dir)
+        self.addCleanup(setattr, app, 'wsgi_app', app.wsgi_app)
+        app.wsgi_app = self.front_server
+
+        # 一个压缩存储的新项目和一个带资源文件的旧项目
+        self.project_dir = main.get_shard_path('shard001')
+        os.makedirs(self.project_dir)
+        with open(os.path.join(self.project_dir, 'index.html.gz'), 'wb') as f:
+            f.write(gzip.compress(HTML_CONTENT.encode('utf-8'), mtime=0))
+        legacy_dir = os.path.join(self.static_dir, 'legacy01')
+        os.makedirs(legacy_dir)
+        with open(os.path.join(legacy_dir, 'style.css'), 'w') as f:
+            f.write('body { margin: 0; }')
+
+    def get(self, path, accept_encoding='gzip'):
+        response = self.client.get(path, headers={'Accept-Encoding': accept_encoding})
+        data = response.get_data()
+        response.close()
+        return response, data
+
+    def assert_security_headers(self, response):
+        for header, value in main.PREVIEW_SECURITY_HEADERS:
+            self.assertEqual(response.headers[header], value)
+
+    def test_x_accel_redirect(self):
+        """测试 X-Accel-Redirect 模式下由前端服务器发送预压缩文件"""
+        with patch.object(main, 'STATIC_OFFLOAD_MODE', 'x-accel'):
+            response, data = self.get('/static/shard001/index.html')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.front_server.offloaded, [os.path.join(self.project_dir, 'index.html.gz')])
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(response.mimetype, 'text/html')
+            self.assert_security_headers(response)
+            self.assertEqual(gzip.decompress(data).decode('utf-8'), HTML_CONTENT)
+            self.assertIn('shard001', main.project_access_log)
+
+            response, data = self.get('/static/legacy01/style.css')
+            self.assertEqual(data, b'body { margin: 0; }')
+            self.assertEqual(response.mimetype, 'text/css')
+            self.assert_security_headers(response)
+
+            # 不存在的文件和目录遍历在应用内直接返回 404，不会交给前端服务器
+            self.assertEqual(self.get('/static/legacy01/missing.js')[0].status_code, 404)
+            self.assertEqual(self.get('/static/legacy01/..%2F..%2Fproject_index.db')[0].status_code, 404)
+            self.assertEqual(len(self.front_server.offloaded), 2)
+
+    def test_x_sendfile(self):
+        """测试 X-Sendfile 模式下返回文件的绝对路径"""
+        with patch.object(main, 'STATIC_OFFLOAD_MODE', 'x-sendfile'):
+            app.config['USE_X_SENDFILE'] = True
+            response, data = self.get('/static/shard001/index.html')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(self.front_server.offloaded, [os.path.abspath(os.path.join(self.project_dir, 'index.html.gz'))])
+        self.assertEqual(gzip.decompress(data).decode('utf-8'), HTML_CONTENT)
+        self.assert_security_headers(response)
+
+    def test_identity_client_not_offloaded(self):
+        """测试只有压缩版本而客户端不支持压缩时仍由应用解压发送"""
+        with patch.object(main, 'STATIC_OFFLOAD_MODE', 'x-accel'):
+            response, data = self.get('/static/shard001/index.html', accept_encoding='identity')
+        self.assertEqual(self.front_server.offloaded, [])
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(data.decode('utf-8'), HTML_CONTENT)
+        self.assert_security_headers(response)
+
+    def test_relative_upload_folder_outside_app_root(self):
+        """测试工作目录不是代码目录、上传目录为相对路径时仍能直接发送文件"""
+        original_cwd = os.getcwd()
+        os.chdir(self.temp_dir)
+        self.addCleanup(os.chdir, original_cwd)
+        app.config['UPLOAD_FOLDER'] = 'static'
+
+        response, data = self.get('/static/shard001/index.html')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(gzip.decompress(data).decode('utf-8'), HTML_CONTENT)
+        response, data = self.get('/static/legacy01/style.css')
+        self.assertEqual(data, b'body { margin: 0; }')
+
+    def test_security_headers_are_frozen(self):
+        """测试安全头在导入时计算好且不可变"""
+        self.assertIsInstance(main.PREVIEW_SECURITY_HEADERS, tuple)
+        response, _ = self.get('/static/legacy01/style.css')
+        self.assertEqual(self.front_server.offloaded, [])
+        self.assert_security_headers(response)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
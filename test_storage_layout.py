@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+项目存储布局测试套件
+测试分片目录布局、旧布局兼容以及在线迁移工具
+"""
+
+import os
+import sys
+import unittest
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from migrate_storage import migrate_legacy_projects
+from test_support import TempStorageTestCase, wait_for_pipeline
+
+HTML_CONTENT = '<html><head><title>分片测试</title></head><body><p>内容</p></body></html>'
+
+
+class TestShardedStorage(TempStorageTestCase):
+    """测试分片存储布局"""
+
+    def setUp(self):
+        """测试前设置：获取上传用的 CSRF 令牌"""
+        super().setUp()
+        self.csrf_token = self.fetch_csrf_token()
+
+    def create_legacy_project(self, project_id):
+        project_dir = os.path.join(self.static_dir, project_id)
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(HTML_CONTENT)
+        return project_dir
+
+    def test_upload_uses_sharded_layout(self):
+        """测试新上传的项目存放在分片目录，公开URL不变"""
+        response = self.client.post(
+            '/upload',
+            data={'html_content': HTML_CONTENT},
+            headers={'X-CSRFToken': self.csrf_token}
+        )
+        self.assertEqual(response.status_code, 200)
+        project_id = response.json['project_id']
+        self.assertTrue(response.json['url'].endswith(f'/static/{project_id}/index.html'))
+
+        sharded_path = main.get_shard_path(project_id)
+        self.assertTrue(main.has_project_html(sharded_path))
+        self.assertFalse(os.path.exists(os.path.join(self.static_dir, project_id)))
+
+        response = self.client.get(f'/static/{project_id}/index.html')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('分片测试'.encode('utf-8'), response.data)
+        response.close()
+
+        wait_for_pipeline(project_id)
+        self.assertEqual([p['id'] for p in main.get_all_projects()], [project_id])
+
+        response = self.client.delete(f'/api/projects/{project_id}', headers={'X-CSRFToken': self.csrf_token})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(sharded_path))
+
+    def test_legacy_projects_and_reserved_dirs(self):
+        """测试旧布局项目仍可访问，保留目录不会被当作项目"""
+        self.create_legacy_project('legacy01')
+        os.makedirs(os.path.join(self.static_dir, 'cdn_cache'))
+
+        response = self.client.get('/static/legacy01/index.html')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+        self.assertEqual([p['id'] for p in main.get_all_projects()], ['legacy01'])
+        self.assertEqual(self.client.get('/static/cdn_cache/x.css').status_code, 404)
+        response = self.client.delete('/api/projects/cdn_cache', headers={'X-CSRFToken': self.csrf_token})
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(os.path.isdir(os.path.join(self.static_dir, 'cdn_cache')))
+
+    def test_migrate_legacy_projects(self):
+        """测试迁移工具把旧项目移动到分片目录，且可重复运行"""
+        for project_id in ('legacy01', 'legacy02'):
+            self.create_legacy_project(project_id)
+
+        result = migrate_legacy_projects()
+        self.assertEqual(result, {'migrated': 2, 'skipped': 0, 'failed': 0})
+        self.assertEqual(sorted(os.listdir(self.static_dir)), ['shards'])
+        self.assertEqual(migrate_legacy_projects()['migrated'], 0)
+
+        for project_id in ('legacy01', 'legacy02'):
+            self.assertEqual(main.get_project_dir(project_id), main.get_shard_path(project_id))
+            response = self.client.get(f'/static/{project_id}/index.html')
+            self.assertEqual(response.status_code, 200)
+            response.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
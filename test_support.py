@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试公共设施
+提供使用临时目录存放项目和索引的测试基类，以及等待上传后处理任务结束的辅助函数
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from main import app, limiter
+
+
+def wait_for_pipeline(project_id, timeout=10):
+    """等待项目的后处理任务结束，返回任务状态"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = main.get_background_job('upload', project_id)
+        if job and job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'后处理任务未在 {timeout} 秒内结束: {project_id}')
+
+
+class TempStorageTestCase(unittest.TestCase):
+    """
+    项目目录和项目索引都指向临时目录的测试基类
+    子类的 setUp 先调用父类，再只准备本测试需要的内容
+    """
+
+    def setUp(self):
+        """测试前设置：使用临时目录存放项目和索引，关闭限流"""
+        self.temp_dir = tempfile.mkdtemp()
+        # 清理按注册的逆序执行，临时目录最后删除
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.static_dir = os.path.join(self.temp_dir, 'static')
+        os.makedirs(self.static_dir)
+
+        self.patch_config(
+            UPLOAD_FOLDER=self.static_dir,
+            PROJECT_INDEX_PATH=os.path.join(self.temp_dir, 'project_index.db'),
+            TESTING=True,
+        )
+        limiter.enabled = False
+        self.addCleanup(setattr, limiter, 'enabled', True)
+
+        main.invalidate_projects_cache()
+        main.project_access_log.clear()
+        self.addCleanup(main.invalidate_projects_cache)
+        self.addCleanup(main.project_access_log.clear)
+
+        self.client = app.test_client()
+
+    def patch_config(self, **values):
+        """修改 app.config，测试结束后恢复原值"""
+        for key, value in values.items():
+            self.addCleanup(app.config.__setitem__, key, app.config.get(key))
+            app.config[key] = value
+
+    def fetch_csrf_token(self):
+        return self.client.get('/api/csrf-token').json['csrf_token']
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+缩略图测试套件
+测试缩略图上传（base64 JSON、二进制请求体、multipart）后的校验、缩放、WebP 转码，
+以及项目列表中带版本号的缩略图地址、srcset、整页缩略图拼图和缩略图生成租约
+"""
+
+import io
+import os
+import sys
+import time
+import base64
+import unittest
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from main import app
+from test_support import TempStorageTestCase
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def make_image(width, height, image_format='PNG'):
+    """生成一张渐变测试图片，返回编码后的字节"""
+    image = Image.new('RGB', (width, height))
+    image.putdata([(x % 256, y % 256, (x + y) % 256) for y in range(height) for x in range(width)])
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def to_data_url(image_bytes, mime='image/png'):
+    return f"data:{mime};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+
+
+class TestThumbnailNormalization(TempStorageTestCase):
+    """测试缩略图规范化"""
+
+    def setUp(self):
+        """测试前设置：获取 CSRF 令牌并创建一个测试项目"""
+        super().setUp()
+        self.addCleanup(main.thumbnail_sprite_cache.clear)
+        # 先等后台拼图任务结束，再清空缓存
+        self.addCleanup(lambda: main.thumbnail_sprite_executor.submit(lambda: None).result())
+        self.csrf_token = self.fetch_csrf_token()
+
+        self.project_dir = main.get_shard_path('thumb001')
+        os.makedirs(self.project_dir)
+        with open(os.path.join(self.project_dir, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write('<html><head><title>缩略图</title></head><body></body></html>')
+
+    def upload(self, data_url):
+        return self.client.post(
+            '/api/projects/thumb001/upload-thumbnail',
+            json={'thumbnail': data_url},
+            headers={'X-CSRFToken': self.csrf_token}
+        )
+
+    def thumbnail_files(self):
+        return sorted(name for name in os.listdir(self.project_dir) if name.startswith(('thumbnail', '.thumbnail')))
+
+    @unittest.skipUnless(Image, '未安装 Pillow')
+    def test_downscales_to_webp_and_png(self):
+        """测试大图被缩放为多个宽度的 WebP 和 PNG 兜底"""
+        response = self.upload(to_data_url(make_image(1200, 900, 'JPEG'), 'image/jpeg'))
+        self.assertEqual(response.status_code, 200, response.json)
+        self.assertEqual(self.thumbnail_files(), ['thumbnail-320.webp', 'thumbnail-640.webp', 'thumbnail.png'])
+
+        for name, size in (('thumbnail-320.webp', (320, 240)), ('thumbnail-640.webp', (640, 480)),
+                           ('thumbnail.png', (640, 480))):
+            with Image.open(os.path.join(self.project_dir, name)) as image:
+                self.assertEqual(image.size, size)
+        self.assertLess(os.path.getsize(os.path.join(self.project_dir, 'thumbnail-320.webp')), 30 * 1024)
+
+        srcset = response.json['thumbnail_srcset']
+        version = response.json['thumbnail_version']
+        self.assertIn(f'/static/thumb001/thumbnail-320.webp?v={version} 320w', srcset)
+        self.assertIn(f'/static/thumb001/thumbnail-640.webp?v={version} 640w', srcset)
+        self.assertEqual(main.get_all_projects()[0]['thumbnail_srcset'], srcset)
+
+    @unittest.skipUnless(Image, '未安装 Pillow')
+    def test_small_image_is_not_upscaled(self):
+        """测试小于目标宽度的图片保持原尺寸"""
+        self.assertEqual(self.upload(to_data_url(make_image(200, 100))).status_code, 200)
+        with Image.open(os.path.join(self.project_dir, 'thumbnail-640.webp')) as image:
+            self.assertEqual(image.size, (200, 100))
+
+    @unittest.skipUnless(Image, '未安装 Pillow')
+    def test_rejects_invalid_images(self):
+        """测试非图片、损坏的图片和像素过多的图片被拒绝，且不留下临时文件"""
+        response = self.upload(to_data_url(b'<svg xmlns="http://www.w3.org/2000/svg"></svg>'))
+        self.assertEqual(response.status_code, 400)
+
+        truncated = make_image(400, 300)[:200]
+        self.assertEqual(self.upload(to_data_url(truncated)).status_code, 400)
+
+        with patch.object(main, 'THUMBNAIL_MAX_PIXELS', 1000):
+            self.assertEqual(self.upload(to_data_url(make_image(100, 100))).status_code, 400)
+
+        with patch.object(main, 'THUMBNAIL_MAX_UPLOAD_SIZE', 100):
+            self.assertEqual(self.upload(to_data_url(make_image(100, 100))).status_code, 413)
+
+        self.assertEqual(self.thumbnail_files(), [])
+        self.assertIsNone(main.get_all_projects()[0]['thumbnail_srcset'])
+
+    def test_without_pillow_keeps_validated_original(self):
+        """测试未安装 Pillow 时只接受 PNG，校验格式后原样保存"""
+        png_bytes = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+        with patch.object(main, 'PILLOW_AVAILABLE', False):
+            self.assertEqual(self.upload(to_data_url(png_bytes)).status_code, 200)
+            self.assertEqual(self.upload(to_data_url(b'GIF89a' + b'\x00' * 64)).status_code, 400)
+            # 无法转码时 JPEG/WebP 被拒绝，不会以 image/png 的名义保存
+            jpeg_bytes = b'\xff\xd8\xff\xe0' + b'\x00' * 64
+            self.assertEqual(self.upload(to_data_url(jpeg_bytes, 'image/jpeg')).status_code, 400)
+            webp_bytes = b'RIFF\x00\x00\x00\x00WEBPVP8 ' + b'\x00' * 64
+            self.assertEqual(self.upload_binary(webp_bytes, 'image/webp').status_code, 400)
+
+        self.assertEqual(self.thumbnail_files(), ['thumbnail.png'])
+        with open(os.path.join(self.project_dir, 'thumbnail.png'), 'rb') as f:
+            self.assertEqual(f.read(), png_bytes)
+
+    def upload_binary(self, body, content_type='image/png'):
+        return self.client.post(
+            '/api/projects/thumb001/upload-thumbnail',
+            data=body,
+            content_type=content_type,
+            headers={'X-CSRFToken': self.csrf_token}
+        )
+
+    def test_binary_body_upload(self):
+        """测试直接以图片二进制作为请求体上传"""
+        png_bytes = make_image(300, 200) if Image else b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+        response = self.upload_binary(png_bytes)
+        self.assertEqual(response.status_code, 200, response.json)
+        self.assertIn('thumbnail.png', self.thumbnail_files())
+        self.assertFalse(any(name.endswith('.upload') for name in os.listdir(self.project_dir)))
+
+    def test_multipart_upload(self):
+        """测试以 multipart 文件字段上传"""
+        png_bytes = make_image(300, 200) if Image else b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+        response = self.client.post(
+            '/api/projects/thumb001/upload-thumbnail',
+            data={'thumbnail': (io.BytesIO(png_bytes), 'thumbnail.png')},
+            content_type='multipart/form-data',
+            headers={'X-CSRFToken': self.csrf_token}
+        )
+        self.assertEqual(response.status_code, 200, response.json)
+        self.assertIn('thumbnail.png', self.thumbnail_files())
+
+        response = self.client.post(
+            '/api/projects/thumb001/upload-thumbnail',
+            data={'other': (io.BytesIO(png_bytes), 'thumbnail.png')},
+            content_type='multipart/form-data',
+            headers={'X-CSRFToken': self.csrf_token}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_multipart_upload_above_request_limit(self):
+        """测试 multipart 上传的大小上限是 THUMBNAIL_MAX_UPLOAD_SIZE，而不是普通接口的 MAX_CONTENT_LENGTH"""
+        png_bytes = b'\x89PNG\r\n\x1a\n' + b'\x00' * (main.MAX_CONTENT_LENGTH + 1024)
+        self.assertLess(len(png_bytes), main.THUMBNAIL_MAX_UPLOAD_SIZE)
+
+        def post_multipart(body):
+            return self.client.post(
+                '/api/projects/thumb001/upload-thumbnail',
+                data={'thumbnail': (io.BytesIO(body), 'thumbnail.png')},
+                content_type='multipart/form-data',
+                headers={'X-CSRFToken': self.csrf_token}
+            )
+
+        with patch.object(main, 'PILLOW_AVAILABLE', False):
+            response = post_multipart(png_bytes)
+            self.assertEqual(response.status_code, 200, response.json)
+            with patch.object(main, 'THUMBNAIL_MAX_UPLOAD_SIZE', main.MAX_CONTENT_LENGTH):
+                self.assertEqual(post_multipart(png_bytes).status_code, 413)
+        self.assertEqual(os.path.getsize(os.path.join(self.project_dir, 'thumbnail.png')), len(png_bytes))
+
+    def test_binary_upload_rejected_early(self):
+        """测试二进制上传在魔数不符或超过大小上限时被拒绝，且不读取整个请求体"""
+        class CountingStream(io.BytesIO):
+            bytes_read = 0
+
+            def read(self, size=-1):
+                data = super().read(size)
+                CountingStream.bytes_read += len(data)
+                return data
+
+        body = b'<html>' + b'x' * (1024 * 1024)
+        with app.test_request_context(data=body, content_type='image/png'):
+            stream = CountingStream(body)
+            with self.assertRaises(main.InvalidThumbnailError) as ctx:
+                main.save_thumbnail_from_stream('thumb001', stream)
+        self.assertEqual(ctx.exception.status_code, 400)
+        self.assertLessEqual(CountingStream.bytes_read, main.THUMBNAIL_STREAM_CHUNK_SIZE)
+
+        oversized = b'\x89PNG\r\n\x1a\n' + b'\x00' * 2048
+        with patch.object(main, 'THUMBNAIL_MAX_UPLOAD_SIZE', 1024):
+            # 声明的长度超过上限时直接拒绝
+            self.assertEqual(self.upload_binary(oversized).status_code, 413)
+
+            # 分块传输没有 Content-Length 时在写入过程中拒绝
+            with patch.object(main, 'THUMBNAIL_STREAM_CHUNK_SIZE', 256):
+                with self.assertRaises(main.InvalidThumbnailError) as ctx:
+                    main.save_thumbnail_from_stream('thumb001', io.BytesIO(oversized))
+            self.assertEqual(ctx.exception.status_code, 413)
+
+        self.assertEqual(self.upload_binary(b'GIF89a' + b'\x00' * 64).status_code, 400)
+        self.assertEqual(self.thumbnail_files(), [])
+
+    def test_versioned_thumbnail_urls(self):
+        """测试项目列表返回带版本号的缩略图地址，重新上传后版本号变化，且可长期缓存"""
+        project = main.get_all_projects()[0]
+        self.assertIsNone(project['thumbnail_version'])
+        self.assertNotIn('?', project['thumbnail'])
+
+        png_bytes = make_image(300, 200) if Image else b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+        response = self.upload_binary(png_bytes)
+        version = response.json['thumbnail_version']
+        self.assertTrue(version)
+        self.assertTrue(response.json['thumbnail_url'].endswith(f'/static/thumb001/thumbnail.png?v={version}'))
+        self.assertEqual(main.get_all_projects()[0]['thumbnail'], response.json['thumbnail_url'])
+
+        response = self.client.get(f'/static/thumb001/thumbnail.png?v={version}')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        response.close()
+        response = self.client.get('/static/thumb001/thumbnail.png')
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+        response.close()
+
+        response = self.client.get('/static/thumb001/thumbnail.png?v=0123abcd')
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+        response.close()
+
+        os.utime(os.path.join(self.project_dir, 'thumbnail.png'), ns=(1, 1))
+        self.assertNotEqual(main.get_thumbnail_version(self.project_dir), version)
+        # 缩略图更新后，旧版本号的地址不能再被长期缓存
+        response = self.client.get(f'/static/thumb001/thumbnail.png?v={version}')
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+        response.close()
+
+    def wait_for_sprite(self, timeout=30):
+        """等待后台生成本页拼图，返回项目列表中的拼图信息"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            sprite_info = self.client.get('/api/projects?page=1&per_page=20').json['thumbnail_sprite']
+            if sprite_info:
+                return sprite_info
+            time.sleep(0.05)
+        raise AssertionError(f'缩略图拼图未在 {timeout} 秒内生成')
+
+    @unittest.skipUnless(Image, '未安装 Pillow')
+    def test_thumbnail_sprite_for_page(self):
+        """测试一页项目的缩略图合成一张拼图，坐标与图片一致，内容变化后版本号更新"""
+        for project_id, (width, height) in (('thumb002', (640, 480)), ('thumb003', (320, 1000))):
+            project_dir = main.get_shard_path(project_id)
+            os.makedirs(project_dir)
+            with open(os.path.join(project_dir, 'index.html'), 'w', encoding='utf-8') as f:
+                f.write('<html><head><title>缩略图</title></head><body></body></html>')
+            with open(os.path.join(project_dir, 'thumbnail.png'), 'wb') as f:
+                f.write(make_image(width, height))
+        main.invalidate_projects_cache()
+
+        # 列表接口不等待生成：第一次返回 None（前端逐个加载缩略图），拼图在后台生成
+        self.assertIsNone(self.client.get('/api/projects?page=1&per_page=20').json['thumbnail_sprite'])
+        sprite_info = self.wait_for_sprite()
+        self.assertEqual(sorted(sprite_info['tiles']), ['thumb002', 'thumb003'])
+        self.assertEqual(sprite_info['tiles']['thumb002']['width'], 320)
+        self.assertEqual(sprite_info['tiles']['thumb002']['height'], 240)
+        self.assertEqual(sprite_info['tiles']['thumb003']['height'], main.THUMBNAIL_SPRITE_MAX_TILE_HEIGHT)
+
+        response = self.client.get(sprite_info['url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/webp')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        with Image.open(io.BytesIO(response.data)) as sprite:
+            self.assertEqual(sprite.width, 2 * 320)
+
+        # 第二次请求命中服务端缓存，且支持条件请求
+        self.assertEqual(len(main.thumbnail_sprite_cache), 1)
+        response = self.client.get(sprite_info['url'], headers={'If-None-Match': f'"{sprite_info["version"]}"'})
+        self.assertEqual(response.status_code, 304)
+
+        # 本页缩略图变化后旧版本地址失效
+        self.upload_binary(make_image(300, 200))
+        new_info = self.wait_for_sprite()
+        self.assertNotEqual(new_info['version'], sprite_info['version'])
+        self.assertIn('thumb001', new_info['tiles'])
+        self.assertEqual(self.client.get(sprite_info['url']).status_code, 404)
+
+    def claim_lease(self, project_id='thumb001'):
+        return self.client.post(
+            f'/api/projects/{project_id}/thumbnail-lease',
+            headers={'X-CSRFToken': self.csrf_token}
+        )
+
+    def test_thumbnail_generation_lease(self):
+        """测试同一时间只有一个客户端拿到生成租约，其他客户端等待，上传后返回已就绪"""
+        first = self.claim_lease().json
+        self.assertEqual(first['status'], 'granted')
+        second = self.claim_lease().json
+        self.assertEqual(second['status'], 'pending')
+        self.assertGreaterEqual(second['retry_after'], 1)
+
+        # 没有租约的客户端不能上传
+        png_bytes = make_image(300, 200) if Image else b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+        self.assertEqual(self.upload_binary(png_bytes).status_code, 409)
+        self.assertEqual(self.thumbnail_files(), [])
+
+        response = self.client.post(
+            '/api/projects/thumb001/upload-thumbnail',
+            data=png_bytes,
+            content_type='image/png',
+            headers={'X-CSRFToken': self.csrf_token, 'X-Thumbnail-Lease': first['lease_token']}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        ready = self.claim_lease().json
+        self.assertEqual(ready['status'], 'ready')
+        self.assertEqual(ready['thumbnail_url'], response.json['thumbnail_url'])
+        self.assertEqual(self.claim_lease('missing1').status_code, 404)
+
+    def test_thumbnail_lease_expiry_and_release(self):
+        """测试租约过期或被持有者释放后，其他客户端可以接手"""
+        with patch.object(main, 'THUMBNAIL_LEASE_SECONDS', 0):
+            expired = self.claim_lease().json
+        self.assertEqual(expired['status'], 'granted')
+        taken_over = self.claim_lease().json
+        self.assertEqual(taken_over['status'], 'granted')
+        self.assertNotEqual(taken_over['lease_token'], expired['lease_token'])
+
+        # 过期租约的令牌不能释放新租约
+        self.client.delete('/api/projects/thumb001/thumbnail-lease',
+                           headers={'X-CSRFToken': self.csrf_token, 'X-Thumbnail-Lease': expired['lease_token']})
+        self.assertEqual(self.claim_lease().json['status'], 'pending')
+
+        self.client.delete('/api/projects/thumb001/thumbnail-lease',
+                           headers={'X-CSRFToken': self.csrf_token, 'X-Thumbnail-Lease': taken_over['lease_token']})
+        self.assertEqual(self.claim_lease().json['status'], 'granted')
+
+        # 删除项目时一并清除租约
+        main.remove_from_project_index(['thumb001'])
+        rows = main.get_project_index().execute('SELECT COUNT(*) FROM thumbnail_leases').fetchone()[0]
+        self.assertEqual(rows, 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上传后处理流水线测试套件
+测试上传快速返回、后台分阶段处理、重试、背压以及重启后的任务恢复
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import subprocess
+import threading
+import unittest
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from main import app
+from test_support import TempStorageTestCase, wait_for_pipeline
+
+HTML_CONTENT = (
+    '<html><head><title>流水线测试</title>'
+    '<meta name="description" content="后台处理">'
+    '<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/foo@1/foo.css">'
+    '</head><body></body></html>'
+)
+
+
+class TestUploadPipeline(TempStorageTestCase):
+    """测试上传后处理流水线"""
+
+    def setUp(self):
+        """测试前设置：获取上传用的 CSRF 令牌"""
+        super().setUp()
+        self.csrf_token = self.fetch_csrf_token()
+
+    def upload(self, html_content=HTML_CONTENT):
+        return self.client.post(
+            '/upload',
+            data={'html_content': html_content},
+            headers={'X-CSRFToken': self.csrf_token}
+        )
+
+    def test_upload_returns_before_post_processing(self):
+        """测试上传只持久化原始HTML，其余阶段在后台完成"""
+        started = threading.Event()
+        release = threading.Event()
+        original_stage = main.pipeline_stage_rewrite
+
+        def blocked_rewrite(project_id, project_dir, context):
+            started.set()
+            release.wait(10)
+            original_stage(project_id, project_dir, context)
+
+        stages = [('rewrite', blocked_rewrite)] + main.UPLOAD_PIPELINE_STAGES[1:]
+        with patch.object(main, 'UPLOAD_PIPELINE_STAGES', stages):
+            response = self.upload()
+            self.assertEqual(response.status_code, 200)
+            project_id = response.json['project_id']
+            project_dir = main.get_project_dir(project_id)
+            self.assertTrue(started.wait(10))
+
+            # 预览地址立即可用，后处理尚未完成
+            with open(os.path.join(project_dir, 'index.html'), encoding='utf-8') as f:
+                self.assertEqual(f.read(), HTML_CONTENT)
+            self.assertTrue(os.path.exists(os.path.join(project_dir, main.UPLOAD_PENDING_MARKER)))
+            status = self.client.get(response.json['status_url']).json['processing']
+            self.assertEqual(status['status'], 'processing')
+            self.assertEqual(status['stage'], 'rewrite')
+
+            release.set()
+            job = wait_for_pipeline(project_id)
+
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['completed_stages'], ['rewrite', 'metadata', 'index', 'prefetch'])
+        self.assertIn('/proxy?url=https%3A%2F%2Fcdn.jsdelivr.net', main.read_project_html(project_dir))
+        with open(os.path.join(project_dir, 'metadata.json'), encoding='utf-8') as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata['title'], '流水线测试')
+        self.assertEqual(metadata['description'], '后台处理')
+        self.assertFalse(os.path.exists(os.path.join(project_dir, main.UPLOAD_PENDING_MARKER)))
+        self.assertEqual([p['id'] for p in main.get_all_projects()], [project_id])
+
+    def test_stage_retries_then_fails(self):
+        """测试阶段失败时重试，超过次数后标记失败"""
+        calls = []
+
+        def flaky_stage(project_id, project_dir, context):
+            calls.append(project_id)
+            if len(calls) < 2:
+                raise IOError('临时错误')
+
+        def broken_stage(project_id, project_dir, context):
+            raise IOError('永久错误')
+
+        with patch.object(main, 'UPLOAD_PIPELINE_RETRY_DELAY_SECONDS', 0), \
+                patch.object(main, 'UPLOAD_PIPELINE_STAGES', [('flaky', flaky_stage)]):
+            job = wait_for_pipeline(self.upload().json['project_id'])
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['attempts'], 2)
+
+        with patch.object(main, 'UPLOAD_PIPELINE_RETRY_DELAY_SECONDS', 0), \
+                patch.object(main, 'UPLOAD_PIPELINE_STAGES', [('broken', broken_stage)]):
+            project_id = self.upload().json['project_id']
+            job = wait_for_pipeline(project_id)
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['attempts'], main.UPLOAD_PIPELINE_MAX_RETRIES)
+        self.assertEqual(job['error'], 'broken 阶段处理失败')
+
+        # 处理失败不影响预览访问
+        response = self.client.get(f'/static/{project_id}/index.html')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_backpressure_when_queue_full(self):
+        """测试排队名额用尽时上传返回 503 且不写入文件"""
+        with patch.object(main, 'upload_pipeline_slots', threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            response = self.upload()
+            slots.release()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(os.listdir(self.static_dir), [])
+
+    def test_resume_pending_projects(self):
+        """测试重启后恢复带有 .pending 标记的项目"""
+        project_dir = main.get_shard_path('pending1')
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(HTML_CONTENT)
+        open(os.path.join(project_dir, main.UPLOAD_PENDING_MARKER), 'w').close()
+
+        self.assertEqual(main.resume_upload_pipeline(), 1)
+        self.assertEqual(wait_for_pipeline('pending1')['status'], 'completed')
+        self.assertTrue(os.path.exists(os.path.join(project_dir, 'metadata.json')))
+        self.assertEqual(main.resume_upload_pipeline(), 0)
+
+    def test_resume_skips_jobs_owned_by_live_process(self):
+        """测试恢复时跳过所属进程仍在运行的任务（leader 切换时不重复处理），所属进程已退出的任务重新提交"""
+        project_dir = main.get_shard_path('pending4')
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(HTML_CONTENT)
+        open(os.path.join(project_dir, main.UPLOAD_PENDING_MARKER), 'w').close()
+
+        job = {
+            'project_id': 'pending4',
+            'pipeline': 'upload',
+            'pid': os.getpid(),
+            'pid_started_at': main.get_process_start_time(os.getpid()),
+            'status': 'processing',
+        }
+        main.save_background_job('upload', 'pending4', job)
+        self.assertEqual(main.resume_upload_pipeline(), 0)
+
+        # pid 被启动时间不同的进程复用
+        if job['pid_started_at'] is not None:
+            main.save_background_job('upload', 'pending4', dict(job, pid_started_at=job['pid_started_at'] - 1))
+            self.assertEqual(main.resume_upload_pipeline(), 1)
+            self.assertEqual(wait_for_pipeline('pending4')['status'], 'completed')
+            open(os.path.join(project_dir, main.UPLOAD_PENDING_MARKER), 'w').close()
+
+        child = subprocess.Popen([sys.executable, '-c', 'pass'])
+        child.wait()
+        main.save_background_job('upload', 'pending4', dict(job, pid=child.pid, pid_started_at=None))
+        self.assertEqual(main.resume_upload_pipeline(), 1)
+        self.assertEqual(wait_for_pipeline('pending4')['status'], 'completed')
+
+    def test_resume_bulk_project_only_stores_content(self):
+        """测试标记为批量上传的项目恢复时只执行存储阶段，不覆盖发布时写入的元数据"""
+        project_dir = main.get_shard_path('pending3')
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(HTML_CONTENT)
+        with open(os.path.join(project_dir, main.UPLOAD_PENDING_MARKER), 'w') as f:
+            f.write('bulk')
+
+        self.assertEqual(main.resume_upload_pipeline(), 1)
+        job = wait_for_pipeline('pending3')
+        self.assertEqual(job['completed_stages'], ['store'])
+        self.assertFalse(os.path.exists(os.path.join(project_dir, 'metadata.json')))
+
+    def test_status_of_unknown_project(self):
+        """测试查询不存在项目的处理状态返回 404"""
+        self.assertEqual(self.client.get('/api/projects/missing1/status').status_code, 404)
+
+    def test_status_shared_through_index(self):
+        """测试处理状态保存在项目索引中（其它 worker 可以查询），没有记录时以 .pending 标记为准"""
+        project_id = self.upload().json['project_id']
+        wait_for_pipeline(project_id)
+        # 模拟另一个进程：新建连接直接读取索引文件
+        conn = sqlite3.connect(app.config['PROJECT_INDEX_PATH'])
+        try:
+            row = conn.execute(
+                "SELECT status, data FROM background_jobs WHERE kind = 'upload' AND id = ?", (project_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        self.assertEqual(row[0], 'completed')
+        self.assertEqual(json.loads(row[1])['completed_stages'], ['rewrite', 'metadata', 'index', 'prefetch'])
+
+        # 没有处理记录、但带有 .pending 标记的项目（例如其它进程上传后退出）显示为等待处理
+        project_dir = main.get_shard_path('pending2')
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(HTML_CONTENT)
+        marker_file = os.path.join(project_dir, main.UPLOAD_PENDING_MARKER)
+        open(marker_file, 'w').close()
+        self.assertEqual(self.client.get('/api/projects/pending2/status').json['processing']['status'], 'pending')
+        os.remove(marker_file)
+        self.assertEqual(self.client.get('/api/projects/pending2/status').json['processing']['status'], 'completed')
+
+        # 删除项目时一并删除处理记录
+        main.remove_from_project_index([project_id])
+        self.assertIsNone(main.get_background_job('upload', project_id))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生产环境 WSGI 入口
+
+用法:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py 设置 PREVIEW_DEFER_BACKGROUND_SERVICES=true，后台服务（访问记录落盘、过期清理等）
+由每个 worker 在 fork 之后启动；其它 WSGI 服务器加载本模块时直接启动后台服务
+"""
+
+import os
+
+from main import create_app
+
+app = create_app(
+    start_services=os.environ.get('PREVIEW_DEFER_BACKGROUND_SERVICES', 'False').lower() != 'true'
+)